@@ -0,0 +1,86 @@
+"""
+Заглушка OpenAI Chat Completions API для бенчмарков.
+
+Воспроизводит записанные ответы распознавания чеков по кругу с настраиваемой
+задержкой, в том числе в streaming-режиме (SSE), как это делает настоящий API.
+"""
+import json
+import time
+import random
+import asyncio
+import logging
+from itertools import cycle
+from typing import Any, Dict, List
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+class FakeOpenAI:
+    """Локальный /v1/chat/completions, отдающий записанные ответы."""
+
+    def __init__(self, responses: List[str], latency: float = 1.0, jitter: float = 0.0, chunk_size: int = 24):
+        """
+        Args:
+            responses: Записанные тексты ответов модели
+            latency: Время ответа в секундах (в streaming-режиме — время до последнего чанка)
+            jitter: Случайная добавка к latency, от 0 до jitter секунд
+            chunk_size: Размер чанка текста в streaming-режиме
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self._responses = cycle(responses)
+        self.app = web.Application()
+        self.app.router.add_post("/v1/chat/completions", self.handle_completion)
+
+    def _delay(self) -> float:
+        return self.latency + random.uniform(0, self.jitter)
+
+    @staticmethod
+    def _chunk(model: str, delta: Dict[str, Any], finish_reason: Any = None) -> bytes:
+        payload = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
+
+    async def handle_completion(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get("model", "bench")
+        content = next(self._responses)
+        self.requests += 1
+        delay = self._delay()
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            return web.json_response({
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 1000, "completion_tokens": len(content) // 4, "total_tokens": 1000 + len(content) // 4},
+            })
+
+        # Первый токен приходит на середине времени ответа, остальное — равномерно
+        pieces = [content[pos:pos + self.chunk_size] for pos in range(0, len(content), self.chunk_size)]
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(delay / 2)
+        step = delay / 2 / max(1, len(pieces))
+        await response.write(self._chunk(model, {"role": "assistant", "content": ""}))
+        for piece in pieces:
+            await response.write(self._chunk(model, {"content": piece}))
+            await asyncio.sleep(step)
+        await response.write(self._chunk(model, {}, "stop"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
@@ -0,0 +1,126 @@
+"""
+Заглушка Telegram Bot API для бенчмарков.
+
+Отвечает на методы, которые использует обработка фото (getFile, sendMessage,
+editMessageText, setWebhook, setMyCommands и т.д.), отдает файлы по /file/bot<token>/<path>
+и позволяет дождаться итогового сообщения с распознанным чеком.
+"""
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Dict, Optional
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+#: Начала текстов, которыми бот сообщает о неудачной обработке фото
+FAILURE_PREFIXES = ("❌", "🔧", "⏳ Сейчас")
+
+class FakeTelegram:
+    """Локальный Bot API с настраиваемой задержкой ответа."""
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Args:
+            latency: Задержка каждого ответа в секундах
+        """
+        self.latency = latency
+        self.files: Dict[str, bytes] = {}
+        self.calls: Counter = Counter()
+        self._message_id = 1_000_000
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._in_flight = 0
+        self._last_activity = time.monotonic()
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle_method)
+        self.app.router.add_get("/file/bot{token}/{path:.*}", self.handle_file)
+
+    def add_file(self, file_id: str, data: bytes) -> None:
+        """Регистрирует файл, который бот сможет скачать через getFile."""
+        self.files[file_id] = data
+
+    def expect_receipt(self, chat_id: int) -> asyncio.Future:
+        """
+        Возвращает future, который завершится, когда бот отправит в чат итог обработки фото.
+
+        Результат future: True — чек распознан (сообщение с клавиатурой), False — ошибка.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id] = future
+        return future
+
+    async def wait_idle(self, quiet: float = 0.3, timeout: float = 10.0) -> None:
+        """Ждет, пока бот перестанет обращаться к API (например, отправит сообщения после итогового)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self._in_flight and time.monotonic() - self._last_activity >= quiet:
+                return
+            await asyncio.sleep(quiet / 3)
+
+    def _resolve(self, chat_id: int, success: bool) -> None:
+        future = self._waiters.pop(chat_id, None)
+        if future is not None and not future.done():
+            future.set_result(success)
+
+    def _message(self, chat_id: int, text: str, message_id: Optional[int] = None) -> Dict[str, Any]:
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group", "title": "bench"},
+            "from": {"id": 1, "is_bot": True, "first_name": "bench_bot"},
+            "text": text,
+        }
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        self._in_flight += 1
+        try:
+            return await self._handle_method(request)
+        finally:
+            self._in_flight -= 1
+            self._last_activity = time.monotonic()
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getme":
+            result: Any = {"id": 1, "is_bot": True, "first_name": "bench_bot", "username": "bench_bot"}
+        elif method == "getfile":
+            file_id = params["file_id"]
+            data = self.files.get(file_id)
+            if data is None:
+                return web.json_response({"ok": False, "error_code": 400, "description": "Bad Request: file not found"})
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": len(data), "file_path": f"photos/{file_id}.jpg"}
+        elif method in ("sendmessage", "editmessagetext"):
+            chat_id = int(params["chat_id"])
+            text = params.get("text", "")
+            message_id = int(params["message_id"]) if "message_id" in params else None
+            result = self._message(chat_id, text, message_id)
+            if method == "editmessagetext" and "reply_markup" in params:
+                self._resolve(chat_id, True)
+            elif text.startswith(FAILURE_PREFIXES):
+                self._resolve(chat_id, False)
+        elif method == "answerwebappquery":
+            result = {}
+        else:
+            # setWebhook, deleteWebhook, setMyCommands, answerCallbackQuery и т.п.
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        path = request.match_info["path"]
+        file_id = path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+        self.calls["download"] += 1
+        data = self.files.get(file_id)
+        if data is None:
+            raise web.HTTPNotFound()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(body=data, content_type="image/jpeg")
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк обработки фото чека целиком, без сети.
+
+Поднимает локальные заглушки Telegram Bot API и OpenAI, направляет на них бота
+через TELEGRAM_API_URL / OPENAI_BASE_URL и прогоняет фото от N одновременных
+пользователей:
+
+- handler: прямой вызов handlers.photo.process_receipt_photo;
+- webhook: POST апдейтов в приложение из main.create_app() (как на Heroku).
+
+Печатает длительности этапов (download, encode, ocr, parse, render, edit),
+задержку от фото до итогового сообщения и пропускную способность.
+
+Запуск из корня репозитория:
+    python -m benchmarks.photo_pipeline --users 20 --photos 3 --openai-latency 2
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from aiohttp import web, ClientSession
+
+from benchmarks.fake_openai import FakeOpenAI
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.receipt_images import make_receipt_photo
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+BOT_TOKEN = "123456:BENCHMARK"
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк обработки фото чека с локальными заглушками Telegram и OpenAI")
+    parser.add_argument("--mode", choices=("handler", "webhook"), default="handler")
+    parser.add_argument("--users", type=int, default=10, help="Количество одновременных пользователей")
+    parser.add_argument("--photos", type=int, default=2, help="Фото на пользователя (отправляются последовательно)")
+    parser.add_argument("--openai-latency", type=float, default=1.0, help="Время ответа OpenAI, с")
+    parser.add_argument("--openai-jitter", type=float, default=0.2, help="Случайная добавка к времени ответа OpenAI, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.02, help="Время ответа Bot API, с")
+    parser.add_argument("--no-stream", action="store_true", help="Отключить streaming-ответы OpenAI")
+    parser.add_argument("--ocr-concurrency", type=int, help="OCR_MAX_CONCURRENCY для прогона")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Таймаут обработки одного фото, с")
+    parser.add_argument("--json", dest="json_path", help="Сохранить результаты в JSON-файл")
+    parser.add_argument("--verbose", action="store_true", help="Не приглушать логи бота")
+    return parser.parse_args()
+
+async def start_server(app: web.Application) -> Tuple[web.AppRunner, str]:
+    """Запускает приложение на свободном порту 127.0.0.1 и возвращает (runner, base_url)."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+def configure_environment(args: argparse.Namespace, telegram_url: str, openai_url: str, data_dir: str) -> None:
+    """Настраивает окружение до импорта модулей бота (config.settings читает его при импорте)."""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": BOT_TOKEN,
+        "OPENAI_API_KEY": "sk-benchmark",
+        "TELEGRAM_API_URL": telegram_url,
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "WEBAPP_URL": "http://localhost:8000",
+        "RECOGNITION_CACHE_ENABLED": "false",
+        "RECOGNITION_CACHE_PATH": os.path.join(data_dir, "recognition_cache.sqlite3"),
+        "STATE_JOURNAL_DIR": os.path.join(data_dir, "state_journal"),
+        "LEDGER_PATH": os.path.join(data_dir, "ledger.sqlite3"),
+        "OPENAI_STREAMING_ENABLED": "false" if args.no_stream else "true",
+        "OPENAI_HEDGE_ENABLED": "false",
+    })
+    if args.ocr_concurrency:
+        os.environ["OCR_MAX_CONCURRENCY"] = str(args.ocr_concurrency)
+        os.environ["OCR_MAX_QUEUE"] = str(max(50, args.users * 2))
+    if args.mode == "webhook":
+        # С PORT main.py настраивает webhook-режим
+        os.environ["PORT"] = "0"
+    else:
+        os.environ.pop("PORT", None)
+
+def make_photo_update(update_id: int, user_id: int, file_id: str, file_size: int) -> Dict[str, Any]:
+    """Апдейт с фото от пользователя в личном чате."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "photo": [
+                {"file_id": f"{file_id}_s", "file_unique_id": f"{file_id}_s", "width": 240, "height": 320},
+                {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 1706, "file_size": file_size},
+            ],
+        },
+    }
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[int(fraction * (len(ordered) - 1))] if ordered else 0.0
+
+async def run_handler_mode(args, telegram: FakeTelegram, updates: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Вызывает process_receipt_photo напрямую."""
+    import main
+    from aiogram.fsm.context import FSMContext
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from aiogram.types import Update
+    from handlers import photo
+
+    bot = main.create_bot()
+    storage = MemoryStorage()
+    results: List[Dict[str, Any]] = []
+
+    async def user_flow(user_updates: List[Dict[str, Any]]) -> None:
+        for data in user_updates:
+            message = Update.model_validate(data, context={"bot": bot}).message
+            state = FSMContext(storage, StorageKey(bot_id=bot.id, chat_id=message.chat.id, user_id=message.from_user.id))
+            done = telegram.expect_receipt(message.chat.id)
+            started = time.perf_counter()
+            await asyncio.wait_for(photo.process_receipt_photo(message, state), timeout=args.timeout)
+            success = done.done() and done.result()
+            results.append({"latency": time.perf_counter() - started, "success": success})
+
+    try:
+        await asyncio.gather(*(user_flow(user_updates) for user_updates in updates))
+    finally:
+        await bot.session.close()
+    return results
+
+async def run_webhook_mode(args, telegram: FakeTelegram, updates: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Отправляет апдейты в webhook приложения из main.create_app()."""
+    import main
+
+    app = await main.create_app()
+    runner, base_url = await start_server(app)
+    webhook_url = f"{base_url}{main.WEBHOOK_PATH}"
+    results: List[Dict[str, Any]] = []
+
+    async def user_flow(session: ClientSession, user_updates: List[Dict[str, Any]]) -> None:
+        for data in user_updates:
+            chat_id = data["message"]["chat"]["id"]
+            done = telegram.expect_receipt(chat_id)
+            started = time.perf_counter()
+            async with session.post(webhook_url, json=data) as response:
+                await response.read()
+                ack = time.perf_counter() - started
+            try:
+                success = await asyncio.wait_for(done, timeout=args.timeout)
+            except asyncio.TimeoutError:
+                success = False
+            results.append({"latency": time.perf_counter() - started, "ack": ack, "success": success})
+
+    try:
+        async with ClientSession() as session:
+            await asyncio.gather(*(user_flow(session, user_updates) for user_updates in updates))
+        # Итог уже отправлен, но обработчики еще могут дописывать сообщения в фоне
+        await telegram.wait_idle()
+    finally:
+        await runner.cleanup()
+    return results
+
+def print_report(args, results: List[Dict[str, Any]], stages: Dict[str, Dict[str, float]],
+                 elapsed: float, telegram: FakeTelegram, openai_fake: FakeOpenAI) -> Dict[str, Any]:
+    latencies = [result["latency"] for result in results]
+    succeeded = sum(1 for result in results if result["success"])
+    report = {
+        "mode": args.mode,
+        "users": args.users,
+        "photos_per_user": args.photos,
+        "streaming": not args.no_stream,
+        "openai_latency_s": args.openai_latency,
+        "telegram_latency_s": args.telegram_latency,
+        "receipts": len(results),
+        "succeeded": succeeded,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 3) if elapsed else 0.0,
+        "latency_p50_s": round(percentile(latencies, 0.5), 3),
+        "latency_p95_s": round(percentile(latencies, 0.95), 3),
+        "latency_max_s": round(max(latencies, default=0.0), 3),
+        "openai_requests": openai_fake.requests,
+        "telegram_calls": dict(telegram.calls),
+        "stages": stages,
+    }
+    acks = [result["ack"] for result in results if "ack" in result]
+    if acks:
+        report["webhook_ack_p95_ms"] = round(percentile(acks, 0.95) * 1000, 2)
+
+    print(f"\nРежим: {args.mode}, пользователей: {args.users}, фото на пользователя: {args.photos}, "
+          f"streaming: {'да' if report['streaming'] else 'нет'}")
+    print(f"Чеков: {len(results)} (успешно {succeeded}) за {elapsed:.2f} с — {report['throughput_rps']:.2f} чек/с")
+    print(f"Задержка фото → итог: p50 {report['latency_p50_s']:.3f} с, p95 {report['latency_p95_s']:.3f} с, "
+          f"max {report['latency_max_s']:.3f} с")
+    if acks:
+        print(f"Ответ webhook: p95 {report['webhook_ack_p95_ms']:.2f} мс")
+    print(f"Запросов к OpenAI: {openai_fake.requests}, вызовов Bot API: {sum(telegram.calls.values())} {dict(telegram.calls)}")
+    print(f"\n{'Этап':<28}{'count':>8}{'avg, мс':>12}{'p50, мс':>12}{'p95, мс':>12}{'max, мс':>12}")
+    main_stages = ["download", "encode", "ocr", "parse", "render", "edit"]
+    # Дополнительные этапы, например ocr[<модель>:<детализация>] для каждого уровня маршрутизации
+    for name in main_stages + sorted(set(stages) - set(main_stages)):
+        stage = stages.get(name)
+        if stage:
+            print(f"{name:<28}{stage['count']:>8}{stage['avg_ms']:>12.2f}{stage['p50_ms']:>12.2f}"
+                  f"{stage['p95_ms']:>12.2f}{stage['max_ms']:>12.2f}")
+    return report
+
+async def run(args: argparse.Namespace) -> int:
+    responses = json.loads((FIXTURES_DIR / "openai_responses.json").read_text(encoding="utf-8"))
+    telegram = FakeTelegram(latency=args.telegram_latency)
+    openai_fake = FakeOpenAI(responses, latency=args.openai_latency, jitter=args.openai_jitter)
+    telegram_runner, telegram_url = await start_server(telegram.app)
+    openai_runner, openai_url = await start_server(openai_fake.app)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        configure_environment(args, telegram_url, openai_url, data_dir)
+
+        import main  # noqa: F401 — настраивает логирование и связывает обработчики
+        from utils.metrics import pipeline_metrics
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.ERROR)
+
+        # Фото генерируются заранее, чтобы их подготовка не попала в замеры
+        updates: List[List[Dict[str, Any]]] = []
+        update_id = 0
+        for user in range(args.users):
+            user_updates = []
+            for _ in range(args.photos):
+                update_id += 1
+                file_id = f"bench_photo_{update_id}"
+                image = make_receipt_photo(update_id)
+                telegram.add_file(file_id, image)
+                user_updates.append(make_photo_update(update_id, 100_000 + user, file_id, len(image)))
+            updates.append(user_updates)
+
+        pipeline_metrics.reset()
+        started = time.perf_counter()
+        try:
+            if args.mode == "webhook":
+                results = await run_webhook_mode(args, telegram, updates)
+            else:
+                results = await run_handler_mode(args, telegram, updates)
+        finally:
+            elapsed = time.perf_counter() - started
+            await telegram_runner.cleanup()
+            await openai_runner.cleanup()
+
+        report = print_report(args, results, pipeline_metrics.summary(), elapsed, telegram, openai_fake)
+        from services.model_router import model_router
+        report["model_router"] = model_router.stats()
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0 if report["succeeded"] == report["receipts"] else 1
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(parse_args())))
@@ -0,0 +1,37 @@
+"""Генерация синтетических фото чеков для бенчмарков (без бинарных файлов в репозитории)."""
+import io
+import random
+from PIL import Image, ImageDraw, ImageFilter
+
+def make_receipt_photo(seed: int, size=(1280, 1706), quality: int = 87) -> bytes:
+    """
+    Рисует «фото» чека: светлая лента с текстом на темном фоне, как снимок с телефона.
+
+    Разные seed дают разные изображения (и разные ключи кэша распознавания).
+    """
+    rng = random.Random(seed)
+    width, height = size
+    image = Image.new("RGB", size, (rng.randint(40, 80), rng.randint(35, 70), rng.randint(30, 60)))
+    draw = ImageDraw.Draw(image)
+
+    left = rng.randint(width // 6, width // 4)
+    right = width - rng.randint(width // 6, width // 4)
+    top = rng.randint(height // 20, height // 10)
+    bottom = height - rng.randint(height // 20, height // 10)
+    draw.rectangle((left, top, right, bottom), fill=(rng.randint(225, 250),) * 3)
+
+    y = top + 40
+    draw.text((left + 40, y), f"CHECK #{seed:06d}", fill=(20, 20, 20))
+    y += 60
+    while y < bottom - 120:
+        name = "".join(rng.choice("ABCDEFGHKLMNOPRSTUXYZ ") for _ in range(rng.randint(8, 22)))
+        price = f"{rng.randint(50, 2000)}.{rng.randint(0, 99):02d}"
+        draw.text((left + 40, y), name, fill=(30, 30, 30))
+        draw.text((right - 140, y), price, fill=(30, 30, 30))
+        y += rng.randint(36, 48)
+    draw.text((left + 40, bottom - 80), "TOTAL", fill=(10, 10, 10))
+
+    image = image.filter(ImageFilter.GaussianBlur(0.6))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк HTTP-обработчиков веб-приложения.
+
+Поднимает объединенное приложение из webapp_server.init_app() (бот в webhook-режиме
+против заглушки Telegram Bot API), заполняет хранилище чеками и отправляет запросы
+от N одновременных клиентов к страницам и API:
+
+- GET /app/<id>, GET /api/receipt/<id>, POST /api/receipt/<id>/quote, GET /health.
+
+Печатает запросы в секунду и задержку (p50/p95/max) по каждому маршруту, чтобы
+сравнивать нативные обработчики aiohttp (--backend aiohttp) с Flask через WSGI (--backend flask).
+
+Запуск из корня репозитория:
+    python -m benchmarks.webapp_http --backend aiohttp --concurrency 20 --requests 4000
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from aiohttp import ClientSession, TCPConnector
+
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.photo_pipeline import BOT_TOKEN, percentile, start_server
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк HTTP-обработчиков веб-приложения")
+    parser.add_argument("--backend", choices=("aiohttp", "flask"), default="aiohttp")
+    parser.add_argument("--receipts", type=int, default=50, help="Чеков в хранилище")
+    parser.add_argument("--items", type=int, default=12, help="Позиций в каждом чеке")
+    parser.add_argument("--concurrency", type=int, default=20, help="Одновременных клиентов")
+    parser.add_argument("--requests", type=int, default=4000, help="Всего запросов")
+    parser.add_argument("--json", dest="json_path", help="Сохранить результаты в JSON-файл")
+    parser.add_argument("--verbose", action="store_true", help="Не приглушать логи бота")
+    return parser.parse_args()
+
+def configure_environment(args: argparse.Namespace, telegram_url: str, data_dir: str) -> None:
+    """Настраивает окружение до импорта модулей бота (config.settings читает его при импорте)."""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": BOT_TOKEN,
+        "OPENAI_API_KEY": "sk-benchmark",
+        "TELEGRAM_API_URL": telegram_url,
+        "WEBAPP_URL": "http://localhost:8000",
+        "WEBAPP_BACKEND": args.backend,
+        "PORT": "0",
+        "RECOGNITION_CACHE_PATH": os.path.join(data_dir, "recognition_cache.sqlite3"),
+        "STATE_JOURNAL_DIR": os.path.join(data_dir, "state_journal"),
+        "LEDGER_PATH": os.path.join(data_dir, "ledger.sqlite3"),
+    })
+
+def make_receipt(index: int, items: int) -> Dict[str, Any]:
+    """Чек в формате API веб-приложения."""
+    return {
+        "items": [
+            {"description": f"Позиция {index}-{item}", "quantity": 1 + item % 3, "total_amount": 100 + 17 * item}
+            for item in range(items)
+        ],
+        "service_charge_percent": 10,
+    }
+
+def make_requests(receipts: List[int], total: int) -> List[Tuple[str, str, str, Any]]:
+    """Смесь запросов по кругу: (маршрут, метод, путь, тело)."""
+    requests = []
+    for number in range(total):
+        message_id = receipts[number % len(receipts)]
+        kind = number % 4
+        if kind == 0:
+            requests.append(("GET /app/<id>", "GET", f"/app/{message_id}", None))
+        elif kind == 1:
+            requests.append(("GET /api/receipt/<id>", "GET", f"/api/receipt/{message_id}", None))
+        elif kind == 2:
+            selection = {str(item): 1 for item in range(number % 5)}
+            requests.append(("POST /api/receipt/<id>/quote", "POST", f"/api/receipt/{message_id}/quote",
+                             {"user_id": 1000 + number % 7, "selection": selection}))
+        else:
+            requests.append(("GET /health", "GET", "/health", None))
+    return requests
+
+async def run_requests(args: argparse.Namespace, base_url: str,
+                       requests: List[Tuple[str, str, str, Any]]) -> Tuple[Dict[str, List[float]], int, float]:
+    """Отправляет запросы из общей очереди от args.concurrency клиентов."""
+    latencies: Dict[str, List[float]] = {}
+    failures = 0
+    queue = iter(requests)
+
+    async def client(session: ClientSession) -> None:
+        nonlocal failures
+        for route, method, path, body in queue:
+            started = time.perf_counter()
+            async with session.request(method, f"{base_url}{path}", json=body) as response:
+                await response.read()
+                if response.status != 200:
+                    failures += 1
+            latencies.setdefault(route, []).append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with ClientSession(connector=TCPConnector(limit=args.concurrency)) as session:
+        await asyncio.gather(*(client(session) for _ in range(args.concurrency)))
+    return latencies, failures, time.perf_counter() - started
+
+def print_report(args: argparse.Namespace, latencies: Dict[str, List[float]], failures: int,
+                 elapsed: float) -> Dict[str, Any]:
+    total = sum(len(values) for values in latencies.values())
+    report: Dict[str, Any] = {
+        "backend": args.backend,
+        "receipts": args.receipts,
+        "concurrency": args.concurrency,
+        "requests": total,
+        "failed": failures,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "routes": {},
+    }
+    print(f"\nОбработчики: {args.backend}, клиентов: {args.concurrency}, чеков: {args.receipts}")
+    print(f"Запросов: {total} (ошибок {failures}) за {elapsed:.2f} с — {report['throughput_rps']:.1f} запр/с")
+    print(f"\n{'Маршрут':<34}{'count':>8}{'p50, мс':>12}{'p95, мс':>12}{'max, мс':>12}")
+    for route, values in latencies.items():
+        stats = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 0.5) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "max_ms": round(max(values) * 1000, 2),
+        }
+        report["routes"][route] = stats
+        print(f"{route:<34}{stats['count']:>8}{stats['p50_ms']:>12.2f}{stats['p95_ms']:>12.2f}{stats['max_ms']:>12.2f}")
+    return report
+
+async def run(args: argparse.Namespace) -> int:
+    telegram = FakeTelegram()
+    telegram_runner, telegram_url = await start_server(telegram.app)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        configure_environment(args, telegram_url, data_dir)
+
+        import webapp_server
+        from models.receipt import receipt_from_api
+        from services.state_store import state_store
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.ERROR)
+
+        app = await webapp_server.init_app()
+        runner, base_url = await start_server(app)
+        try:
+            receipts = list(range(1, args.receipts + 1))
+            for message_id in receipts:
+                await state_store.put(message_id, receipt_from_api(make_receipt(message_id, args.items)))
+            requests = make_requests(receipts, args.requests)
+            # Прогрев: первые запросы импортируют модули и открывают соединения
+            await run_requests(argparse.Namespace(concurrency=args.concurrency), base_url, requests[:100])
+            latencies, failures, elapsed = await run_requests(args, base_url, requests)
+        finally:
+            await runner.cleanup()
+            await telegram_runner.cleanup()
+
+        report = print_report(args, latencies, failures, elapsed)
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0 if not failures else 1
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(parse_args())))
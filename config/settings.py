@@ -1,4 +1,5 @@
 import os
+import socket
 import logging
 from dotenv import load_dotenv
 
@@ -13,6 +14,9 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN не найден в .env файле!")
 
+# Адрес Bot API (по умолчанию api.telegram.org); локальный сервер или заглушка в бенчмарках
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL") or None
+
 # Bot username for deep linking
 BOT_USERNAME = os.getenv("BOT_USERNAME", "Splitix_bot")
 logger.info(f"Используется BOT_USERNAME: {BOT_USERNAME}")
@@ -23,9 +27,86 @@ if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY не найден в .env файле!")
 
 # OpenAI model settings
-OPENAI_MODEL = "gpt-4.1-mini"
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
 OPENAI_MAX_TOKENS = 1500
 USE_OPENAI_GPT_VISION = True  # Использовать ли GPT Vision для анализа чеков
+# Адрес OpenAI-совместимого API (по умолчанию api.openai.com)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+
+# Устойчивость запросов к OpenAI: повторы, хеджирование, предохранитель
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "20"))
+OPENAI_HEDGE_ENABLED = os.getenv("OPENAI_HEDGE_ENABLED", "false").lower() == "true"
+OPENAI_HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "0.95"))
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+OPENAI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("OPENAI_CIRCUIT_FAILURE_THRESHOLD", "5"))
+OPENAI_CIRCUIT_RESET_SECONDS = float(os.getenv("OPENAI_CIRCUIT_RESET_SECONDS", "30"))
+
+# Маршрутизация по уровням: сначала дешевая модель с низкой детализацией,
+# следующий уровень — только если сумма позиций не сходится с итогом чека или позиций нет
+OPENAI_ROUTING_ENABLED = os.getenv("OPENAI_ROUTING_ENABLED", "true").lower() == "true"
+OPENAI_MODEL_TIERS = os.getenv("OPENAI_MODEL_TIERS", f"gpt-4.1-nano:low,{OPENAI_MODEL}:high")
+OPENAI_RECONCILE_TOLERANCE = os.getenv("OPENAI_RECONCILE_TOLERANCE", "0.01")
+
+# Ограничивать ответ модели JSON-схемой чека (structured output)
+OPENAI_STRUCTURED_OUTPUT = os.getenv("OPENAI_STRUCTURED_OUTPUT", "true").lower() == "true"
+OPENAI_STREAMING_ENABLED = os.getenv("OPENAI_STREAMING_ENABLED", "true").lower() == "true"
+# Минимальный интервал между обновлениями сообщения о ходе распознавания (секунды)
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "1.5"))
+
+# Планировщик запросов на распознавание
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", "4"))
+OCR_MAX_QUEUE = int(os.getenv("OCR_MAX_QUEUE", "50"))
+OCR_MAX_JOBS_PER_USER = int(os.getenv("OCR_MAX_JOBS_PER_USER", "2"))
+
+# Альбомы: фото с одним media_group_id обрабатываются как один чек
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.0"))
+MEDIA_GROUP_MAX_PHOTOS = int(os.getenv("MEDIA_GROUP_MAX_PHOTOS", "10"))
+
+# Предобработка изображения перед отправкой в OpenAI
+IMAGE_PREPROCESSING_ENABLED = os.getenv("IMAGE_PREPROCESSING_ENABLED", "true").lower() == "true"
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "true").lower() == "true"
+IMAGE_AUTOCROP = os.getenv("IMAGE_AUTOCROP", "true").lower() == "true"
+IMAGE_TARGET_LONG_EDGE = int(os.getenv("IMAGE_TARGET_LONG_EDGE", "2048"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "82"))
+
+# Кэш результатов распознавания чеков (по хэшу изображения)
+RECOGNITION_CACHE_ENABLED = os.getenv("RECOGNITION_CACHE_ENABLED", "true").lower() == "true"
+RECOGNITION_CACHE_PATH = os.getenv("RECOGNITION_CACHE_PATH", "data/recognition_cache.sqlite3")
+RECOGNITION_CACHE_MAX_ENTRIES = int(os.getenv("RECOGNITION_CACHE_MAX_ENTRIES", "5000"))
+RECOGNITION_CACHE_MEMORY_ENTRIES = int(os.getenv("RECOGNITION_CACHE_MEMORY_ENTRIES", "256"))
+RECOGNITION_CACHE_TTL_HOURS = float(os.getenv("RECOGNITION_CACHE_TTL_HOURS", "168"))
+
+# Индекс file_unique_id → результат распознавания (пересланные фото не скачиваются повторно)
+PHOTO_INDEX_MAX_ENTRIES = int(os.getenv("PHOTO_INDEX_MAX_ENTRIES", "2000"))
+PHOTO_INDEX_TTL_HOURS = float(os.getenv("PHOTO_INDEX_TTL_HOURS", "24"))
+
+# Хранилище состояний чеков (позиции, выбор и итоги участников)
+STATE_STORE_BACKEND = os.getenv("STATE_STORE_BACKEND", "memory").lower()  # memory, sqlite или redis
+STATE_STORE_PATH = os.getenv("STATE_STORE_PATH", "data/receipt_state.sqlite3")
+STATE_STORE_MAX_BYTES = int(os.getenv("STATE_STORE_MAX_BYTES", str(32 * 1024 * 1024)))
+STATE_STORE_MAX_ENTRIES = int(os.getenv("STATE_STORE_MAX_ENTRIES", "20000"))
+STATE_TTL_HOURS = float(os.getenv("STATE_TTL_HOURS", "48"))
+STATE_SWEEP_INTERVAL = float(os.getenv("STATE_SWEEP_INTERVAL", "60"))
+# Журнал изменений memory-хранилища: каталог должен быть на диске, который переживает перезапуск
+STATE_JOURNAL_ENABLED = os.getenv("STATE_JOURNAL_ENABLED", "true").lower() == "true"
+STATE_JOURNAL_DIR = os.getenv("STATE_JOURNAL_DIR", "data/state_journal")
+STATE_SNAPSHOT_INTERVAL = float(os.getenv("STATE_SNAPSHOT_INTERVAL", "300"))
+STATE_JOURNAL_MAX_RECORDS = int(os.getenv("STATE_JOURNAL_MAX_RECORDS", "5000"))
+
+# Несколько процессов за одним webhook: общее состояние в Redis и закрепление чатов за процессами
+REDIS_URL = os.getenv("REDIS_URL") or None
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "splitix")
+CHAT_OWNERSHIP_ENABLED = os.getenv("CHAT_OWNERSHIP_ENABLED", "true" if REDIS_URL else "false").lower() == "true"
+CHAT_LEASE_SECONDS = float(os.getenv("CHAT_LEASE_SECONDS", "60"))
+NODE_HEARTBEAT_SECONDS = float(os.getenv("NODE_HEARTBEAT_SECONDS", "10"))
+NODE_ID = os.getenv("NODE_ID") or os.getenv("DYNO") or f"{socket.gethostname()}-{os.getpid()}"
+
+# Журнал взаиморасчетов по многим чекам (чат или именованное событие)
+LEDGER_BACKEND = os.getenv("LEDGER_BACKEND", "redis" if REDIS_URL else "sqlite").lower()  # sqlite или redis
+LEDGER_PATH = os.getenv("LEDGER_PATH", "data/ledger.sqlite3")
 
 # WebApp settings
 WEBAPP_URL = os.getenv("WEBAPP_URL")
@@ -38,6 +119,27 @@ else:
     WEBAPP_URL = WEBAPP_URL.strip('"\'')
     logger.info(f"Загружен WEBAPP_URL: {WEBAPP_URL}")
 
+# Передача чеков веб-приложению: local — оно в этом процессе или читает то же хранилище,
+# http — отдельный сервер веб-приложения (POST /api/receipt/<id> в фоне, с повторами)
+WEBAPP_PUBLISH_MODE = os.getenv("WEBAPP_PUBLISH_MODE", "local").lower()
+WEBAPP_PUBLISH_URL = (os.getenv("WEBAPP_PUBLISH_URL") or "").strip('"\'') or WEBAPP_URL
+WEBAPP_PUBLISH_RETRIES = int(os.getenv("WEBAPP_PUBLISH_RETRIES", "3"))
+WEBAPP_PUBLISH_TIMEOUT = float(os.getenv("WEBAPP_PUBLISH_TIMEOUT", "5"))
+WEBAPP_PUBLISH_MAX_PENDING = int(os.getenv("WEBAPP_PUBLISH_MAX_PENDING", "1000"))
+
+# Срок действия initData веб-приложения Telegram (подпись проверяется токеном бота), секунды
+WEBAPP_INIT_DATA_MAX_AGE = int(os.getenv("WEBAPP_INIT_DATA_MAX_AGE", "86400"))
+
+# Общий пул исходящих HTTP-соединений (keep-alive, лимиты на процесс и на хост, DNS-кэш)
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_DNS_CACHE_SECONDS = float(os.getenv("HTTP_DNS_CACHE_SECONDS", "300"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+
+# Обработчики веб-приложения: aiohttp (в event loop бота) или flask (прежний WSGI-мост)
+WEBAPP_BACKEND = os.getenv("WEBAPP_BACKEND", "aiohttp").lower()
+
 # Environment settings
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
 ENABLE_TEST_COMMANDS = os.getenv("ENABLE_TEST_COMMANDS", "true").lower() == "true"
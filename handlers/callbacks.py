@@ -5,7 +5,9 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from utils.calculations import calculate_total_with_charges
 from utils.formatters import format_user_summary, format_final_summary
-from utils.state import message_state
+from utils.settlement import settle_receipt
+from services.ledger import record_receipt
+from services.state_store import state_store
 from handlers.commands import HELP_TEXT
 
 logger = logging.getLogger(__name__)
@@ -19,39 +21,34 @@ async def handle_confirm_selection(callback: CallbackQuery, state: FSMContext):
         user_id = callback.from_user.id
         
         # Получаем состояние
-        state_data = message_state.get_state(message_id)
+        state_data = await state_store.get(message_id)
         if not state_data:
             await callback.answer("Состояние для этого списка не найдено. Возможно, он устарел.", show_alert=True)
             return
         
         # Получаем выбор пользователя
-        user_counts = message_state.get_user_selection(message_id, user_id)
+        user_counts = state_data.user_selections.get(str(user_id))
         if not user_counts or not any(user_counts.values()):
             await callback.answer("❌ Выберите хотя бы один товар")
             return
         
         # Рассчитываем итоги
-        total_sum, summary = calculate_total_with_charges(
-            items=state_data.get("items", []),
-            user_counts=user_counts,
-            service_charge_percent=state_data.get("service_charge_percent"),
-            actual_discount_percent=state_data.get("actual_discount_percent"),
-            total_discount_amount=state_data.get("total_discount_amount")
-        )
+        total_sum, summary = calculate_total_with_charges(state_data, user_id)
         
         # Форматируем сообщение
         username = callback.from_user.username or callback.from_user.first_name
-        formatted_summary = format_user_summary(username, state_data["items"], user_counts, total_sum, summary)
+        formatted_summary = format_user_summary(username, state_data.items, user_counts, total_sum, summary)
         
         # Сохраняем результат
-        if "user_results" not in state_data:
-            state_data["user_results"] = {}
-        
-        state_data["user_results"][user_id] = {
+        await state_store.set_result(message_id, user_id, {
             "summary": formatted_summary,
             "total_sum": float(total_sum),
-            "selected_items": {str(idx): count for idx, count in user_counts.items() if count > 0}
-        }
+            "selected_items": {str(idx): value for idx, value in user_counts.items() if value}
+        })
+        # В журнал идет состояние уже с этим подтверждением
+        receipt = await state_store.get(message_id)
+        if receipt is not None:
+            await record_receipt(message_id, receipt)
         
         # Отправляем сообщения
         await callback.message.answer(formatted_summary, parse_mode="HTML")
@@ -59,7 +56,7 @@ async def handle_confirm_selection(callback: CallbackQuery, state: FSMContext):
         keyboard = InlineKeyboardBuilder()
         keyboard.row(InlineKeyboardButton(
             text="👥 Посмотреть итоги всех участников",
-            callback_data="show_all_results"
+            callback_data=f"show_all_results:{message_id}"
         ))
         
         await callback.message.answer(
@@ -71,25 +68,34 @@ async def handle_confirm_selection(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Ошибка при обработке confirm_selection: {e}", exc_info=True)
         await callback.answer("❌ Произошла ошибка. Пожалуйста, попробуйте еще раз.")
 
-@router.callback_query(F.data == "show_all_results")
+@router.callback_query(F.data.startswith("show_all_results"))
 async def handle_show_all_results(callback: CallbackQuery):
-    """Обработчик показа результатов всех участников."""
+    """Обработчик показа результатов всех участников и переводов между ними."""
     try:
-        message_id = callback.message.message_id
-        state_data = message_state.get_state(message_id)
+        # message_id чека передается в callback_data; в старых кнопках его нет
+        _, _, raw_message_id = callback.data.partition(":")
+        message_id = int(raw_message_id) if raw_message_id.isdigit() else callback.message.message_id
+        state_data = await state_store.get(message_id)
         
-        if not state_data or "user_results" not in state_data:
+        if not state_data:
+            await callback.answer("Нет данных о результатах участников.")
+            return
+        settlement = settle_receipt(state_data)
+        if not settlement.shares:
             await callback.answer("Нет данных о результатах участников.")
             return
         
         # Собираем имена пользователей
         usernames = {}
-        for user_id in state_data["user_results"].keys():
-            user = await callback.bot.get_chat_member(callback.message.chat.id, user_id)
-            usernames[user_id] = user.user.username or user.user.first_name
+        for user_id in settlement.shares.keys() | settlement.payments.keys():
+            try:
+                user = await callback.bot.get_chat_member(callback.message.chat.id, int(user_id))
+                usernames[user_id] = user.user.username or user.user.first_name
+            except Exception as e:
+                logger.warning(f"Не удалось получить имя участника {user_id}: {e}")
         
         # Форматируем итоговый результат
-        summary = format_final_summary(state_data["user_results"], usernames)
+        summary = format_final_summary(settlement, usernames)
         
         # Отправляем результат
         await callback.message.answer(summary, parse_mode="HTML")
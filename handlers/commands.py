@@ -1,10 +1,15 @@
+import html
 import logging
 import os
 from aiogram import Router
 from aiogram.types import Message, InlineKeyboardButton, WebAppInfo, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from handlers.photo import ReceiptStates
+from services.state_store import state_store
+from services.ledger import ledger, ledger_name
+from utils.formatters import format_ledger_summary
+from utils.settlement import settle
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from config.settings import WEBAPP_URL, TELEGRAM_BOT_TOKEN, ENABLE_TEST_COMMANDS
 from utils.keyboards import create_test_webapp_inline_keyboard, create_test_webapp_reply_keyboard
@@ -18,6 +23,10 @@ HELP_TEXT = (
     "2. 🔍 Я распознаю товары и цены\n"
     "3. ✅ Выбери товары, которые ты хочешь добавить в свой счет\n"
     "4. 💰 Я посчитаю твою часть\n\n"
+    "🧳 Поездка из многих чеков:\n"
+    "• /event название — начать событие, новые чеки пойдут в общий расчет\n"
+    "• /balance — кто кому должен по всем чекам чата или события\n"
+    "• /event — завершить событие\n\n"
     "💡 Советы:\n"
     "• Убедись, что фото чека четкое и хорошо освещенное\n"
     "• Чек должен быть полностью виден на фото\n"
@@ -36,10 +45,7 @@ async def cmd_start(message: Message):
             receipt_param = command_args[1]  # receipt_123
             message_id = int(receipt_param.split("_")[1])
             
-            # Импортируем message_states для проверки существования чека
-            from handlers.photo import message_states
-            
-            if message_id in message_states:
+            if await state_store.get(message_id) is not None:
                 # Создаем кнопку Mini App для конкретного чека
                 clean_url = WEBAPP_URL.strip('"\'')
                 webapp_url = f"{clean_url}/app/{message_id}"
@@ -92,6 +98,43 @@ async def cmd_split(message: Message, state: FSMContext):
     await state.set_state(ReceiptStates.waiting_for_photo)
     await message.answer("📸 Пожалуйста, пришлите фото чека.")
 
+@router.message(Command("event"))
+async def cmd_event(message: Message, command: CommandObject):
+    """Обработчик команды /event: /event название начинает событие (поездку), /event без названия завершает его."""
+    event = (command.args or "").strip()[:64] or None
+    previous = await ledger.get_event(message.chat.id)
+    await ledger.set_event(message.chat.id, event)
+    if event:
+        await message.answer(
+            f"🧳 Событие «{html.escape(event)}» начато. Новые чеки этого чата идут в его общий расчет.\n\n"
+            "Итоги по всем чекам события: /balance",
+            parse_mode="HTML"
+        )
+    elif previous:
+        await message.answer(
+            f"🏁 Событие «{html.escape(previous)}» завершено. Итоги по нему: /balance {html.escape(previous)}",
+            parse_mode="HTML"
+        )
+    else:
+        await message.answer("Использование: /event название — начать событие (поездку), /event — завершить его.")
+
+@router.message(Command("balance"))
+async def cmd_balance(message: Message, command: CommandObject):
+    """Обработчик команды /balance: кто кому должен по всем чекам чата или события."""
+    event = (command.args or "").strip()[:64] or await ledger.get_event(message.chat.id)
+    balances = await ledger.balances(ledger_name(message.chat.id, event))
+    
+    usernames = {}
+    for user_id in balances:
+        try:
+            member = await message.bot.get_chat_member(message.chat.id, int(user_id))
+            usernames[user_id] = member.user.username or member.user.first_name
+        except Exception as e:
+            logger.warning(f"Не удалось получить имя участника {user_id}: {e}")
+    
+    title = f"Итоги события «{event}»" if event else "Итоги по всем чекам чата"
+    await message.answer(format_ledger_summary(title, balances, settle(balances), usernames), parse_mode="HTML")
+
 # Тестовые команды (доступны только в dev/staging окружениях)
 if ENABLE_TEST_COMMANDS:
     @router.message(Command("testbothwebapp"))
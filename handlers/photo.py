@@ -1,18 +1,27 @@
+import asyncio
 import logging
-import aiohttp
-from decimal import Decimal
 from aiogram import F, Router
-from aiogram.types import Message
+from aiogram.types import Message, PhotoSize
 from aiogram.enums import ChatType
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from services.openai_service import process_receipt_with_openai
+from services.openai_service import ItemCallback, lookup_cached_recognition, process_receipt_with_openai
+from services.ocr_scheduler import PositionCallback, QueueFullError, ocr_scheduler
+from services.resilience import CircuitOpenError
+from services.recognition_cache import photo_index
+from services.ledger import chat_ledger
+from services.receipt_publisher import receipt_publisher
+from services.receipt_merge import merge_recognition_results
+from services.state_store import state_store
 from utils.keyboards import create_receipt_keyboard
-from utils.api import check_api_health, prepare_data_for_api
-from utils.formatters import format_item_line, calculate_totals
-from models.receipt import Receipt, ReceiptItem
-from typing import Dict, Any
-from config.settings import WEBAPP_URL
+from utils.formatters import format_item_line, format_progress_message, calculate_totals
+from utils.pricing import pricing_plan
+from utils.progress import ProgressMessage
+from utils.media_group import media_group_collector
+from utils.metrics import pipeline_metrics
+from utils.money import format_minor, format_percent
+from models.receipt import ReceiptRecord
+from typing import Dict, Any, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -21,94 +30,143 @@ class ReceiptStates(StatesGroup):
     waiting_for_photo = State()
     waiting_for_items_selection = State()
 
-# Будет установлено из main.py
-message_states: Dict[int, Dict[str, Any]] = None
+async def load_photo(message: Message, photo: PhotoSize) -> Tuple[Optional[ReceiptRecord], Optional[bytes], Optional[str]]:
+    """
+    Готовит фото к распознаванию.
 
-async def save_receipt_data_to_api(message_id: int, data: Dict[str, Any]) -> bool:
-    """Сохраняет данные чека в API для веб-приложения"""
-    if not WEBAPP_URL or "http://localhost" in WEBAPP_URL or "http://127.0.0.1" in WEBAPP_URL:
-        logger.warning("WEBAPP_URL не настроен или использует localhost")
-        return False
-    
-    clean_url = WEBAPP_URL.strip('"\'')
-    timeout = aiohttp.ClientTimeout(total=5.0)
-    
-    try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            if not await check_api_health(session, clean_url):
-                return False
-            
-            api_url = f"{clean_url}/api/receipt/{message_id}"
-            serializable_data = prepare_data_for_api(data)
-            
-            async with session.post(api_url, json=serializable_data) as response:
-                if response.status == 200:
-                    logger.info(f"Данные чека сохранены для message_id: {message_id}")
-                    return True
-                error_text = await response.text()
-                logger.error(f"Ошибка API: {response.status}, {error_text}")
-                return False
-                
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении данных: {e}", exc_info=True)
-        return False
+    Если фото с таким file_unique_id уже распознавалось (пересылка, повторная отправка),
+    результат берется из индекса без скачивания файла. Иначе файл скачивается
+    и проверяется кэш распознавания по содержимому; найденный там результат тоже
+    запоминается в индексе, чтобы следующая пересылка обошлась без скачивания.
 
-async def process_receipt_photo(message: Message, state: FSMContext):
-    """Обрабатывает фото чека"""
-    try:
-        photo = message.photo[-1]
+    Returns:
+        (готовый результат или None, байты изображения или None, ключ кэша распознавания или None)
+    """
+    cached_result = photo_index.get(photo.file_unique_id)
+    if cached_result is not None:
+        logger.info(f"Фото {photo.file_unique_id} уже распознано, используем сохраненный результат")
+        return cached_result.copy(), None, None
+
+    with pipeline_metrics.stage("download"):
         file = await message.bot.get_file(photo.file_id)
         file_bytes = await message.bot.download_file(file.file_path)
         image_data = file_bytes.read()
+
+    cached_result, cache_key = await lookup_cached_recognition(image_data)
+    if cached_result is not None and cached_result.items:
+        photo_index.set(photo.file_unique_id, cached_result.copy())
+    return cached_result, image_data, cache_key
+
+async def recognize_photos(messages: List[Message], on_item: Optional[ItemCallback] = None,
+                           on_position: Optional[PositionCallback] = None) -> List[Optional[ReceiptRecord]]:
+    """
+    Распознает фото чека (одно или несколько фото альбома) параллельно.
+
+    Скачивание идет одновременно для всех фото, запросы к OpenAI ставятся в очередь
+    ocr_scheduler одной группой. Результаты возвращаются в порядке сообщений.
+
+    Raises:
+        QueueFullError: Если очередь распознавания переполнена
+    """
+    photos = [message.photo[-1] for message in messages]
+    loaded = await asyncio.gather(*(load_photo(message, photo) for message, photo in zip(messages, photos)))
+    results: List[Optional[ReceiptRecord]] = [result for result, _, _ in loaded]
+
+    pending = [index for index, (result, _, _) in enumerate(loaded) if result is None]
+    if pending:
+        first = messages[0]
+        user_id = first.from_user.id if first.from_user else first.chat.id
+        factories = [
+            lambda image_data=loaded[index][1], cache_key=loaded[index][2]:
+                process_receipt_with_openai(image_data, on_item=on_item, cache_key=cache_key)
+            for index in pending
+        ]
+        recognized = await ocr_scheduler.run_many(first.chat.id, user_id, factories, on_position=on_position)
+        for index, result in zip(pending, recognized):
+            results[index] = result
+            if result is not None and result.items:
+                photo_index.set(photos[index].file_unique_id, result.copy())
+    return results
+
+async def process_receipt_photo(message: Message, state: FSMContext, album: Optional[List[Message]] = None):
+    """
+    Обрабатывает фото чека.
+
+    Если передан album (несколько фото одного длинного чека), все фото распознаются
+    параллельно и объединяются в один чек с одной клавиатурой и одним состоянием.
+    """
+    try:
+        messages = album or [message]
+        processing_text = "⏳ Обрабатываю чек..." if len(messages) == 1 else f"⏳ Обрабатываю чек ({len(messages)} фото)..."
+        processing_message = await message.answer(processing_text)
+        
+        # Показываем позиции по мере их распознавания (для одного фото)
+        progress = ProgressMessage(processing_message)
+        streamed_items = []
         
-        processing_message = await message.answer("⏳ Обрабатываю чек...")
+        async def on_item(item: Dict[str, Any]) -> None:
+            streamed_items.append(item)
+            progress.update(format_progress_message(streamed_items))
         
-        items, service_charge, total_check_amount, total_discount_percent, total_discount_amount = await process_receipt_with_openai(image_data)
+        def on_position(position: int) -> None:
+            if position > 0:
+                progress.update(f"⏳ Чек в очереди на распознавание, позиция: {position}")
+            else:
+                progress.update(processing_text)
+        
+        try:
+            results = await recognize_photos(
+                messages, on_item=on_item if len(messages) == 1 else None, on_position=on_position
+            )
+            receipt = results[0] if len(results) == 1 else merge_recognition_results(results)
+        except QueueFullError as e:
+            logger.warning(f"Распознавание отклонено: {e}")
+            await progress.close()
+            await processing_message.edit_text("⏳ Сейчас распознается слишком много чеков. Пожалуйста, отправьте фото еще раз через минуту.")
+            return
+        except CircuitOpenError as e:
+            logger.warning(f"Распознавание недоступно: {e}")
+            await progress.close()
+            await processing_message.edit_text("🔧 Сервис распознавания временно недоступен. Пожалуйста, попробуйте через пару минут.")
+            return
+        finally:
+            await progress.close()
         
-        if not items:
+        if receipt is None or not receipt.items:
             await processing_message.edit_text("❌ Не удалось распознать чек. Пожалуйста, попробуйте еще раз или отправьте более четкое фото.")
             await state.clear()
             return
         
-        # Создаем объект Receipt
-        receipt = Receipt(
-            items=[ReceiptItem(**item) for item in items],
-            service_charge_percent=service_charge,
-            total_check_amount=total_check_amount,
-            total_discount_percent=total_discount_percent,
-            total_discount_amount=total_discount_amount
-        )
+        with pipeline_metrics.stage("render"):
+            calculated_total, service_charge_amount, actual_discount_percent = calculate_totals(receipt)
         
-        calculated_total, service_charge_amount, actual_discount_percent = calculate_totals(
-            items, service_charge, total_discount_amount
-        )
+            # Формируем сообщение
+            response_msg_text = "<b>📋 Распознанные позиции из чека:</b>\n\n"
+            response_msg_text += "".join(format_item_line(item) for item in receipt.items)
         
-        # Формируем сообщение
-        response_msg_text = "<b>📋 Распознанные позиции из чека:</b>\n\n"
-        response_msg_text += "".join(format_item_line(item) for item in items)
+            response_msg_text += "\n<b>📊 Итоговая информация:</b>\n"
         
-        response_msg_text += "\n<b>📊 Итоговая информация:</b>\n"
+            if receipt.total_discount_amount is not None or receipt.total_discount_percent is not None:
+                response_msg_text += f"🎉 Скидка: {format_percent(actual_discount_percent)}% (-{format_minor(pricing_plan(receipt).discount)})\n"
         
-        if total_discount_amount is not None:
-            response_msg_text += f"🎉 Скидка: {actual_discount_percent}% (-{total_discount_amount:.2f})\n"
+            if receipt.service_charge_percent is not None:
+                response_msg_text += f"💰 Сервисный сбор: {format_percent(receipt.service_charge_percent)}% (+{format_minor(service_charge_amount)})\n"
         
-        if service_charge is not None:
-            response_msg_text += f"💰 Сервисный сбор: {service_charge}% (+{service_charge_amount:.2f})\n"
+            if receipt.total_check_amount is not None:
+                total_check_text = format_minor(receipt.total_check_amount)
+                if calculated_total == receipt.total_check_amount:
+                    response_msg_text += f"✅ Итоговая сумма: {total_check_text} (совпадает с расчетом)\n"
+                else:
+                    response_msg_text += f"⚠️ Внимание: сумма в чеке ({total_check_text}) не совпадает с расчетом ({format_minor(calculated_total)})\n"
         
-        if total_check_amount is not None:
-            if abs(calculated_total - total_check_amount) < Decimal("0.01"):
-                response_msg_text += f"✅ Итоговая сумма: {total_check_amount:.2f} (совпадает с расчетом)\n"
-            else:
-                response_msg_text += f"⚠️ Внимание: сумма в чеке ({total_check_amount:.2f}) не совпадает с расчетом ({calculated_total:.2f})\n"
+        # Сохраняем данные; по умолчанию чек оплатил тот, кто его прислал
+        if message.from_user is not None:
+            receipt.payments = {str(message.from_user.id): pricing_plan(receipt).total}
+        receipt.ledger = await chat_ledger(message.chat.id)
+        await state_store.put(processing_message.message_id, receipt)
         
-        # Сохраняем данные
-        receipt_data = receipt.model_dump()
-        receipt_data["actual_discount_percent"] = actual_discount_percent
-        
-        message_states[processing_message.message_id] = receipt_data
-        
-        # Сохраняем в API
-        await save_receipt_data_to_api(processing_message.message_id, receipt_data)
+        # Передаем веб-приложению (без ожидания: в одном процессе чек уже в хранилище)
+        receipt_publisher.publish(processing_message.message_id, receipt)
         
         # Создаем клавиатуру
         keyboard = create_receipt_keyboard(
@@ -117,11 +175,12 @@ async def process_receipt_photo(message: Message, state: FSMContext):
         )
         
         # Отправляем итоговое сообщение
-        await processing_message.edit_text(
-            response_msg_text,
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
+        with pipeline_metrics.stage("edit"):
+            await processing_message.edit_text(
+                response_msg_text,
+                reply_markup=keyboard,
+                parse_mode="HTML"
+            )
         
         # Добавляем Reply-клавиатуру с кнопкой Mini App (только для личного чата)
         if message.chat.type == "private":
@@ -143,9 +202,16 @@ async def handle_photo(message: Message, state: FSMContext):
     """Обработчик сообщений с фото"""
     current_state = await state.get_state()
     
-    # В личном чате обрабатываем фото сразу
-    if message.chat.type == ChatType.PRIVATE:
-        await process_receipt_photo(message, state)
-    # В групповом чате только после команды /split
-    elif current_state == ReceiptStates.waiting_for_photo:
-        await process_receipt_photo(message, state)
\ No newline at end of file
+    # В личном чате обрабатываем фото сразу, в групповом — только после команды /split
+    if message.chat.type != ChatType.PRIVATE and current_state != ReceiptStates.waiting_for_photo:
+        return
+    
+    # Фото альбома собираем вместе: весь альбом обрабатывает первое сообщение
+    if message.media_group_id:
+        album = await media_group_collector.collect(message)
+        if album is None:
+            return
+        await process_receipt_photo(album[0], state, album=album)
+        return
+    
+    await process_receipt_photo(message, state)
\ No newline at end of file
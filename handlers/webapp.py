@@ -3,6 +3,9 @@ import logging
 from aiogram import Router, F, Bot
 from aiogram.types import Message, InlineQueryResultArticle, InputTextMessageContent
 import html
+from services.state_store import state_store
+from services.ledger import record_receipt
+from utils.calculations import calculate_total_with_charges
 
 logger = logging.getLogger(__name__)
 if not logger.handlers:
@@ -24,29 +27,55 @@ async def handle_receipt_selection(message: Message, data: dict):
         
         logger.info(f"Обработка выбора позиций: message_id={message_id}, items_count={len(selected_items)}")
         
-        # Формируем ответное сообщение
-        response = "✅ **Ваш выбор подтвержден!**\n\n"
-        
-        # Показываем выбранные позиции
-        if selected_items:
-            response += "📋 **Выбранные позиции:**\n"
-            for item in selected_items:
-                item_total = item['price'] * item['quantity']
-                response += f"• {escape_markdown(item['name'])} — {item['price']:.2f} ₽ × {item['quantity']} = {item_total:.2f} ₽\n"
-        
-        response += "\n💰 **Итоги:**\n"
-        response += f"📊 Позиций выбрано: {summary.get('items_count', 0)}\n"
-        response += f"💵 Сумма позиций: {summary.get('items_total', 0):.2f} ₽\n"
-        
-        if summary.get('discount_amount', 0) > 0:
-            response += f"🎉 Скидка: -{summary.get('discount_amount', 0):.2f} ₽\n"
-        
-        if summary.get('service_amount', 0) > 0:
-            response += f"💰 Сервисный сбор: +{summary.get('service_amount', 0):.2f} ₽\n"
-        
-        response += f"**💳 Итого к оплате: {summary.get('final_total', 0):.2f} ₽**"
+        # Сохраняем выбор участника в состоянии чека
+        receipt = None
+        if message_id is not None and str(message_id).isdigit():
+            selection = {
+                str(item['index']): {"share": 1} if item.get('shared') else int(item.get('quantity') or 1)
+                for item in selected_items if 'index' in item
+            }
+            if await state_store.update_selection(int(message_id), message.from_user.id, selection):
+                receipt = await state_store.get(int(message_id))
+            else:
+                logger.warning(f"Чек message_id={message_id} не найден, выбор не сохранен")
         
-        await message.answer(response, parse_mode="Markdown")
+        if receipt is not None:
+            # Доля считается по выбору всех участников, в том числе доли общих позиций
+            total_sum, share_summary = calculate_total_with_charges(receipt, message.from_user.id)
+            # Отправка из веб-приложения — это подтверждение выбора: сохраняем итог, как и кнопка подтверждения,
+            # и только после этого чек попадает в журнал взаиморасчетов
+            await state_store.set_result(int(message_id), message.from_user.id, {
+                "summary": share_summary,
+                "total_sum": float(total_sum),
+                "selected_items": {idx: value for idx, value in selection.items() if value},
+            })
+            confirmed = await state_store.get(int(message_id))
+            if confirmed is not None:
+                await record_receipt(int(message_id), confirmed)
+            await message.answer(f"✅ <b>Ваш выбор подтвержден!</b>\n\n{share_summary}", parse_mode="HTML")
+        else:
+            # Формируем ответное сообщение по расчету веб-приложения
+            response = "✅ **Ваш выбор подтвержден!**\n\n"
+            
+            # Показываем выбранные позиции
+            if selected_items:
+                response += "📋 **Выбранные позиции:**\n"
+                for item in selected_items:
+                    response += f"• {escape_markdown(str(item.get('description', '')))}\n"
+            
+            response += "\n💰 **Итоги:**\n"
+            response += f"📊 Позиций выбрано: {summary.get('items_count', 0)}\n"
+            response += f"💵 Сумма позиций: {summary.get('items_total', 0):.2f} ₽\n"
+            
+            if summary.get('discount_amount', 0) > 0:
+                response += f"🎉 Скидка: -{summary.get('discount_amount', 0):.2f} ₽\n"
+            
+            if summary.get('service_amount', 0) > 0:
+                response += f"💰 Сервисный сбор: +{summary.get('service_amount', 0):.2f} ₽\n"
+            
+            response += f"**💳 Итого к оплате: {summary.get('final_total', 0):.2f} ₽**"
+            
+            await message.answer(response, parse_mode="Markdown")
         
         # Убираем Reply-клавиатуру после подтверждения
         from aiogram.types import ReplyKeyboardRemove
@@ -1,16 +1,24 @@
 import asyncio
 import logging
 import os
-from typing import Any
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.enums import ParseMode
 from aiogram.types import BotCommand, Update
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
-from config.settings import TELEGRAM_BOT_TOKEN, LOG_LEVEL, WEBAPP_URL
+from config.settings import TELEGRAM_BOT_TOKEN, TELEGRAM_API_URL, LOG_LEVEL, WEBAPP_URL, REDIS_URL, REDIS_PREFIX
 from handlers import photo, callbacks, commands, webapp, inline
+from services.chat_ownership import chat_ownership
+from services.redis_client import close_redis
+from services.state_store import state_store
+from services.ledger import ledger
+from services.receipt_publisher import receipt_publisher
+from services.http_client import http_client
 
 # Настраиваем логирование
 logging.basicConfig(
@@ -22,14 +30,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Словарь для хранения состояния (items и их счетчики) для каждого сообщения с клавиатурой
-message_states: dict[int, dict[str, Any]] = {}
-
-# Экспорт message_states для использования в обработчиках
-callbacks.message_states = message_states
-photo.message_states = message_states
-webapp.message_states = message_states
-
 # Конфигурация для Heroku
 # Определяем имя приложения из переменных или используем полное имя
 APP_NAME = os.getenv('HEROKU_APP_NAME') or os.getenv('APP_NAME') or 'splitix-bot-69642ff6c071'
@@ -50,6 +50,9 @@ if PORT:
 else:
     WEBHOOK_HOST = WEBHOOK_PATH = WEBHOOK_URL = None
 
+# Бот приложения: обработчики веб-приложения отвечают через его сессию
+BOT_KEY = web.AppKey("bot", Bot)
+
 async def on_startup(bot: Bot) -> None:
     """Хук для настройки webhook при запуске."""
     if WEBHOOK_URL:
@@ -68,14 +71,43 @@ async def on_shutdown(bot: Bot) -> None:
         logger.info("Удаление webhook...")
         await bot.delete_webhook()
         logger.info("Webhook удален")
+    if chat_ownership is not None:
+        await chat_ownership.stop()
+    await receipt_publisher.close()
+    await http_client.close()
+    await state_store.close()
+    await ledger.close()
+    await close_redis()
+
+def create_storage() -> BaseStorage:
+    """FSM-хранилище: при заданном REDIS_URL — Redis, общий для всех процессов бота, иначе память."""
+    if REDIS_URL:
+        from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+        logger.info("FSM-состояния хранятся в Redis")
+        return RedisStorage.from_url(REDIS_URL, key_builder=DefaultKeyBuilder(prefix=f"{REDIS_PREFIX}:fsm"))
+    return MemoryStorage()
+
+def create_bot() -> Bot:
+    """Создает бота; при заданном TELEGRAM_API_URL запросы идут на указанный Bot API сервер."""
+    session = None
+    if TELEGRAM_API_URL:
+        logger.info(f"Используем Bot API сервер: {TELEGRAM_API_URL}")
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    return Bot(token=TELEGRAM_BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
 async def create_app() -> web.Application:
     """Создание и настройка веб-приложения."""
     # Инициализируем бота и диспетчер
-    storage = MemoryStorage()
-    bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    storage = create_storage()
+    bot = create_bot()
     dp = Dispatcher(storage=storage)
     
+    # Flask обращается к хранилищу состояний из своих потоков через этот loop
+    state_store.bind_loop(asyncio.get_running_loop())
+    await state_store.start()
+    # Общий пул исходящих HTTP-соединений; закрывается в on_shutdown
+    await http_client.start()
+    
     # Регистрируем команды бота
     await register_commands(bot)
     
@@ -104,9 +136,14 @@ async def create_app() -> web.Application:
     
     # Создаем веб-приложение
     app = web.Application()
+    app[BOT_KEY] = bot
     
     if WEBHOOK_URL:
         # Webhook режим для Heroku
+        if chat_ownership is not None:
+            # Несколько процессов за одним webhook: апдейты чата обрабатывает его владелец
+            dp.update.outer_middleware(chat_ownership.middleware)
+            await chat_ownership.start(dp, bot)
         webhook_requests_handler = SimpleRequestHandler(
             dispatcher=dp,
             bot=bot,
@@ -133,6 +170,8 @@ async def register_commands(bot: Bot):
         BotCommand(command="start", description="👋 Начать работу с ботом"),
         BotCommand(command="help", description="❓ Помощь по использованию бота"),
         BotCommand(command="split", description="📇 Разделить чек (в группе)"),
+        BotCommand(command="event", description="🧳 Начать или завершить поездку"),
+        BotCommand(command="balance", description="🧾 Кто кому должен по всем чекам"),
     ]
     
     # Добавляем тестовые команды только в dev/staging окружениях
@@ -154,9 +193,11 @@ async def main():
         return
     
     # Для локальной разработки - простой polling
-    storage = MemoryStorage()
-    bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    storage = create_storage()
+    bot = create_bot()
     dp = Dispatcher(storage=storage)
+    await state_store.start()
+    await http_client.start()
     
     await register_commands(bot)
     
@@ -176,7 +217,13 @@ async def main():
     dp.include_router(inline.router)
     dp.include_router(webapp.router)
     
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await receipt_publisher.close()
+        await http_client.close()
+        await state_store.close()
+        await ledger.close()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
@@ -1,6 +1,14 @@
 from decimal import Decimal
-from typing import Optional, List
-from pydantic import BaseModel, Field, field_validator
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Annotated, Any, Dict, Optional, List, Type, Union, get_args, get_origin
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
+from typing_extensions import TypedDict
+from utils.data_utils import parse_quantity
+from utils.money import MINOR_UNITS, to_basis_points, to_minor
+
+# Pydantic-модели описывают формат ответа OpenAI (по ним строится receipt_json_schema).
+# Внутри бота чек хранится в ReceiptRecord, см. ниже.
 
 class ReceiptItem(BaseModel):
     """Модель товарной позиции в чеке."""
@@ -57,4 +65,279 @@ class Receipt(BaseModel):
             service_charge = (total * self.service_charge_percent / Decimal('100')).quantize(Decimal('0.01'))
             total += service_charge
             
-        return total.quantize(Decimal('0.01')) 
\ No newline at end of file
+        return total.quantize(Decimal('0.01'))
+
+#: Поля Receipt, которые вычисляются ботом и не запрашиваются у модели
+OCR_EXCLUDED_FIELDS = {"actual_discount_percent", "user_selections"}
+
+def _ocr_field_name(field_name: str) -> str:
+    """Имя поля в ответе OpenAI: суффикс _from_openai в ответе не используется."""
+    return field_name.removesuffix("_from_openai")
+
+def _json_schema_type(annotation: Any) -> Dict[str, Any]:
+    """Тип JSON Schema для аннотации поля модели."""
+    nullable = False
+    if get_origin(annotation) is not None and type(None) in get_args(annotation):
+        nullable = True
+        annotation = next(arg for arg in get_args(annotation) if arg is not type(None))
+
+    if annotation is str:
+        json_type = "string"
+    elif annotation in (Decimal, float, int):
+        json_type = "number"
+    else:
+        raise TypeError(f"Неподдерживаемый тип поля для схемы OCR: {annotation}")
+    return {"type": [json_type, "null"] if nullable else json_type}
+
+def _object_schema(model: Type[BaseModel], properties: Dict[str, Any]) -> Dict[str, Any]:
+    """Строгая схема объекта: все поля обязательны, лишние поля запрещены."""
+    return {
+        "type": "object",
+        "description": (model.__doc__ or "").strip(),
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+@lru_cache(maxsize=1)
+def receipt_json_schema() -> Dict[str, Any]:
+    """
+    JSON Schema ответа OpenAI, построенная по моделям Receipt и ReceiptItem.
+
+    Используется в режиме structured output (strict): необязательные поля моделей
+    становятся nullable, вычисляемые ботом поля (OCR_EXCLUDED_FIELDS) исключаются.
+    """
+    item_properties = {
+        _ocr_field_name(name): _json_schema_type(field.annotation)
+        for name, field in ReceiptItem.model_fields.items()
+    }
+    receipt_properties: Dict[str, Any] = {}
+    for name, field in Receipt.model_fields.items():
+        if name in OCR_EXCLUDED_FIELDS:
+            continue
+        if name == "items":
+            receipt_properties[name] = {"type": "array", "items": _object_schema(ReceiptItem, item_properties)}
+        else:
+            receipt_properties[name] = _json_schema_type(field.annotation)
+    return _object_schema(Receipt, receipt_properties)
+
+@dataclass(slots=True, frozen=True)
+class ReceiptLine:
+    """
+    Позиция чека во внутреннем представлении.
+
+    Суммы — целые числа в минимальных единицах валюты (копейках), проценты —
+    в сотых долях процента (1250 = 12.5%).
+    """
+    description: str
+    quantity: int = 1
+    unit_price: Optional[int] = None
+    total_amount: Optional[int] = None
+    discount_percent: Optional[int] = None
+    discount_amount: Optional[int] = None
+
+#: Выбор участника по позиции: количество штук или {"share": вес} — доля общей позиции,
+#: которая делится между всеми выбравшими ее пропорционально весам
+SelectionValue = Union[int, Dict[str, int]]
+
+@dataclass(slots=True)
+class ReceiptRecord:
+    """
+    Распознанный чек во внутреннем представлении.
+
+    Создается один раз из ответа OpenAI (receipt_from_ocr) или из данных API
+    (receipt_from_api) и дальше используется всеми слоями без повторной валидации.
+    Единицы те же, что у ReceiptLine.
+    """
+    items: List[ReceiptLine]
+    service_charge_percent: Optional[int] = None
+    total_check_amount: Optional[int] = None
+    total_discount_percent: Optional[int] = None
+    total_discount_amount: Optional[int] = None
+    user_selections: Dict[str, Dict[str, SelectionValue]] = field(default_factory=dict)
+    user_results: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    #: Кто сколько заплатил по чеку (user_id → минимальные единицы), для взаиморасчета
+    payments: Dict[str, int] = field(default_factory=dict)
+    #: Журнал взаиморасчетов, в который идет чек (services.ledger.ledger_name)
+    ledger: Optional[str] = None
+    #: Версия состояния чека: растет при каждом изменении в хранилище (ETag в API)
+    version: int = 0
+    #: Версия, с которой чек сохранен целиком; более ранние изменения ?since= не отдает
+    base_version: int = 0
+    #: Версии последних изменений участников: поле (user_selections, user_results, payments) → user_id → версия
+    changes: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    #: Расчет чека (utils.pricing.PricingPlan); строится при первом обращении и не сериализуется
+    pricing: Annotated[Any, Field(exclude=True)] = field(default=None, compare=False, repr=False)
+    #: Текущие доли участников (utils.pricing.SplitTotals); строятся при первом обращении и не сериализуются
+    totals: Annotated[Any, Field(exclude=True)] = field(default=None, compare=False, repr=False)
+
+    def copy(self) -> "ReceiptRecord":
+        """Копия с общими (неизменяемыми) позициями и пустыми выборами участников."""
+        return ReceiptRecord(
+            items=list(self.items),
+            service_charge_percent=self.service_charge_percent,
+            total_check_amount=self.total_check_amount,
+            total_discount_percent=self.total_discount_percent,
+            total_discount_amount=self.total_discount_amount,
+            pricing=self.pricing,
+        )
+
+def receipt_from_ocr(data: Dict[str, Any]) -> Optional[ReceiptRecord]:
+    """
+    Строит ReceiptRecord из JSON-ответа OpenAI за один проход.
+
+    Returns:
+        Чек или None, если в ответе нет списка items
+    """
+    raw_items = data.get("items")
+    if not isinstance(raw_items, list):
+        return None
+    items = [
+        ReceiptLine(
+            description=str(item.get("description") or "N/A"),
+            quantity=parse_quantity(item.get("quantity", 1)),
+            unit_price=to_minor(item.get("unit_price")),
+            total_amount=to_minor(item.get("total_amount")),
+            discount_percent=to_basis_points(item.get("discount_percent")),
+            discount_amount=to_minor(item.get("discount_amount")),
+        )
+        for item in raw_items
+        if isinstance(item, dict)
+    ]
+    return ReceiptRecord(
+        items=items,
+        service_charge_percent=to_basis_points(data.get("service_charge_percent")),
+        total_check_amount=to_minor(data.get("total_check_amount")),
+        total_discount_percent=to_basis_points(data.get("total_discount_percent")),
+        total_discount_amount=to_minor(data.get("total_discount_amount")),
+    )
+
+class ApiReceiptItem(TypedDict, total=False):
+    """Позиция чека в формате API веб-приложения."""
+    description: str
+    quantity: Decimal
+    unit_price_from_openai: Optional[Decimal]
+    total_amount: Optional[Decimal]
+    discount_percent: Optional[Decimal]
+    discount_amount: Optional[Decimal]
+
+class ApiReceipt(TypedDict, total=False):
+    """Чек в формате API веб-приложения (суммы и проценты — обычные числа)."""
+    items: List[ApiReceiptItem]
+    service_charge_percent: Optional[Decimal]
+    total_check_amount: Optional[Decimal]
+    total_discount_percent: Optional[Decimal]
+    total_discount_amount: Optional[Decimal]
+    actual_discount_percent: Optional[Decimal]
+    user_selections: Dict[str, Dict[str, SelectionValue]]
+    user_results: Dict[str, Dict[str, Any]]
+    payments: Dict[str, Decimal]
+
+@lru_cache(maxsize=1)
+def api_receipt_adapter() -> TypeAdapter:
+    """TypeAdapter для валидации данных чека, пришедших через API."""
+    return TypeAdapter(ApiReceipt)
+
+@lru_cache(maxsize=1)
+def receipt_record_adapter() -> TypeAdapter:
+    """TypeAdapter для сериализации ReceiptRecord (кэш распознавания, хранилища)."""
+    return TypeAdapter(ReceiptRecord)
+
+def receipt_from_api(payload: Any) -> ReceiptRecord:
+    """
+    Строит ReceiptRecord из данных API веб-приложения.
+
+    Raises:
+        pydantic.ValidationError: Если данные не соответствуют формату ApiReceipt
+    """
+    data = api_receipt_adapter().validate_python(payload)
+    return ReceiptRecord(
+        items=[
+            ReceiptLine(
+                description=item.get("description", "N/A"),
+                quantity=parse_quantity(item.get("quantity", 1)),
+                unit_price=to_minor(item.get("unit_price_from_openai")),
+                total_amount=to_minor(item.get("total_amount")),
+                discount_percent=to_basis_points(item.get("discount_percent")),
+                discount_amount=to_minor(item.get("discount_amount")),
+            )
+            for item in data.get("items", [])
+        ],
+        service_charge_percent=to_basis_points(data.get("service_charge_percent")),
+        total_check_amount=to_minor(data.get("total_check_amount")),
+        total_discount_percent=to_basis_points(data.get("total_discount_percent")),
+        total_discount_amount=to_minor(data.get("total_discount_amount")),
+        user_selections=data.get("user_selections", {}),
+        user_results=data.get("user_results", {}),
+        payments={user: to_minor(amount) for user, amount in data.get("payments", {}).items()},
+    )
+
+def _api_number(value: Optional[int]) -> Optional[float]:
+    """Минимальные единицы (или сотые доли процента) → число для JSON."""
+    return value / MINOR_UNITS if value is not None else None
+
+def receipt_to_api(receipt: ReceiptRecord) -> Dict[str, Any]:
+    """
+    Данные чека в формате API веб-приложения (числа вместо минимальных единиц).
+
+    Итоги в блоке pricing берутся из расчета чека (utils.pricing), тем же, что использует бот.
+    """
+    # utils.pricing импортирует этот модуль, поэтому импорт внутри функции
+    from utils.pricing import pricing_plan
+    plan = pricing_plan(receipt)
+    actual_discount_percent = plan.discount_percent if plan.discount else None
+    return {
+        "items": [
+            {
+                "description": item.description,
+                "quantity": item.quantity,
+                "unit_price_from_openai": _api_number(item.unit_price),
+                "total_amount": _api_number(item.total_amount),
+                "discount_percent": _api_number(item.discount_percent),
+                "discount_amount": _api_number(item.discount_amount),
+            }
+            for item in receipt.items
+        ],
+        "service_charge_percent": _api_number(receipt.service_charge_percent),
+        "total_check_amount": _api_number(receipt.total_check_amount),
+        "total_discount_percent": _api_number(receipt.total_discount_percent),
+        "total_discount_amount": _api_number(receipt.total_discount_amount),
+        "actual_discount_percent": _api_number(actual_discount_percent),
+        "user_selections": receipt.user_selections,
+        "user_results": receipt.user_results,
+        "payments": {user: _api_number(amount) for user, amount in receipt.payments.items()},
+        "version": receipt.version,
+        "pricing": {
+            "line_totals": [_api_number(amount) for amount in plan.line_totals],
+            "items_total": _api_number(plan.items_total),
+            "discount_amount": _api_number(plan.discount),
+            "service_charge_amount": _api_number(plan.service_charge),
+            "total": _api_number(plan.total),
+        },
+    }
+
+#: Поля участников, изменения которых отдает receipt_changes_to_api
+CHANGE_FIELDS = ("user_selections", "user_results", "payments")
+
+def receipt_changes_to_api(receipt: ReceiptRecord, since: int) -> Optional[Dict[str, Any]]:
+    """
+    Выборы, итоги и оплаты участников, измененные после версии since.
+
+    Returns:
+        {"version", "since", "changes": {поле: {user_id: значение}}} или None, если изменения
+        с этой версии не восстановить (чек с тех пор сохранен целиком или версия неизвестна)
+    """
+    if since < receipt.base_version or since > receipt.version:
+        return None
+    changes: Dict[str, Dict[str, Any]] = {}
+    for field_name in CHANGE_FIELDS:
+        values = getattr(receipt, field_name)
+        changed = {
+            user: values[user]
+            for user, version in receipt.changes.get(field_name, {}).items()
+            if version > since and user in values
+        }
+        if field_name == "payments":
+            changed = {user: _api_number(amount) for user, amount in changed.items()}
+        changes[field_name] = changed
+    return {"version": receipt.version, "since": since, "changes": changes}
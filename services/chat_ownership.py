@@ -0,0 +1,204 @@
+import json
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from aiogram import Bot, Dispatcher
+from aiogram.types import TelegramObject, Update
+from config.settings import (
+    REDIS_PREFIX,
+    NODE_ID,
+    CHAT_OWNERSHIP_ENABLED,
+    CHAT_LEASE_SECONDS,
+    NODE_HEARTBEAT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Возвращает владельца чата: продлевает аренду, если чат уже за ARGV[1], оставляет
+# другого владельца, если его процесс жив, иначе закрепляет чат за ARGV[1]
+_ACQUIRE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return owner
+end
+if owner and redis.call('EXISTS', ARGV[3] .. owner) == 1 then
+    return owner
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return ARGV[1]
+"""
+
+class ChatOwnership:
+    """
+    Закрепление чатов за процессами бота при нескольких экземплярах за одним webhook.
+
+    Telegram отправляет апдейты на один URL, а балансировщик раздает их процессам
+    произвольно. Процесс, первым получивший апдейт чата, берет аренду чата
+    (<prefix>:lease:chat:<chat_id> = node_id на lease_seconds), и каждый следующий
+    апдейт ее продлевает (и локальный, и пересланный). Апдейты этого чата, пришедшие
+    в другие процессы, пересылаются владельцу через его очередь <prefix>:inbox:<node_id>.
+    Владелец, как и aiogram для своих апдейтов, запускает обработку каждого апдейта
+    отдельной задачей в порядке поступления, не дожидаясь предыдущих: обработчики
+    одного чата идут параллельно, поэтому фото альбома собираются вместе, а нажатия
+    кнопок не ждут распознавания. Так альбомы, прогресс распознавания и выбор
+    участников одного чата остаются в памяти одного процесса. Живость процесса подтверждается ключом
+    <prefix>:node:<node_id>; чат остановленного процесса забирает первый, к кому
+    придет апдейт.
+    """
+
+    def __init__(self, redis: Any, node_id: str = NODE_ID, prefix: str = REDIS_PREFIX,
+                 lease_seconds: float = CHAT_LEASE_SECONDS, heartbeat_seconds: float = NODE_HEARTBEAT_SECONDS):
+        """
+        Args:
+            redis: Клиент redis.asyncio
+            node_id: Идентификатор процесса
+            prefix: Префикс ключей
+            lease_seconds: Срок аренды чата без новых апдейтов
+            heartbeat_seconds: Срок жизни ключа живости процесса (обновляется втрое чаще)
+        """
+        self._redis = redis
+        self.node_id = node_id
+        self._prefix = prefix
+        self._lease_ms = int(lease_seconds * 1000)
+        self._heartbeat_ms = int(heartbeat_seconds * 1000)
+        self._acquire = redis.register_script(_ACQUIRE_SCRIPT)
+        self._tasks: List[asyncio.Task] = []
+        self._handling: Set[asyncio.Task] = set()
+        self._bot: Optional[Bot] = None
+        self._dispatcher: Optional[Dispatcher] = None
+        self.local = 0
+        self.forwarded = 0
+        self.received = 0
+
+    def _node_key(self, node_id: str) -> str:
+        return f"{self._prefix}:node:{node_id}"
+
+    def _inbox_key(self, node_id: str) -> str:
+        return f"{self._prefix}:inbox:{node_id}"
+
+    async def owner_of(self, chat_id: int) -> str:
+        """Возвращает node_id владельца чата, при необходимости закрепляя чат за этим процессом."""
+        owner = await self._acquire(
+            keys=[f"{self._prefix}:lease:chat:{chat_id}"],
+            args=[self.node_id, self._lease_ms, f"{self._prefix}:node:"],
+        )
+        return owner.decode("utf-8") if isinstance(owner, bytes) else owner
+
+    async def middleware(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        """Внешний middleware апдейтов: обрабатывает апдейт здесь или пересылает владельцу чата."""
+        chat = data.get("event_chat")
+        if chat is None:
+            return await handler(event, data)
+        if data.get("forwarded"):
+            # Апдейт уже у владельца: только продлеваем аренду, чтобы чат не ушел другому процессу
+            try:
+                await self.owner_of(chat.id)
+            except Exception as e:
+                logger.error(f"Ошибка продления аренды чата {chat.id}: {e}")
+            return await handler(event, data)
+        try:
+            owner = await self.owner_of(chat.id)
+            if owner != self.node_id:
+                envelope = {"chat_id": chat.id, "update": event.model_dump(mode="json", exclude_unset=True)}
+                await self._redis.rpush(self._inbox_key(owner), json.dumps(envelope, ensure_ascii=False))
+                self.forwarded += 1
+                logger.debug(f"Апдейт {event.update_id} чата {chat.id} переслан владельцу {owner}")
+                return None
+        except Exception as e:
+            # Redis недоступен: лучше обработать апдейт без упорядочивания, чем потерять его
+            logger.error(f"Ошибка определения владельца чата {chat.id}: {e}")
+        self.local += 1
+        return await handler(event, data)
+
+    async def start(self, dispatcher: Dispatcher, bot: Bot) -> None:
+        """Регистрирует процесс и запускает прием пересланных апдейтов."""
+        self._dispatcher = dispatcher
+        self._bot = bot
+        await self._redis.set(self._node_key(self.node_id), 1, px=self._heartbeat_ms)
+        self._tasks = [asyncio.create_task(self._heartbeat()), asyncio.create_task(self._consume())]
+        logger.info(f"Процесс {self.node_id} принимает апдейты закрепленных чатов")
+
+    async def stop(self) -> None:
+        """Снимает регистрацию процесса и обрабатывает оставшиеся в очереди апдейты."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            await self._redis.delete(self._node_key(self.node_id))
+            while (raw := await self._redis.lpop(self._inbox_key(self.node_id))) is not None:
+                self._dispatch(raw)
+        except Exception as e:
+            logger.error(f"Ошибка при остановке приема апдейтов: {e}")
+        if self._handling:
+            await asyncio.gather(*self._handling, return_exceptions=True)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self._heartbeat_ms / 3000)
+            try:
+                await self._redis.set(self._node_key(self.node_id), 1, px=self._heartbeat_ms)
+            except Exception as e:
+                logger.error(f"Ошибка обновления heartbeat процесса {self.node_id}: {e}")
+
+    async def _consume(self) -> None:
+        inbox = self._inbox_key(self.node_id)
+        while True:
+            try:
+                item = await self._redis.blpop([inbox], timeout=5)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка чтения очереди апдейтов: {e}")
+                await asyncio.sleep(1)
+                continue
+            if item is not None:
+                self._dispatch(item[1])
+
+    def _dispatch(self, raw: bytes) -> None:
+        """
+        Запускает обработку пересланного апдейта отдельной задачей.
+
+        Как и в webhook, задачи стартуют в порядке поступления, а обработчики
+        не ждут друг друга (сбор альбома и распознавание не задерживают чат).
+        """
+        self.received += 1
+        try:
+            update = json.loads(raw)["update"]
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Пересланный апдейт не читается: {e}")
+            return
+        task = asyncio.create_task(self._feed(update))
+        self._handling.add(task)
+        task.add_done_callback(self._handling.discard)
+
+    async def _feed(self, data: Dict[str, Any]) -> None:
+        try:
+            update = Update.model_validate(data, context={"bot": self._bot})
+            await self._dispatcher.feed_update(self._bot, update, forwarded=True)
+        except Exception as e:
+            logger.error(f"Ошибка обработки пересланного апдейта: {e}", exc_info=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "node_id": self.node_id,
+            "local": self.local,
+            "forwarded": self.forwarded,
+            "received": self.received,
+        }
+
+def create_chat_ownership() -> Optional[ChatOwnership]:
+    """Создает закрепление чатов, если оно включено (CHAT_OWNERSHIP_ENABLED, нужен REDIS_URL)."""
+    if not CHAT_OWNERSHIP_ENABLED:
+        return None
+    from services.redis_client import get_redis
+    return ChatOwnership(get_redis())
+
+# Глобальный экземпляр; None при работе одним процессом
+chat_ownership = create_chat_ownership()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+import aiohttp
+from config.settings import (
+    HTTP_POOL_LIMIT,
+    HTTP_POOL_LIMIT_PER_HOST,
+    HTTP_DNS_CACHE_SECONDS,
+    HTTP_KEEPALIVE_SECONDS,
+    HTTP_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+class HttpClientManager:
+    """
+    Общий пул исходящих HTTP-соединений приложения.
+
+    Одна ClientSession на процесс: соединения с одним хостом переиспользуются
+    (keep-alive, без повторных TLS-рукопожатий), число соединений ограничено
+    на весь процесс и на каждый хост, DNS-ответы кэшируются. Создается в
+    main.create_app() и закрывается при остановке; Telegram Bot API и OpenAI
+    ходят через собственные пулы aiogram и openai.
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 20, dns_cache_seconds: float = 300,
+                 keepalive_seconds: float = 30, timeout: float = 10.0):
+        """
+        Args:
+            limit: Максимум одновременных соединений
+            limit_per_host: Максимум одновременных соединений с одним хостом
+            dns_cache_seconds: Время жизни DNS-кэша
+            keepalive_seconds: Сколько держать простаивающее соединение открытым
+            timeout: Таймаут запроса по умолчанию в секундах
+        """
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._dns_cache_seconds = dns_cache_seconds
+        self._keepalive_seconds = keepalive_seconds
+        self._timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        """Счетчики запросов и соединений для /api/stats."""
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params) -> None:
+            self.requests += 1
+
+        async def on_connection_create_end(session, context, params) -> None:
+            self.connections_created += 1
+
+        async def on_connection_reuseconn(session, context, params) -> None:
+            self.connections_reused += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self._limit,
+            limit_per_host=self._limit_per_host,
+            ttl_dns_cache=self._dns_cache_seconds,
+            keepalive_timeout=self._keepalive_seconds,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self._timeout),
+            trace_configs=[self._trace_config()],
+        )
+
+    async def start(self) -> None:
+        """Создает пул в текущем event loop (повторный вызов ничего не делает)."""
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+            self._loop = asyncio.get_running_loop()
+            logger.info(f"Пул HTTP-соединений: до {self._limit} соединений, до {self._limit_per_host} на хост")
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Общая сессия; создается при первом обращении, если start() еще не вызывался."""
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+            self._loop = asyncio.get_running_loop()
+        return self._session
+
+    async def post_json(self, url: str, payload: Any, timeout: Optional[float] = None) -> Tuple[int, str]:
+        """
+        POST с JSON-телом через общий пул; возвращает (статус, тело ответа).
+
+        Вызов из другого event loop (отдельный запуск Flask через asyncio.run) идет
+        через временную сессию: сессия пула привязана к loop, в котором создана.
+        """
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout is not None else None
+        if self._loop is not None and self._loop is not asyncio.get_running_loop():
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout or self._timeout)) as session:
+                async with session.post(url, json=payload) as response:
+                    return response.status, await response.text()
+        async with self.session.post(url, json=payload, timeout=request_timeout) as response:
+            return response.status, await response.text()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "open": self._session is not None and not self._session.closed,
+            "limit": self._limit,
+            "limit_per_host": self._limit_per_host,
+            "requests": self.requests,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+        }
+
+    async def close(self) -> None:
+        """Закрывает пул (вызывается при остановке приложения)."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            self._loop = None
+
+# Глобальный пул исходящих HTTP-соединений
+http_client = HttpClientManager(
+    limit=HTTP_POOL_LIMIT,
+    limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+    dns_cache_seconds=HTTP_DNS_CACHE_SECONDS,
+    keepalive_seconds=HTTP_KEEPALIVE_SECONDS,
+    timeout=HTTP_TIMEOUT,
+)
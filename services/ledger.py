@@ -0,0 +1,291 @@
+import os
+import asyncio
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Mapping, Optional
+from config.settings import LEDGER_BACKEND, LEDGER_PATH, REDIS_PREFIX
+from models.receipt import ReceiptRecord
+from utils.settlement import confirmed_receipt, settle_receipt
+
+logger = logging.getLogger(__name__)
+
+def ledger_name(chat_id: int, event: Optional[str] = None) -> str:
+    """Имя журнала взаиморасчетов: весь чат или именованное событие в нем (поездка)."""
+    return f"{chat_id}:{event}" if event else str(chat_id)
+
+class Ledger(ABC):
+    """
+    Журнал взаиморасчетов по многим чекам (поездка, событие, чат).
+
+    Журнал хранит итоговый баланс каждого участника и вклад каждого чека в эти
+    балансы. Когда чек подтверждается повторно, прежний вклад вычитается, а новый
+    прибавляется, поэтому запись чека стоит O(участников чека), а ответ «кто кому
+    должен» — O(участников журнала): чеки при этом не перечитываются.
+    """
+
+    @abstractmethod
+    async def apply(self, ledger: str, message_id: int, balances: Mapping[str, int]) -> None:
+        """Заменяет вклад чека в журнал (balances — оплачено минус доля, минимальные единицы)."""
+
+    @abstractmethod
+    async def balances(self, ledger: str) -> Dict[str, int]:
+        """Ненулевые балансы участников журнала."""
+
+    @abstractmethod
+    async def is_participant(self, ledger: str, user_id: str) -> bool:
+        """Участвовал ли пользователь хотя бы в одном чеке журнала (в том числе с нулевым балансом)."""
+
+    @abstractmethod
+    async def get_event(self, chat_id: int) -> Optional[str]:
+        """Текущее именованное событие чата или None."""
+
+    @abstractmethod
+    async def set_event(self, chat_id: int, event: Optional[str]) -> None:
+        """Начинает именованное событие в чате (None — новые чеки снова идут в журнал чата)."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики журнала для /api/stats."""
+
+    async def close(self) -> None:
+        """Освобождает ресурсы (вызывается при остановке)."""
+        pass
+
+class SQLiteLedger(Ledger):
+    """
+    Журнал в SQLite: балансы (ledger_balance) и вклады чеков (ledger_entry) по первичным
+    ключам, поэтому запись чека и чтение балансов не зависят от числа чеков в журнале.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Путь к файлу SQLite
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.applied = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """Открывает соединение с SQLite и создает таблицы при первом обращении."""
+        if self._conn is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ledger_balance ("
+                "ledger TEXT NOT NULL, user_id TEXT NOT NULL, balance INTEGER NOT NULL, "
+                "PRIMARY KEY (ledger, user_id))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ledger_entry ("
+                "ledger TEXT NOT NULL, message_id INTEGER NOT NULL, user_id TEXT NOT NULL, delta INTEGER NOT NULL, "
+                "PRIMARY KEY (ledger, message_id, user_id))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ledger_participant ("
+                "ledger TEXT NOT NULL, user_id TEXT NOT NULL, PRIMARY KEY (ledger, user_id))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS ledger_event (chat_id INTEGER PRIMARY KEY, event TEXT NOT NULL)")
+            # Участники журналов, записанных до появления ledger_participant
+            conn.execute("INSERT OR IGNORE INTO ledger_participant (ledger, user_id) SELECT DISTINCT ledger, user_id FROM ledger_entry")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _apply(self, ledger: str, message_id: int, balances: Mapping[str, int]) -> None:
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                previous = conn.execute(
+                    "SELECT user_id, delta FROM ledger_entry WHERE ledger = ? AND message_id = ?",
+                    (ledger, message_id)
+                ).fetchall()
+                changes: Dict[str, int] = {}
+                for user_id, delta in previous:
+                    changes[user_id] = changes.get(user_id, 0) - delta
+                for user_id, delta in balances.items():
+                    changes[user_id] = changes.get(user_id, 0) + delta
+                conn.execute("DELETE FROM ledger_entry WHERE ledger = ? AND message_id = ?", (ledger, message_id))
+                conn.executemany(
+                    "INSERT INTO ledger_entry (ledger, message_id, user_id, delta) VALUES (?, ?, ?, ?)",
+                    [(ledger, message_id, user_id, delta) for user_id, delta in balances.items() if delta]
+                )
+                conn.executemany(
+                    "INSERT INTO ledger_balance (ledger, user_id, balance) VALUES (?, ?, ?) "
+                    "ON CONFLICT (ledger, user_id) DO UPDATE SET balance = balance + excluded.balance",
+                    [(ledger, user_id, change) for user_id, change in changes.items() if change]
+                )
+                conn.execute("DELETE FROM ledger_balance WHERE ledger = ? AND balance = 0", (ledger,))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO ledger_participant (ledger, user_id) VALUES (?, ?)",
+                    [(ledger, user_id) for user_id in balances]
+                )
+            self.applied += 1
+
+    def _balances(self, ledger: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT user_id, balance FROM ledger_balance WHERE ledger = ?", (ledger,)
+            ).fetchall()
+        return {user_id: balance for user_id, balance in rows if balance}
+
+    def _is_participant(self, ledger: str, user_id: str) -> bool:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT 1 FROM ledger_participant WHERE ledger = ? AND user_id = ?", (ledger, user_id)
+            ).fetchone()
+        return row is not None
+
+    def _get_event(self, chat_id: int) -> Optional[str]:
+        with self._lock:
+            row = self._connection().execute("SELECT event FROM ledger_event WHERE chat_id = ?", (chat_id,)).fetchone()
+        return row[0] if row else None
+
+    def _set_event(self, chat_id: int, event: Optional[str]) -> None:
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                if event:
+                    conn.execute("INSERT OR REPLACE INTO ledger_event (chat_id, event) VALUES (?, ?)", (chat_id, event))
+                else:
+                    conn.execute("DELETE FROM ledger_event WHERE chat_id = ?", (chat_id,))
+
+    async def apply(self, ledger: str, message_id: int, balances: Mapping[str, int]) -> None:
+        await asyncio.to_thread(self._apply, ledger, message_id, dict(balances))
+
+    async def balances(self, ledger: str) -> Dict[str, int]:
+        return await asyncio.to_thread(self._balances, ledger)
+
+    async def is_participant(self, ledger: str, user_id: str) -> bool:
+        return await asyncio.to_thread(self._is_participant, ledger, user_id)
+
+    async def get_event(self, chat_id: int) -> Optional[str]:
+        return await asyncio.to_thread(self._get_event, chat_id)
+
+    async def set_event(self, chat_id: int, event: Optional[str]) -> None:
+        await asyncio.to_thread(self._set_event, chat_id, event)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "sqlite", "path": self._path, "applied": self.applied}
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# Атомарная замена вклада чека: вычесть прежние дельты, записать и прибавить новые;
+# ARGV — пары user_id, дельта (нулевые дельты только отмечают участника в KEYS[3])
+_APPLY_SCRIPT = """
+local previous = redis.call('HGETALL', KEYS[2])
+for i = 1, #previous, 2 do
+    if redis.call('HINCRBY', KEYS[1], previous[i], -tonumber(previous[i + 1])) == 0 then
+        redis.call('HDEL', KEYS[1], previous[i])
+    end
+end
+redis.call('DEL', KEYS[2])
+for i = 1, #ARGV, 2 do
+    redis.call('SADD', KEYS[3], ARGV[i])
+    if tonumber(ARGV[i + 1]) ~= 0 then
+        redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+        if redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1]) == 0 then
+            redis.call('HDEL', KEYS[1], ARGV[i])
+        end
+    end
+end
+return 1
+"""
+
+class RedisLedger(Ledger):
+    """
+    Журнал в Redis, общий для нескольких процессов бота.
+
+    Балансы журнала — хэш <prefix>:ledger:<name>:balances, вклад чека — хэш
+    <prefix>:ledger:<name>:receipt:<message_id>, участники — множество
+    <prefix>:ledger:<name>:participants; замена вклада выполняется одним скриптом.
+    Ключи журнала не имеют срока жизни.
+    """
+
+    def __init__(self, redis: Any, prefix: str = "splitix"):
+        """
+        Args:
+            redis: Клиент redis.asyncio
+            prefix: Префикс ключей
+        """
+        self._redis = redis
+        self._prefix = prefix
+        self._apply = redis.register_script(_APPLY_SCRIPT)
+        self.applied = 0
+
+    def _key(self, ledger: str, suffix: str) -> str:
+        return f"{self._prefix}:ledger:{ledger}:{suffix}"
+
+    async def apply(self, ledger: str, message_id: int, balances: Mapping[str, int]) -> None:
+        args = []
+        for user_id, delta in balances.items():
+            args.extend([user_id, delta])
+        keys = [self._key(ledger, "balances"), self._key(ledger, f"receipt:{message_id}"), self._key(ledger, "participants")]
+        await self._apply(keys=keys, args=args)
+        self.applied += 1
+
+    async def balances(self, ledger: str) -> Dict[str, int]:
+        fields = await self._redis.hgetall(self._key(ledger, "balances"))
+        return {user_id.decode("utf-8"): int(balance) for user_id, balance in fields.items() if int(balance)}
+
+    async def is_participant(self, ledger: str, user_id: str) -> bool:
+        if await self._redis.sismember(self._key(ledger, "participants"), user_id):
+            return True
+        # Журналы, записанные до появления множества участников
+        return bool(await self._redis.hexists(self._key(ledger, "balances"), user_id))
+
+    async def get_event(self, chat_id: int) -> Optional[str]:
+        event = await self._redis.get(f"{self._prefix}:ledger:event:{chat_id}")
+        return event.decode("utf-8") if event is not None else None
+
+    async def set_event(self, chat_id: int, event: Optional[str]) -> None:
+        key = f"{self._prefix}:ledger:event:{chat_id}"
+        if event:
+            await self._redis.set(key, event)
+        else:
+            await self._redis.delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis", "prefix": self._prefix, "applied": self.applied}
+
+async def chat_ledger(chat_id: int) -> str:
+    """Журнал, в который идут новые чеки чата: текущее событие или весь чат."""
+    try:
+        return ledger_name(chat_id, await ledger.get_event(chat_id))
+    except Exception as e:
+        logger.error(f"Ошибка чтения события чата {chat_id}: {e}")
+        return ledger_name(chat_id)
+
+async def record_receipt(message_id: int, receipt: ReceiptRecord) -> None:
+    """
+    Записывает взаиморасчет чека по подтвержденному выбору участников в его журнал
+    (если чек привязан к журналу). receipt — состояние чека после последнего изменения.
+    """
+    if receipt.ledger is None:
+        return
+    try:
+        await ledger.apply(receipt.ledger, message_id, settle_receipt(confirmed_receipt(receipt)).balances)
+    except Exception as e:
+        logger.error(f"Ошибка записи чека message_id={message_id} в журнал {receipt.ledger}: {e}")
+
+def create_ledger(backend: str = LEDGER_BACKEND) -> Ledger:
+    """Создает журнал взаиморасчетов по настройке LEDGER_BACKEND."""
+    if backend == "redis":
+        from services.redis_client import get_redis
+        return RedisLedger(get_redis(), prefix=REDIS_PREFIX)
+    if backend != "sqlite":
+        logger.warning(f"Неизвестный LEDGER_BACKEND '{backend}', используется sqlite")
+    return SQLiteLedger(LEDGER_PATH)
+
+# Глобальный журнал взаиморасчетов
+ledger = create_ledger()
@@ -0,0 +1,176 @@
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+from config.settings import OPENAI_MODEL, OPENAI_ROUTING_ENABLED, OPENAI_MODEL_TIERS, OPENAI_RECONCILE_TOLERANCE
+from services.resilience import CircuitOpenError, LatencyTracker
+from models.receipt import ReceiptRecord
+from utils.formatters import calculate_totals
+from utils.money import format_minor, to_minor
+
+logger = logging.getLogger(__name__)
+
+IMAGE_DETAILS = ("low", "high", "auto")
+
+class ModelTier(NamedTuple):
+    """Уровень распознавания: модель и детализация изображения."""
+    model: str
+    detail: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.model}:{self.detail}"
+
+#: Попытка распознавания на уровне: возвращает (чек или None, признак восстановленного JSON)
+TierAttempt = Callable[[ModelTier, int], Awaitable[Tuple[Optional[ReceiptRecord], bool]]]
+
+def parse_model_tiers(spec: str, default_model: str = OPENAI_MODEL) -> List[ModelTier]:
+    """
+    Разбирает список уровней вида "gpt-4.1-nano:low,gpt-4.1-mini:high".
+
+    Детализация по умолчанию — auto; некорректные элементы пропускаются.
+    """
+    tiers: List[ModelTier] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        model, _, detail = part.partition(":")
+        detail = detail.strip().lower() or "auto"
+        if detail not in IMAGE_DETAILS:
+            logger.warning(f"Неизвестная детализация изображения '{detail}' в '{part}', уровень пропущен")
+            continue
+        tiers.append(ModelTier(model.strip(), detail))
+    return tiers or [ModelTier(default_model, "auto")]
+
+def reconcile(receipt: Optional[ReceiptRecord], tolerance: int = 1) -> Optional[str]:
+    """
+    Проверяет результат распознавания.
+
+    Args:
+        receipt: Распознанный чек
+        tolerance: Допустимое расхождение в минимальных единицах
+
+    Returns:
+        Причина отказа или None, если результат можно принять: позиции есть и расчетная
+        сумма (calculate_totals) совпадает с итогом чека. Чек без итоговой суммы
+        проверить не с чем, он принимается.
+    """
+    if receipt is None or not receipt.items:
+        return "позиции не распознаны"
+    if receipt.total_check_amount is None:
+        return None
+    calculated_total, _, _ = calculate_totals(receipt)
+    if abs(calculated_total - receipt.total_check_amount) > tolerance:
+        return (f"расчетная сумма {format_minor(calculated_total)} не совпадает "
+                f"с итогом чека {format_minor(receipt.total_check_amount)}")
+    return None
+
+class TierStats:
+    """Счетчики одного уровня."""
+
+    def __init__(self):
+        self.requests = 0
+        self.answered = 0
+        self.escalated = 0
+        self.errors = 0
+        self.latency = LatencyTracker()
+
+    def to_dict(self) -> Dict[str, Any]:
+        p50 = self.latency.percentile(0.5)
+        p95 = self.latency.percentile(0.95)
+        return {
+            "requests": self.requests,
+            "answered": self.answered,
+            "escalated": self.escalated,
+            "errors": self.errors,
+            "latency_p50_s": round(p50, 3) if p50 is not None else None,
+            "latency_p95_s": round(p95, 3) if p95 is not None else None,
+        }
+
+class ModelRouter:
+    """
+    Маршрутизация распознавания по уровням моделей.
+
+    Сначала чек распознается самым дешевым уровнем (быстрая модель, низкая детализация).
+    Следующий уровень используется, только если результат не прошел сверку (reconcile),
+    JSON пришлось восстанавливать или запрос завершился ошибкой.
+    """
+
+    def __init__(self, tiers: List[ModelTier], tolerance: int = 1):
+        """
+        Args:
+            tiers: Уровни в порядке эскалации
+            tolerance: Допустимое расхождение расчетной суммы с итогом чека в минимальных единицах
+        """
+        self.tiers = tiers
+        self._tolerance = tolerance
+        self._stats: Dict[str, TierStats] = {tier.name: TierStats() for tier in tiers}
+
+    @property
+    def signature(self) -> str:
+        """Строка с уровнями маршрутизации (входит в ключ кэша распознавания)."""
+        return ",".join(tier.name for tier in self.tiers)
+
+    async def recognize(self, attempt: TierAttempt) -> Tuple[Optional[ReceiptRecord], bool, ModelTier]:
+        """
+        Распознает чек, поднимаясь по уровням до первого результата, прошедшего сверку.
+
+        Args:
+            attempt: Функция распознавания на заданном уровне (уровень и его номер)
+
+        Returns:
+            (чек или None, признак восстановленного JSON, уровень, давший результат)
+
+        Raises:
+            CircuitOpenError: Если OpenAI недоступен
+        """
+        best: Optional[Tuple[ReceiptRecord, bool, ModelTier]] = None
+        last_index = len(self.tiers) - 1
+        for index, tier in enumerate(self.tiers):
+            stats = self._stats[tier.name]
+            stats.requests += 1
+            started = time.monotonic()
+            try:
+                result, repaired = await attempt(tier, index)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                stats.errors += 1
+                if index == last_index and best is None:
+                    raise
+                logger.warning(f"Уровень {tier.name}: ошибка распознавания {type(e).__name__}: {e}")
+                continue
+            duration = time.monotonic() - started
+            stats.latency.record(duration)
+
+            reason = "ответ пришлось восстанавливать" if repaired else reconcile(result, self._tolerance)
+            # Если ни один уровень не пройдет сверку, берем результат самого сильного уровня
+            if result is not None and result.items and (best is None or not repaired):
+                best = (result, repaired, tier)
+            if reason is None:
+                stats.answered += 1
+                logger.info(f"Чек распознан на уровне {tier.name} за {duration:.2f} с")
+                return result, repaired, tier
+            if index < last_index:
+                stats.escalated += 1
+                logger.info(f"Уровень {tier.name} ({duration:.2f} с): {reason}, переходим к {self.tiers[index + 1].name}")
+            else:
+                logger.warning(f"Уровень {tier.name} ({duration:.2f} с): {reason}, более сильных уровней нет")
+
+        if best is None:
+            return None, False, self.tiers[last_index]
+        self._stats[best[2].name].answered += 1
+        return best
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика по уровням: сколько чеков принято, сколько эскалировано, задержки."""
+        return {
+            "enabled": len(self.tiers) > 1,
+            "tiers": {name: stats.to_dict() for name, stats in self._stats.items()},
+        }
+
+# Глобальный маршрутизатор; без маршрутизации используется один уровень OPENAI_MODEL
+model_router = ModelRouter(
+    parse_model_tiers(OPENAI_MODEL_TIERS) if OPENAI_ROUTING_ENABLED else [ModelTier(OPENAI_MODEL, "auto")],
+    tolerance=to_minor(OPENAI_RECONCILE_TOLERANCE) or 0,
+)
@@ -0,0 +1,230 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from config.settings import OCR_MAX_CONCURRENCY, OCR_MAX_QUEUE, OCR_MAX_JOBS_PER_USER
+
+logger = logging.getLogger(__name__)
+
+#: Callback, получающий позицию задачи в очереди (1 — следующая, 0 — задача запущена)
+PositionCallback = Callable[[int], None]
+
+class QueueFullError(Exception):
+    """Очередь распознавания переполнена или у пользователя слишком много задач."""
+
+class OcrJob:
+    """Задача распознавания в очереди."""
+
+    __slots__ = ("chat_id", "user_id", "factory", "future", "on_position", "position", "group")
+
+    def __init__(self, chat_id: int, user_id: int, factory: Callable[[], Awaitable[Any]],
+                 on_position: Optional[PositionCallback], group: List[int]):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.factory = factory
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.on_position = on_position
+        self.position = -1
+        # Общий счетчик незавершенных задач группы: группа занимает один слот пользователя
+        self.group = group
+
+class OcrScheduler:
+    """
+    Планировщик запросов на распознавание чеков.
+
+    Ограничивает число одновременных запросов к OpenAI, раздает слоты между чатами
+    по кругу (один активный чат не забивает очередь остальным), ограничивает число
+    задач одного пользователя и отклоняет новые задачи при переполнении очереди.
+    """
+
+    def __init__(self, max_concurrency: int = 4, max_queue: int = 50, max_jobs_per_user: int = 2):
+        """
+        Args:
+            max_concurrency: Максимальное число одновременно выполняемых задач
+            max_queue: Максимальное число задач, ожидающих в очереди
+            max_jobs_per_user: Максимальное число задач одного пользователя (в очереди и в работе)
+        """
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
+        self._max_jobs_per_user = max_jobs_per_user
+        self._queues: "OrderedDict[int, Deque[OcrJob]]" = OrderedDict()
+        self._user_jobs: Dict[int, int] = {}
+        self._queued = 0
+        self._running = 0
+
+    @property
+    def queued(self) -> int:
+        """Количество задач в очереди."""
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        """Количество выполняемых задач."""
+        return self._running
+
+    async def run(self, chat_id: int, user_id: int, factory: Callable[[], Awaitable[Any]],
+                  on_position: Optional[PositionCallback] = None) -> Any:
+        """
+        Ставит задачу в очередь и дожидается ее результата.
+
+        Args:
+            chat_id: ID чата (единица справедливого распределения)
+            user_id: ID пользователя
+            factory: Функция без аргументов, возвращающая корутину с работой
+            on_position: Вызывается при изменении позиции задачи в очереди
+
+        Raises:
+            QueueFullError: Если очередь заполнена или превышен лимит задач пользователя
+        """
+        return (await self.run_many(chat_id, user_id, [factory], on_position))[0]
+
+    async def run_many(self, chat_id: int, user_id: int, factories: List[Callable[[], Awaitable[Any]]],
+                       on_position: Optional[PositionCallback] = None) -> List[Any]:
+        """
+        Ставит в очередь группу задач (например, фото одного альбома) и дожидается всех результатов.
+
+        Группа занимает один слот в лимите задач пользователя, но каждая задача
+        выполняется в своем слоте общей конкуренции, поэтому задачи группы идут параллельно.
+        on_position сообщает позицию первой задачи группы.
+
+        Raises:
+            QueueFullError: Если очередь заполнена или превышен лимит задач пользователя
+        """
+        if self._user_jobs.get(user_id, 0) >= self._max_jobs_per_user:
+            raise QueueFullError(f"У пользователя {user_id} уже {self._max_jobs_per_user} задач в обработке")
+        if self._queued + len(factories) > self._max_queue:
+            raise QueueFullError(f"Очередь распознавания заполнена ({self._max_queue})")
+
+        group = [len(factories)]
+        jobs = [
+            OcrJob(chat_id, user_id, factory, on_position if index == 0 else None, group)
+            for index, factory in enumerate(factories)
+        ]
+        self._queues.setdefault(chat_id, deque()).extend(jobs)
+        self._queued += len(jobs)
+        self._user_jobs[user_id] = self._user_jobs.get(user_id, 0) + 1
+        logger.debug(f"OCR-задачи поставлены в очередь: chat_id={chat_id}, user_id={user_id}, "
+                     f"задач {len(jobs)}, в очереди {self._queued}")
+
+        self._dispatch()
+        try:
+            results = await asyncio.shield(asyncio.gather(*(job.future for job in jobs), return_exceptions=True))
+        except asyncio.CancelledError:
+            for job in jobs:
+                self._cancel(job)
+            raise
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    def _cancel(self, job: OcrJob) -> None:
+        """Убирает из очереди задачу, ожидание которой было отменено."""
+        queue = self._queues.get(job.chat_id)
+        if queue is None or job not in queue:
+            return
+        queue.remove(job)
+        if not queue:
+            del self._queues[job.chat_id]
+        self._queued -= 1
+        self._finish(job)
+        self._notify_positions()
+
+    def _finish(self, job: OcrJob) -> None:
+        """Отмечает завершение задачи; последняя задача группы освобождает слот пользователя."""
+        job.group[0] -= 1
+        if job.group[0] == 0:
+            self._release_user(job.user_id)
+
+    def _release_user(self, user_id: int) -> None:
+        """Уменьшает счетчик задач пользователя."""
+        count = self._user_jobs.get(user_id, 0) - 1
+        if count > 0:
+            self._user_jobs[user_id] = count
+        else:
+            self._user_jobs.pop(user_id, None)
+
+    def _next_job(self) -> Optional[OcrJob]:
+        """Берет следующую задачу по кругу между чатами."""
+        if not self._queues:
+            return None
+        chat_id, queue = self._queues.popitem(last=False)
+        job = queue.popleft()
+        if queue:
+            # Чат с оставшимися задачами уходит в конец круга
+            self._queues[chat_id] = queue
+        self._queued -= 1
+        return job
+
+    def _dispatch(self) -> None:
+        """Запускает задачи, пока есть свободные слоты."""
+        while self._running < self._max_concurrency:
+            job = self._next_job()
+            if job is None:
+                break
+            self._running += 1
+            self._set_position(job, 0)
+            asyncio.create_task(self._execute(job))
+        self._notify_positions()
+
+    async def _execute(self, job: OcrJob) -> None:
+        """Выполняет задачу и освобождает слот."""
+        try:
+            result = await job.factory()
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._running -= 1
+            self._finish(job)
+            self._dispatch()
+
+    def _round_robin_order(self) -> List[OcrJob]:
+        """Порядок, в котором будут запущены ожидающие задачи."""
+        order: List[OcrJob] = []
+        queues = [list(queue) for queue in self._queues.values()]
+        depth = 0
+        while len(order) < self._queued:
+            for queue in queues:
+                if depth < len(queue):
+                    order.append(queue[depth])
+            depth += 1
+        return order
+
+    def _notify_positions(self) -> None:
+        """Сообщает ожидающим задачам их новую позицию в очереди."""
+        if not self._queued:
+            return
+        for index, job in enumerate(self._round_robin_order(), start=1):
+            self._set_position(job, index)
+
+    @staticmethod
+    def _set_position(job: OcrJob, position: int) -> None:
+        """Вызывает callback, если позиция задачи изменилась."""
+        if job.position == position:
+            return
+        job.position = position
+        if job.on_position is not None:
+            try:
+                job.on_position(position)
+            except Exception as e:
+                logger.warning(f"Ошибка в callback позиции очереди: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        """Текущая загрузка планировщика."""
+        return {
+            "running": self._running,
+            "queued": self._queued,
+            "chats_waiting": len(self._queues),
+            "max_concurrency": self._max_concurrency,
+            "max_queue": self._max_queue,
+        }
+
+# Глобальный экземпляр планировщика
+ocr_scheduler = OcrScheduler(
+    max_concurrency=OCR_MAX_CONCURRENCY,
+    max_queue=OCR_MAX_QUEUE,
+    max_jobs_per_user=OCR_MAX_JOBS_PER_USER,
+)
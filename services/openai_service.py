@@ -1,16 +1,29 @@
 import json
+import asyncio
 import logging
 import base64
-from decimal import Decimal, InvalidOperation
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 from openai import AsyncOpenAI
-from config.settings import OPENAI_API_KEY, OPENAI_MODEL, OPENAI_MAX_TOKENS
-from utils.data_utils import parse_possible_price, parse_quantity
-from models.receipt import Receipt, ReceiptItem
+from config.settings import OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL, OPENAI_MAX_TOKENS, OPENAI_TIMEOUT, OPENAI_STREAMING_ENABLED, OPENAI_STRUCTURED_OUTPUT, RECOGNITION_CACHE_ENABLED
+from models.receipt import ReceiptRecord, receipt_from_ocr, receipt_json_schema
+from services.recognition_cache import recognition_cache
+from services.resilience import CircuitOpenError, openai_caller
+from services.model_router import ModelTier, model_router
+from utils.image_processing import preprocess_receipt_image
+from utils.json_stream import IncrementalItemsParser
+from utils.json_repair import repair_json
+from utils.metrics import pipeline_metrics
 
 logger = logging.getLogger(__name__)
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+#: Callback, который получает сырые позиции чека по мере их появления в потоке
+ItemCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Повторы выполняет openai_caller, поэтому встроенные повторы клиента отключены
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0, timeout=OPENAI_TIMEOUT)
+
+#: Версия промпта; входит в ключ кэша распознавания, поэтому меняется при каждой правке промпта
+RECEIPT_OCR_PROMPT_VERSION = "1"
 
 #: Промпт для анализа чека через OpenAI Vision
 RECEIPT_OCR_PROMPT = """
@@ -49,67 +62,44 @@ RECEIPT_OCR_PROMPT = """
 
 def clean_openai_json_response(response_text: str) -> str:
     """
-    Очищает ответ OpenAI от markdown и возвращает чистый JSON-текст.
+    Очищает ответ OpenAI от markdown и пояснений и возвращает чистый JSON-текст.
     """
     text = response_text.strip()
-    if text.startswith("```json"):
-        json_start = text.find("{")
-        json_end = text.rfind("}")
-        if json_start != -1 and json_end != -1:
-            return text[json_start:json_end+1]
-        return text.replace("```json", "").replace("```", "").strip()
-    return text
-
-def extract_items_from_openai_response(parsed_json_data: dict) -> Tuple[Optional[List[Dict]], Optional[Decimal], Optional[Decimal], Optional[Decimal], Optional[Decimal]]:
-    """Извлекает и нормализует данные о товарах и скидках из ответа OpenAI."""
-    logger.info("Начало извлечения данных из ответа OpenAI.")
-    if not parsed_json_data or "items" not in parsed_json_data or not isinstance(parsed_json_data["items"], list):
-        logger.warning(f"Неожиданный формат JSON от OpenAI или нет ключа 'items': {parsed_json_data}")
-        return None, None, None, None, None
+    if text.startswith("{") and text.endswith("}"):
+        return text
+    json_start = text.find("{")
+    json_end = text.rfind("}")
+    if json_start != -1 and json_end > json_start:
+        return text[json_start:json_end+1]
+    return text.replace("```json", "").replace("```", "").strip()
 
+def extract_items_from_openai_response(parsed_json_data: dict) -> Optional[ReceiptRecord]:
+    """Извлекает и нормализует данные о товарах и скидках из ответа OpenAI (один проход, без повторной валидации)."""
+    logger.info("Начало извлечения данных из ответа OpenAI.")
     try:
-        # Создаем объект Receipt из данных
-        receipt = Receipt(
-            items=[
-                ReceiptItem(
-                    description=item.get("description", "N/A"),
-                    quantity_from_openai=parse_quantity(item.get("quantity", 1)),
-                    unit_price_from_openai=parse_possible_price(item.get("unit_price")),
-                    total_amount_from_openai=parse_possible_price(item.get("total_amount")),
-                    discount_percent=parse_possible_price(item.get("discount_percent")),
-                    discount_amount=parse_possible_price(item.get("discount_amount"))
-                )
-                for item in parsed_json_data["items"]
-                if isinstance(item, dict)
-            ],
-            service_charge_percent=parsed_json_data.get("service_charge_percent"),
-            total_check_amount=parsed_json_data.get("total_check_amount"),
-            total_discount_percent=parsed_json_data.get("total_discount_percent"),
-            total_discount_amount=parsed_json_data.get("total_discount_amount")
-        )
-
-        # Конвертируем обратно в словари для совместимости
-        processed_items = [item.model_dump() for item in receipt.items]
+        receipt = receipt_from_ocr(parsed_json_data) if isinstance(parsed_json_data, dict) else None
+        if receipt is None:
+            logger.warning(f"Неожиданный формат JSON от OpenAI или нет ключа 'items': {parsed_json_data}")
+            return None
         
-        logger.info(f"Извлечено {len(processed_items)} товаров из ответа OpenAI.")
+        logger.info(f"Извлечено {len(receipt.items)} товаров из ответа OpenAI.")
         logger.info(f"service_charge: {receipt.service_charge_percent}; total_check_amount: {receipt.total_check_amount}; "
                    f"total_discount_amount: {receipt.total_discount_amount}; total_discount_percent: {receipt.total_discount_percent}")
-        
-        return (
-            processed_items,
-            receipt.service_charge_percent,
-            receipt.total_check_amount,
-            receipt.total_discount_percent,
-            receipt.total_discount_amount
-        )
+        return receipt
     except Exception as e:
         logger.error(f"Ошибка при обработке данных чека: {e}", exc_info=True)
-        return None, None, None, None, None
+        return None
 
-def prepare_openai_request(base64_image: str) -> dict:
-    """Подготавливает запрос к OpenAI Vision API."""
-    return {
-        "model": OPENAI_MODEL,
+def prepare_openai_request(base64_image: str, mime_type: str = "image/jpeg",
+                           model: str = OPENAI_MODEL, detail: str = "auto") -> dict:
+    """
+    Подготавливает запрос к OpenAI Vision API.
+
+    При OPENAI_STRUCTURED_OUTPUT ответ ограничивается JSON-схемой чека (receipt_json_schema).
+    detail — детализация изображения (low / high / auto), от нее зависит число входных токенов.
+    """
+    request_params = {
+        "model": model,
         "temperature": 0,
         "top_p": 1,
         "messages": [
@@ -120,7 +110,8 @@ def prepare_openai_request(base64_image: str) -> dict:
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
+                            "url": f"data:{mime_type};base64,{base64_image}",
+                            "detail": detail
                         }
                     }
                 ]
@@ -128,47 +119,173 @@ def prepare_openai_request(base64_image: str) -> dict:
         ],
         "max_tokens": OPENAI_MAX_TOKENS
     }
+    if OPENAI_STRUCTURED_OUTPUT:
+        request_params["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "receipt",
+                "strict": True,
+                "schema": receipt_json_schema(),
+            },
+        }
+    return request_params
 
 async def send_openai_request(request_params: dict) -> str:
     """Отправляет запрос к OpenAI API и возвращает ответ."""
-    response = await client.chat.completions.create(**request_params)
+    response = await openai_caller.call(lambda: client.chat.completions.create(**request_params))
     return response.choices[0].message.content
 
-def parse_openai_response(response_text: str) -> Optional[dict]:
-    """Парсит ответ от OpenAI в JSON."""
+async def send_openai_request_stream(request_params: dict, on_item: ItemCallback) -> str:
+    """
+    Отправляет запрос к OpenAI API в streaming-режиме.
+
+    Каждая позиция из массива items передается в on_item, как только ее JSON-объект
+    закрывается в потоке. Возвращает полный текст ответа.
+    Повторы и хеджирование применяются к открытию потока. Если уже начатый поток
+    оборвался, ошибка учитывается предохранителем, а ответ запрашивается заново
+    без потока (с обычными повторами); позиции, уже переданные в on_item, не повторяются.
+    """
+    stream = await openai_caller.call(lambda: client.chat.completions.create(**request_params, stream=True), kind="stream")
+    parser = IncrementalItemsParser()
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            for item in parser.feed(delta):
+                try:
+                    await on_item(item)
+                except Exception as e:
+                    logger.warning(f"Ошибка в обработчике промежуточной позиции: {e}")
+    except Exception as e:
+        openai_caller.record_failure(e)
+        logger.warning(f"Streaming-ответ оборвался после {parser.items_emitted} позиций ({type(e).__name__}: {e}), "
+                       f"запрашиваем ответ без потока")
+        return await send_openai_request(request_params)
+    logger.info(f"Streaming-ответ завершен, позиций получено по ходу: {parser.items_emitted}")
+    return parser.text
+
+def parse_openai_response_with_repair(response_text: str) -> Tuple[Optional[dict], bool]:
+    """
+    Парсит ответ от OpenAI в JSON.
+
+    Если ответ не является валидным JSON (лишняя запятая, обрезанный массив, текст вокруг),
+    пытается восстановить его через repair_json, чтобы не потерять уже оплаченное распознавание.
+
+    Returns:
+        (данные или None, признак того, что ответ пришлось восстанавливать)
+    """
+    clean_text = clean_openai_json_response(response_text)
+    logger.info(f"Подготовленный текст для парсинга JSON: {clean_text[:100]}...")
+    repaired = False
     try:
-        clean_text = clean_openai_json_response(response_text)
-        logger.info(f"Подготовленный текст для парсинга JSON: {clean_text[:100]}...")
         parsed_json_data = json.loads(clean_text)
-        logger.info(f"JSON успешно распарсен, найдено товаров: {len(parsed_json_data.get('items', []))}")
-        return parsed_json_data
     except json.JSONDecodeError as e:
-        logger.error(f"Ошибка при парсинге JSON от OpenAI: {e}")
-        logger.error(f"Полученный текст: {response_text}")
-        return None
+        logger.warning(f"Ответ OpenAI не является валидным JSON ({e}), пробуем восстановить")
+        parsed_json_data = repair_json(response_text)
+        repaired = True
+        if parsed_json_data is None:
+            logger.error(f"Ошибка при парсинге JSON от OpenAI: {e}")
+            logger.error(f"Полученный текст: {response_text}")
+            return None, repaired
+    if not isinstance(parsed_json_data, dict):
+        logger.error(f"Ответ OpenAI не является JSON-объектом: {type(parsed_json_data).__name__}")
+        return None, repaired
+    logger.info(f"JSON успешно распарсен, найдено товаров: {len(parsed_json_data.get('items', []))}")
+    return parsed_json_data, repaired
 
-async def process_receipt_with_openai(image_data: bytes) -> Tuple[Optional[List[Dict]], Optional[Decimal], Optional[Decimal], Optional[Decimal], Optional[Decimal]]:
-    """Отправляет изображение чека в OpenAI Vision, парсит и возвращает нормализованные данные."""
+def parse_openai_response(response_text: str) -> Optional[dict]:
+    """Парсит ответ от OpenAI в JSON, при необходимости восстанавливая его."""
+    return parse_openai_response_with_repair(response_text)[0]
+
+def get_recognition_cache_key(image_data: bytes) -> str:
+    """Ключ кэша распознавания для изображения с текущими уровнями моделей и промптом."""
+    return recognition_cache.make_key(image_data, model_router.signature, RECEIPT_OCR_PROMPT_VERSION)
+
+async def lookup_cached_recognition(image_data: bytes) -> Tuple[Optional[ReceiptRecord], Optional[str]]:
+    """
+    Ищет сохраненный результат распознавания изображения.
+
+    Returns:
+        (результат или None, ключ кэша или None, если кэш выключен); ключ передается
+        в process_receipt_with_openai, чтобы не считать его и не проверять кэш повторно
+    """
+    if not RECOGNITION_CACHE_ENABLED:
+        return None, None
+    cache_key = get_recognition_cache_key(image_data)
+    cached_result = await asyncio.to_thread(recognition_cache.get, cache_key)
+    if cached_result is not None:
+        logger.info(f"Результат распознавания взят из кэша (key={cache_key[:12]}), статистика: {recognition_cache.stats()}")
+    return cached_result, cache_key
+
+async def recognize_with_tier(base64_image: str, mime_type: str, tier: ModelTier,
+                              on_item: Optional[ItemCallback] = None) -> Tuple[Optional[ReceiptRecord], bool]:
+    """
+    Распознает изображение на одном уровне маршрутизации.
+
+    Returns:
+        (распознанный чек или None, признак того, что JSON пришлось восстанавливать)
+    """
+    request_params = prepare_openai_request(base64_image, mime_type, model=tier.model, detail=tier.detail)
+    logger.info(f"Отправляем запрос на анализ изображения в OpenAI, уровень: {tier.name}")
+
+    with pipeline_metrics.stage(f"ocr[{tier.name}]"):
+        if on_item is not None and OPENAI_STREAMING_ENABLED:
+            response_text = await send_openai_request_stream(request_params, on_item)
+        else:
+            response_text = await send_openai_request(request_params)
+    logger.info(f"Получен ответ от OpenAI, длина текста: {len(response_text)} символов")
+    logger.info(f"Полный ответ OpenAI:\n{response_text}")
+
+    with pipeline_metrics.stage("parse"):
+        parsed_json_data, repaired = parse_openai_response_with_repair(response_text)
+        if parsed_json_data is None:
+            return None, repaired
+        return extract_items_from_openai_response(parsed_json_data), repaired
+
+async def process_receipt_with_openai(image_data: bytes, on_item: Optional[ItemCallback] = None,
+                                      cache_key: Optional[str] = None) -> Optional[ReceiptRecord]:
+    """
+    Отправляет изображение чека в OpenAI Vision, парсит и возвращает распознанный чек (None при ошибке).
+
+    Распознавание идет по уровням model_router: более сильная модель или более высокая
+    детализация используются, только если результат дешевого уровня не прошел сверку.
+    Если передан on_item и включен OPENAI_STREAMING_ENABLED, ответ первого уровня
+    запрашивается потоком, и распознанные позиции передаются в on_item до завершения ответа.
+    cache_key — ключ из lookup_cached_recognition, если кэш уже проверен (промах): тогда
+    кэш не проверяется повторно, а результат сохраняется под этим ключом.
+
+    Raises:
+        CircuitOpenError: Если OpenAI недоступен и предохранитель разомкнут
+    """
     try:
-        base64_image = base64.b64encode(image_data).decode('utf-8')
+        if cache_key is None:
+            cached_result, cache_key = await lookup_cached_recognition(image_data)
+            if cached_result is not None:
+                return cached_result
+
+        # Предобработка изображения (CPU-работа вне event loop)
+        with pipeline_metrics.stage("encode"):
+            upload_data, mime_type = await asyncio.to_thread(preprocess_receipt_image, image_data)
+            base64_image = base64.b64encode(upload_data).decode('utf-8')
         logger.info(f"Изображение закодировано, размер base64: {len(base64_image)} символов")
         
-        # Подготовка запроса
-        request_params = prepare_openai_request(base64_image)
-        logger.info(f"Отправляем запрос на анализ изображения в OpenAI, используя модель: {OPENAI_MODEL}")
+        # Промежуточные позиции показываем только для первого уровня, чтобы не дублировать их при эскалации
+        async def attempt(tier: ModelTier, index: int) -> Tuple[Optional[ReceiptRecord], bool]:
+            return await recognize_with_tier(base64_image, mime_type, tier, on_item if index == 0 else None)
+
+        with pipeline_metrics.stage("ocr"):
+            result, repaired, tier = await model_router.recognize(attempt)
         
-        # Отправка запроса
-        response_text = await send_openai_request(request_params)
-        logger.info(f"Получен ответ от OpenAI, длина текста: {len(response_text)} символов")
-        logger.info(f"Полный ответ OpenAI:\n{response_text}")
-        
-        # Парсинг ответа
-        parsed_json_data = parse_openai_response(response_text)
-        if parsed_json_data is None:
-            return None, None, None, None, None
-            
-        return extract_items_from_openai_response(parsed_json_data)
+        # Восстановленный ответ может быть неполным, его не кэшируем
+        if cache_key is not None and result is not None and result.items and not repaired:
+            await asyncio.to_thread(recognition_cache.put, cache_key, result)
+        return result
         
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при обработке чека через OpenAI: {e}", exc_info=True)
-        return None, None, None, None, None 
\ No newline at end of file
+        return None
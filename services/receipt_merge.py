@@ -0,0 +1,58 @@
+import logging
+from typing import Any, List, Optional, Tuple
+from models.receipt import ReceiptLine, ReceiptRecord
+
+logger = logging.getLogger(__name__)
+
+def _item_key(item: ReceiptLine) -> Tuple[str, Optional[int]]:
+    """Ключ для сравнения позиций с соседних фото одного чека."""
+    description = " ".join(item.description.lower().split())
+    return description, item.total_amount
+
+def _overlap_length(merged: List[ReceiptLine], items: List[ReceiptLine]) -> int:
+    """
+    Длина перекрытия: сколько последних позиций merged совпадает с первыми позициями items.
+
+    Соседние фото длинного чека обычно снимаются с нахлестом, поэтому несколько строк
+    в конце одного фото повторяются в начале следующего.
+    """
+    merged_keys = [_item_key(item) for item in merged]
+    item_keys = [_item_key(item) for item in items]
+    for length in range(min(len(merged_keys), len(item_keys)), 0, -1):
+        if merged_keys[-length:] == item_keys[:length]:
+            return length
+    return 0
+
+def _first_not_none(values: List[Any]) -> Any:
+    return next((value for value in values if value is not None), None)
+
+def merge_recognition_results(results: List[Optional[ReceiptRecord]]) -> Optional[ReceiptRecord]:
+    """
+    Объединяет результаты распознавания нескольких фото одного чека (по порядку фото).
+
+    Позиции из перекрывающихся участков соседних фото учитываются один раз.
+    Сервисный сбор берется с первого фото, где он найден, итоговая сумма и общая скидка —
+    с последнего (они печатаются в конце чека).
+
+    Returns:
+        Объединенный чек или None, если ни одно фото не распознано
+    """
+    merged_items: List[ReceiptLine] = []
+    for index, result in enumerate(results):
+        items = result.items if result is not None else []
+        overlap = _overlap_length(merged_items, items)
+        if overlap:
+            logger.info(f"Фото {index + 1}: пропущено {overlap} позиций из перекрытия с предыдущим фото")
+        merged_items.extend(items[overlap:])
+
+    recognized = [result for result in results if result is not None and result.items]
+    if not recognized:
+        return None
+    last_first = list(reversed(recognized))
+    return ReceiptRecord(
+        items=merged_items,
+        service_charge_percent=_first_not_none([result.service_charge_percent for result in recognized]),
+        total_check_amount=_first_not_none([result.total_check_amount for result in last_first]),
+        total_discount_percent=_first_not_none([result.total_discount_percent for result in last_first]),
+        total_discount_amount=_first_not_none([result.total_discount_amount for result in last_first]),
+    )
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import aiohttp
+from config.settings import (
+    WEBAPP_PUBLISH_MODE,
+    WEBAPP_PUBLISH_URL,
+    WEBAPP_PUBLISH_RETRIES,
+    WEBAPP_PUBLISH_TIMEOUT,
+    WEBAPP_PUBLISH_MAX_PENDING,
+)
+from models.receipt import ReceiptRecord, receipt_to_api
+from services.http_client import http_client
+from services.resilience import compute_backoff
+
+logger = logging.getLogger(__name__)
+
+class ReceiptPublisher(ABC):
+    """Передача распознанного чека веб-приложению."""
+
+    @abstractmethod
+    def publish(self, message_id: int, receipt: ReceiptRecord) -> None:
+        """Публикует чек, не дожидаясь доставки (вызывается после state_store.put)."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики публикации для /api/stats."""
+
+    async def close(self) -> None:
+        """Дожидается отправки оставшихся чеков и освобождает ресурсы."""
+        pass
+
+class LocalReceiptPublisher(ReceiptPublisher):
+    """
+    Веб-приложение работает в том же процессе (webapp_server) или читает то же хранилище
+    (Redis): чек уже доступен ему после state_store.put, поэтому публиковать нечего.
+    """
+
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, message_id: int, receipt: ReceiptRecord) -> None:
+        self.published += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": "local", "published": self.published}
+
+class HttpReceiptPublisher(ReceiptPublisher):
+    """
+    Отправка чеков отдельному серверу веб-приложения (POST /api/receipt/<message_id>).
+
+    Чеки ставятся в очередь и отправляются фоновой задачей через общий пул соединений
+    (services.http_client), поэтому обработка фото их не ждет. Если чек опубликован
+    повторно до отправки, уходит только последняя версия. Сетевые ошибки, таймауты
+    и ответы 5xx повторяются с экспоненциальной задержкой; при переполнении очереди
+    отбрасывается самый старый чек.
+    """
+
+    def __init__(self, base_url: str, retries: int = 3, timeout: float = 5.0, max_pending: int = 1000):
+        """
+        Args:
+            base_url: Адрес сервера веб-приложения
+            retries: Повторов после первой неудачной попытки
+            timeout: Таймаут одного запроса в секундах
+            max_pending: Максимум чеков в очереди
+        """
+        self._base_url = base_url.rstrip("/")
+        self._retries = retries
+        self._timeout = timeout
+        self._max_pending = max_pending
+        self._pending: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.published = 0
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retried = 0
+
+    def publish(self, message_id: int, receipt: ReceiptRecord) -> None:
+        # Снимок берется сразу: дальнейшие изменения чека бот сохраняет сам
+        self._pending[message_id] = receipt_to_api(receipt)
+        self._pending.move_to_end(message_id)
+        self.published += 1
+        if len(self._pending) > self._max_pending:
+            dropped_id, _ = self._pending.popitem(last=False)
+            self.dropped += 1
+            logger.warning(f"Очередь публикации чеков переполнена, чек message_id={dropped_id} отброшен")
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            message_id, payload = self._pending.popitem(last=False)
+            await self._send(message_id, payload)
+
+    async def _send(self, message_id: int, payload: Dict[str, Any]) -> bool:
+        url = f"{self._base_url}/api/receipt/{message_id}"
+        for attempt in range(self._retries + 1):
+            if message_id in self._pending:
+                # Пока ждали повтора, пришла более новая версия чека — отправится она
+                return False
+            try:
+                status, error_text = await http_client.post_json(url, payload, timeout=self._timeout)
+                if status == 200:
+                    self.delivered += 1
+                    logger.info(f"Данные чека отправлены веб-приложению для message_id: {message_id}")
+                    return True
+                if status < 500 and status not in (408, 429):
+                    logger.error(f"Веб-приложение отклонило чек message_id={message_id}: {status}, {error_text}")
+                    break
+                logger.warning(f"Ошибка веб-приложения для message_id={message_id}: {status}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Ошибка отправки чека message_id={message_id} (попытка {attempt + 1}): {e}")
+            if attempt < self._retries:
+                self.retried += 1
+                await asyncio.sleep(compute_backoff(attempt, 0.5, 10.0))
+        self.failed += 1
+        logger.error(f"Не удалось отправить чек message_id={message_id} веб-приложению")
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": "http",
+            "url": self._base_url,
+            "published": self.published,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "retried": self.retried,
+            "pending": len(self._pending),
+        }
+
+    async def close(self, timeout: float = 5.0) -> None:
+        if self._worker is not None:
+            # Даем отправить то, что уже в очереди, затем останавливаем задачу
+            deadline = asyncio.get_running_loop().time() + timeout
+            while self._pending and not self._worker.done() and asyncio.get_running_loop().time() < deadline:
+                await asyncio.sleep(0.05)
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+def create_receipt_publisher(mode: str = WEBAPP_PUBLISH_MODE) -> ReceiptPublisher:
+    """Создает публикацию чеков по настройке WEBAPP_PUBLISH_MODE."""
+    if mode == "http":
+        if WEBAPP_PUBLISH_URL:
+            return HttpReceiptPublisher(
+                WEBAPP_PUBLISH_URL,
+                retries=WEBAPP_PUBLISH_RETRIES,
+                timeout=WEBAPP_PUBLISH_TIMEOUT,
+                max_pending=WEBAPP_PUBLISH_MAX_PENDING,
+            )
+        logger.warning("WEBAPP_PUBLISH_MODE=http, но адрес веб-приложения не задан, чеки публикуются локально")
+    elif mode != "local":
+        logger.warning(f"Неизвестный WEBAPP_PUBLISH_MODE '{mode}', используется local")
+    return LocalReceiptPublisher()
+
+# Глобальная публикация чеков
+receipt_publisher = create_receipt_publisher()
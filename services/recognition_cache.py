@@ -0,0 +1,168 @@
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+from pydantic import ValidationError
+from config.settings import (
+    RECOGNITION_CACHE_ENABLED,
+    RECOGNITION_CACHE_PATH,
+    RECOGNITION_CACHE_MAX_ENTRIES,
+    RECOGNITION_CACHE_MEMORY_ENTRIES,
+    RECOGNITION_CACHE_TTL_HOURS,
+    PHOTO_INDEX_MAX_ENTRIES,
+    PHOTO_INDEX_TTL_HOURS,
+)
+from models.receipt import ReceiptRecord, receipt_record_adapter
+from utils.lru_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+class RecognitionCache:
+    """
+    Персистентный кэш результатов распознавания чеков.
+
+    Ключ — SHA-256 от байтов изображения, имени модели и версии промпта.
+    Значение — распознанный чек (ReceiptRecord). Горячие записи держатся в памяти,
+    все записи — в SQLite (JSON через receipt_record_adapter), поэтому кэш
+    переживает перезапуск процесса.
+    """
+
+    def __init__(self, path: str, max_entries: int = 5000, memory_entries: int = 256, ttl_hours: float = 24 * 7):
+        """
+        Args:
+            path: Путь к файлу SQLite
+            max_entries: Максимальное количество записей на диске (LRU)
+            memory_entries: Количество записей, которые держатся в памяти
+            ttl_hours: Время жизни записи в часах
+        """
+        self._path = path
+        self._max_entries = max_entries
+        self._ttl = ttl_hours * 3600
+        self._memory = TTLCache(max_size=memory_entries, ttl=self._ttl)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_data: bytes, model: str, prompt_version: str) -> str:
+        """Формирует ключ кэша по содержимому изображения и параметрам распознавания."""
+        digest = hashlib.sha256()
+        digest.update(image_data)
+        digest.update(b"\0")
+        digest.update(model.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(prompt_version.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Открывает соединение с SQLite и создает таблицу при первом обращении."""
+        if self._conn is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS recognition_cache ("
+                "key TEXT PRIMARY KEY, payload TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_recognition_accessed ON recognition_cache(accessed_at)")
+            removed = conn.execute("DELETE FROM recognition_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            conn.commit()
+            if removed:
+                logger.info(f"Кэш распознавания: удалено {removed} устаревших записей")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[ReceiptRecord]:
+        """Возвращает копию сохраненного результата распознавания или None."""
+        result = self._memory.get(key)
+        if result is not None:
+            self.hits += 1
+            return result.copy()
+
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute(
+                    "SELECT payload, expires_at FROM recognition_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > time.time():
+                    conn.execute("UPDATE recognition_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                    conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения кэша распознавания: {e}")
+            row = None
+
+        if row is None or row[1] <= time.time():
+            self.misses += 1
+            return None
+
+        try:
+            result = receipt_record_adapter().validate_json(row[0])
+        except ValidationError as e:
+            # Запись в старом формате: считаем промахом, она будет перезаписана
+            logger.warning(f"Запись кэша распознавания {key[:12]} не читается: {e.error_count()} ошибок")
+            self.misses += 1
+            return None
+        self._memory.set(key, result, expires_at=row[1])
+        self.hits += 1
+        return result.copy()
+
+    def put(self, key: str, result: ReceiptRecord) -> None:
+        """Сохраняет результат распознавания и вытесняет самые старые записи сверх лимита."""
+        expires_at = time.time() + self._ttl
+        result = result.copy()
+        self._memory.set(key, result, expires_at=expires_at)
+        try:
+            payload = receipt_record_adapter().dump_json(result).decode("utf-8")
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO recognition_cache (key, payload, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, payload, expires_at, time.time())
+                )
+                conn.execute(
+                    "DELETE FROM recognition_cache WHERE key IN ("
+                    "SELECT key FROM recognition_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self._max_entries,)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи в кэш распознавания: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает счетчики попаданий и промахов."""
+        total = self.hits + self.misses
+        try:
+            with self._lock:
+                entries = self._connection().execute("SELECT COUNT(*) FROM recognition_cache").fetchone()[0]
+        except sqlite3.Error:
+            entries = len(self._memory)
+        return {
+            "enabled": RECOGNITION_CACHE_ENABLED,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "saved_openai_requests": self.hits,
+            "entries": entries,
+            "memory_entries": len(self._memory),
+        }
+
+# Глобальный экземпляр кэша
+recognition_cache = RecognitionCache(
+    path=RECOGNITION_CACHE_PATH,
+    max_entries=RECOGNITION_CACHE_MAX_ENTRIES,
+    memory_entries=RECOGNITION_CACHE_MEMORY_ENTRIES,
+    ttl_hours=RECOGNITION_CACHE_TTL_HOURS,
+)
+
+# Индекс Telegram file_unique_id → результат распознавания.
+# file_unique_id одинаков у пересланных и повторно отправленных фото,
+# поэтому при попадании не нужны ни скачивание файла, ни запрос к OpenAI.
+photo_index = TTLCache(max_size=PHOTO_INDEX_MAX_ENTRIES, ttl=PHOTO_INDEX_TTL_HOURS * 3600)
@@ -0,0 +1,29 @@
+import logging
+from typing import Any, Optional
+from config.settings import REDIS_URL
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[Any] = None
+
+def get_redis() -> Any:
+    """
+    Возвращает общий клиент redis.asyncio (хранилище состояний, FSM, закрепление чатов).
+
+    Пакет redis импортируется только при первом обращении, поэтому без REDIS_URL он не нужен.
+    """
+    global _client
+    if _client is None:
+        if not REDIS_URL:
+            raise RuntimeError("REDIS_URL не задан")
+        from redis.asyncio import Redis
+        _client = Redis.from_url(REDIS_URL)
+        logger.info("Создан клиент Redis")
+    return _client
+
+async def close_redis() -> None:
+    """Закрывает соединения общего клиента Redis."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
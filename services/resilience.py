@@ -0,0 +1,296 @@
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+import openai
+from config.settings import (
+    OPENAI_MAX_RETRIES,
+    OPENAI_BACKOFF_BASE,
+    OPENAI_BACKOFF_MAX,
+    OPENAI_HEDGE_ENABLED,
+    OPENAI_HEDGE_PERCENTILE,
+    OPENAI_HEDGE_MIN_SAMPLES,
+    OPENAI_CIRCUIT_FAILURE_THRESHOLD,
+    OPENAI_CIRCUIT_RESET_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """Внешний сервис считается недоступным, запросы временно не выполняются."""
+
+class CircuitBreaker:
+    """
+    Предохранитель для внешнего сервиса.
+
+    После failure_threshold ошибок подряд размыкается и сразу отклоняет запросы.
+    Через reset_timeout секунд пропускает один пробный запрос: успех замыкает цепь,
+    ошибка снова размыкает ее.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: Количество ошибок подряд для размыкания
+            reset_timeout: Время в секундах до пробного запроса
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.state = self.CLOSED
+
+    def before_call(self) -> None:
+        """Проверяет, можно ли выполнить запрос.
+
+        Raises:
+            CircuitOpenError: Если цепь разомкнута
+        """
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.OPEN:
+            retry_in = self._opened_at + self._reset_timeout - time.monotonic()
+            if retry_in > 0:
+                raise CircuitOpenError(f"Сервис недоступен, повтор через {retry_in:.0f} с")
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self._probe_in_flight:
+            raise CircuitOpenError("Сервис недоступен, выполняется пробный запрос")
+        self._probe_in_flight = True
+
+    def release_probe(self) -> None:
+        """Освобождает пробный запрос, который не завершился (отменен), не меняя состояние."""
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        """Учитывает успешный запрос."""
+        if self.state != self.CLOSED:
+            logger.info("Предохранитель замкнут: сервис снова отвечает")
+        self.state = self.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """Учитывает неудачный запрос."""
+        self._failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self._failures >= self._failure_threshold:
+            if self.state != self.OPEN:
+                logger.error(f"Предохранитель разомкнут после {self._failures} ошибок подряд")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+class LatencyTracker:
+    """Скользящее окно длительностей запросов для оценки перцентилей."""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, duration: float) -> None:
+        """Добавляет длительность успешного запроса."""
+        self._samples.append(duration)
+
+    def percentile(self, fraction: float, min_samples: int = 1) -> Optional[float]:
+        """Возвращает перцентиль или None, если данных недостаточно."""
+        if len(self._samples) < max(1, min_samples):
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(fraction * len(ordered)))
+        return ordered[index]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+def is_retryable_error(error: Exception) -> bool:
+    """Определяет, имеет ли смысл повторять запрос после ошибки."""
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409) or error.status_code >= 500
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError))
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Извлекает задержку из заголовков Retry-After / retry-after-ms ответа OpenAI."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def compute_backoff(attempt: int, base: float, maximum: float, retry_after: Optional[float] = None) -> float:
+    """Экспоненциальная задержка с полным джиттером; Retry-After задает нижнюю границу."""
+    delay = random.uniform(0, min(maximum, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, maximum))
+    return delay
+
+class ResilientCaller:
+    """
+    Обертка над вызовами внешнего API: повторы с джиттером, хеджирование и предохранитель.
+
+    Хеджирование: если запрос не завершился за время p95 последних успешных запросов,
+    параллельно отправляется второй такой же, используется первый успешный ответ.
+    Длительности учитываются отдельно по видам запросов (kind): открытие потока
+    намного короче полного ответа, и общий p95 дублировал бы почти каждый полный запрос.
+    """
+
+    def __init__(self, name: str, max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 20.0,
+                 hedge_enabled: bool = False, hedge_percentile: float = 0.95, hedge_min_samples: int = 20,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._hedge_enabled = hedge_enabled
+        self._hedge_percentile = hedge_percentile
+        self._hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latency: Dict[str, LatencyTracker] = {}
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    async def call(self, factory: Callable[[], Awaitable[Any]], kind: str = "request") -> Any:
+        """
+        Выполняет запрос с повторами.
+
+        Args:
+            factory: Функция без аргументов, создающая корутину запроса
+            kind: Вид запроса для учета длительностей и порога хеджирования (например, "stream")
+
+        Raises:
+            CircuitOpenError: Если предохранитель разомкнут
+        """
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await self._call_hedged(factory, self.latency.setdefault(kind, LatencyTracker()))
+            except Exception as e:
+                if not is_retryable_error(e):
+                    # Ошибка в самом запросе (400, 401 и т.п.) не говорит о недоступности сервиса
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self._max_retries or self.breaker.state == CircuitBreaker.OPEN:
+                    raise
+                delay = compute_backoff(attempt, self._backoff_base, self._backoff_max, get_retry_after(e))
+                logger.warning(f"{self.name}: ошибка {type(e).__name__}: {e}; повтор {attempt + 1}/{self._max_retries} через {delay:.2f} с")
+                self.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Отмена (проигравший хедж, таймаут клиента, остановка) ничего не говорит о сервисе,
+                # но пробный запрос полуоткрытого предохранителя должен освободиться
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def record_failure(self, error: BaseException) -> None:
+        """
+        Учитывает ошибку, случившуюся после успешного вызова (например, обрыв уже открытого потока).
+        Ошибки самого запроса (400, 401 и т.п.) предохранитель не размыкают.
+        """
+        if isinstance(error, Exception) and is_retryable_error(error):
+            self.breaker.record_failure()
+
+    async def _timed(self, factory: Callable[[], Awaitable[Any]], latency: LatencyTracker) -> Any:
+        """Выполняет запрос и учитывает его длительность."""
+        started = time.monotonic()
+        result = await factory()
+        latency.record(time.monotonic() - started)
+        return result
+
+    async def _call_hedged(self, factory: Callable[[], Awaitable[Any]], latency: LatencyTracker) -> Any:
+        """Выполняет запрос, при необходимости отправляя хеджирующий дубль."""
+        hedge_delay = None
+        if self._hedge_enabled:
+            hedge_delay = latency.percentile(self._hedge_percentile, self._hedge_min_samples)
+        if hedge_delay is None:
+            return await self._timed(factory, latency)
+
+        primary = asyncio.create_task(self._timed(factory, latency))
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        except BaseException:
+            # Вызывающий отменен во время ожидания: запрос не должен остаться висеть
+            primary.cancel()
+            raise
+        if done:
+            return primary.result()
+
+        self.hedges += 1
+        logger.info(f"{self.name}: запрос дольше p95 ({hedge_delay:.2f} с), отправляем хеджирующий запрос")
+        hedge = asyncio.create_task(self._timed(factory, latency))
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики повторов, хеджирования и состояние предохранителя."""
+        latency = {}
+        for kind, tracker in self.latency.items():
+            p95 = tracker.percentile(0.95)
+            latency[kind] = {"samples": len(tracker), "p95_s": round(p95, 3) if p95 is not None else None}
+        return {
+            "circuit_state": self.breaker.state,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency": latency,
+        }
+
+# Глобальная обертка для запросов к OpenAI
+openai_caller = ResilientCaller(
+    "OpenAI",
+    max_retries=OPENAI_MAX_RETRIES,
+    backoff_base=OPENAI_BACKOFF_BASE,
+    backoff_max=OPENAI_BACKOFF_MAX,
+    hedge_enabled=OPENAI_HEDGE_ENABLED,
+    hedge_percentile=OPENAI_HEDGE_PERCENTILE,
+    hedge_min_samples=OPENAI_HEDGE_MIN_SAMPLES,
+    breaker=CircuitBreaker(
+        failure_threshold=OPENAI_CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=OPENAI_CIRCUIT_RESET_SECONDS,
+    ),
+)
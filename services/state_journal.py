@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import queue
+import shutil
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from models.receipt import ReceiptRecord, receipt_record_adapter
+
+logger = logging.getLogger(__name__)
+
+#: Состояние хранилища для снимка: (message_id, expires_at, чек)
+SnapshotEntry = Tuple[int, float, ReceiptRecord]
+
+def encode_put(message_id: int, expires_at: float, receipt_json: bytes) -> bytes:
+    """Запись «чек создан или заменен»; receipt_json — результат receipt_record_adapter().dump_json."""
+    header = json.dumps({"op": "put", "id": message_id, "expires_at": expires_at})
+    return header[:-1].encode("utf-8") + b', "receipt": ' + receipt_json + b"}\n"
+
+def encode_update(op: str, message_id: int, user_id: int, value: Any, expires_at: float) -> bytes:
+    """Запись «выбор изменен» (op="selection"), «итог подтвержден» (op="result") или «оплата» (op="payment")."""
+    record = {"op": op, "id": message_id, "user": str(user_id), "value": value, "expires_at": expires_at}
+    return json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+def encode_delete(message_id: int) -> bytes:
+    """Запись «чек удален»."""
+    return json.dumps({"op": "delete", "id": message_id}).encode("utf-8") + b"\n"
+
+class StateJournal:
+    """
+    Журнал изменений хранилища состояний в памяти.
+
+    Каждое изменение дописывается строкой JSON в journal.jsonl; запись на диск идет
+    в отдельном потоке пачками (одна запись и fsync на пачку), поэтому event loop
+    только ставит готовую строку в очередь. Когда в журнале накопилось max_records
+    записей или прошло snapshot_interval секунд, тот же поток пишет сжатый снимок
+    (snapshot.jsonl — по одной записи put на живой чек) и начинает журнал заново.
+    При запуске восстанавливаются снимок и хвост журнала, поэтому время
+    восстановления ограничено размером хранилища и max_records.
+    """
+
+    def __init__(self, directory: str, snapshot_interval: float = 300.0, max_records: int = 5000):
+        """
+        Args:
+            directory: Каталог для снимка и журнала
+            snapshot_interval: Максимальный интервал между снимками в секундах
+            max_records: Количество записей журнала, после которого делается снимок
+        """
+        self._directory = directory
+        self.snapshot_path = os.path.join(directory, "snapshot.jsonl")
+        self.journal_path = os.path.join(directory, "journal.jsonl")
+        self.rotated_path = self.journal_path + ".1"
+        self._snapshot_interval = snapshot_interval
+        self._max_records = max_records
+        self._queue: "queue.SimpleQueue[Optional[bytes]]" = queue.SimpleQueue()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._lock: Optional[threading.Lock] = None
+        self._capture: Optional[Callable[[], List[SnapshotEntry]]] = None
+        self._records_since_snapshot = 0
+        self._last_snapshot = time.monotonic()
+        self.records_written = 0
+        self.snapshots = 0
+        self.last_snapshot_ms: Optional[float] = None
+        self.recovery: Dict[str, Any] = {}
+
+    def _read_records(self, path: str) -> Iterator[Dict[str, Any]]:
+        """Читает записи из файла; поврежденные строки (оборванная запись при сбое) пропускаются."""
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    self.recovery["skipped"] = self.recovery.get("skipped", 0) + 1
+                    logger.warning(f"Журнал состояний: пропущена поврежденная строка {line_number} в {os.path.basename(path)}")
+
+    def replay(self, apply: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+        """
+        Восстанавливает состояние: снимок, затем журнал до последней ротации и текущий журнал.
+
+        Операции идемпотентны (последняя запись выигрывает), поэтому повторное применение
+        журнала, уже вошедшего в снимок (сбой во время снимка), дает то же состояние.
+
+        Returns:
+            Количество записей из снимка и журнала, пропущенные строки и время в мс
+        """
+        started = time.perf_counter()
+        self.recovery = {"snapshot_records": 0, "journal_records": 0, "skipped": 0}
+        for record in self._read_records(self.snapshot_path):
+            apply(record)
+            self.recovery["snapshot_records"] += 1
+        for path in (self.rotated_path, self.journal_path):
+            for record in self._read_records(path):
+                apply(record)
+                self.recovery["journal_records"] += 1
+        self.recovery["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        # Поврежденные строки тоже уходят при следующем снимке
+        self._records_since_snapshot = self.recovery["journal_records"] + self.recovery["skipped"]
+        return self.recovery
+
+    def start(self, lock: threading.Lock, capture: Callable[[], List[SnapshotEntry]]) -> None:
+        """
+        Запускает поток записи.
+
+        Args:
+            lock: Блокировка хранилища; append должен вызываться под ней, тогда снимок
+                фиксирует состояние между изменениями, а не посреди них (запись на диск
+                и ротация журнала идут уже без блокировки)
+            capture: Возвращает живые чеки хранилища; вызывается под lock
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        self._lock = lock
+        self._capture = capture
+        self._file = open(self.journal_path, "ab")
+        if self._file.tell() and not self._ends_with_newline():
+            # Последняя запись оборвана сбоем: новые записи начинаются с новой строки
+            self._file.write(b"\n")
+            self._file.flush()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="state-journal", daemon=True)
+        self._thread.start()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.journal_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def append(self, record: bytes) -> None:
+        """Ставит запись в очередь на запись; не блокирует вызывающий поток."""
+        if self._thread is not None:
+            self._queue.put(record)
+
+    def stop(self) -> None:
+        """Дописывает очередь, делает итоговый снимок и останавливает поток."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _drain(self, first: Optional[bytes] = None) -> List[bytes]:
+        batch = [first] if first else []
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                return batch
+            if record:
+                batch.append(record)
+
+    def _write(self, batch: List[bytes]) -> None:
+        self._file.write(b"".join(batch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.records_written += len(batch)
+        self._records_since_snapshot += len(batch)
+
+    def _snapshot_due(self) -> bool:
+        if not self._records_since_snapshot:
+            return False
+        return (self._records_since_snapshot >= self._max_records
+                or time.monotonic() - self._last_snapshot >= self._snapshot_interval)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self._queue.get(timeout=min(self._snapshot_interval, 5.0))
+            except queue.Empty:
+                first = None
+            try:
+                batch = self._drain(first)
+                if batch:
+                    self._write(batch)
+                if (self._stopping.is_set() and self._records_since_snapshot) or self._snapshot_due():
+                    self._snapshot()
+            except Exception as e:
+                logger.error(f"Ошибка записи журнала состояний: {e}", exc_info=True)
+            if self._stopping.is_set():
+                return
+
+    def _rotate(self) -> None:
+        """Переносит текущий журнал в journal.jsonl.1 и открывает новый."""
+        self._file.close()
+        if os.path.exists(self.rotated_path):
+            # Предыдущий снимок не был записан: сохраняем его журнал целиком
+            with open(self.rotated_path, "ab") as dst, open(self.journal_path, "rb") as src:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, self.rotated_path)
+        self._file = open(self.journal_path, "ab")
+
+    def _snapshot(self) -> None:
+        started = time.perf_counter()
+        # Под блокировкой только фиксируем состояние и записи до него; новые записи
+        # остаются в очереди и после ротации попадут уже в новый журнал, потому что
+        # очередь разбирает только этот поток
+        with self._lock:
+            entries = self._capture()
+            pending = self._drain()
+        if pending:
+            self._write(pending)
+        self._rotate()
+        self._records_since_snapshot = 0
+        self._last_snapshot = time.monotonic()
+
+        # Чеки в хранилище не изменяются на месте, поэтому сериализация идет без блокировки
+        adapter = receipt_record_adapter()
+        now = time.time()
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            for message_id, expires_at, receipt in entries:
+                if expires_at > now:
+                    f.write(encode_put(message_id, expires_at, adapter.dump_json(receipt)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        os.remove(self.rotated_path)
+
+        self.snapshots += 1
+        self.last_snapshot_ms = round((time.perf_counter() - started) * 1000, 2)
+        logger.info(f"Журнал состояний: снимок из {len(entries)} чеков записан за {self.last_snapshot_ms} мс")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "records_written": self.records_written,
+            "records_since_snapshot": self._records_since_snapshot,
+            "snapshots": self.snapshots,
+            "last_snapshot_ms": self.last_snapshot_ms,
+            "recovery": self.recovery,
+        }
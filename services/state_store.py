@@ -0,0 +1,709 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Any, Awaitable, Dict, List, Optional, Tuple, TypeVar
+from pydantic import ValidationError
+from config.settings import (
+    STATE_STORE_BACKEND,
+    STATE_STORE_PATH,
+    STATE_STORE_MAX_BYTES,
+    STATE_STORE_MAX_ENTRIES,
+    STATE_TTL_HOURS,
+    STATE_SWEEP_INTERVAL,
+    STATE_JOURNAL_ENABLED,
+    STATE_JOURNAL_DIR,
+    STATE_SNAPSHOT_INTERVAL,
+    STATE_JOURNAL_MAX_RECORDS,
+    REDIS_PREFIX,
+)
+from models.receipt import ReceiptRecord, SelectionValue, receipt_record_adapter
+from services.state_journal import SnapshotEntry, StateJournal, encode_delete, encode_put, encode_update
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+def _json_size(value: Any) -> int:
+    """Длина JSON значения участника в байтах (для оценки размера записи)."""
+    return len(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def stamp_put(receipt: ReceiptRecord, previous_version: int) -> None:
+    """
+    Проставляет версию чеку, который сохраняется целиком.
+
+    Версия не меньше текущего времени в миллисекундах, чтобы у чека, созданного заново
+    с тем же message_id (после удаления или истечения срока), она не начиналась сначала.
+    """
+    receipt.version = max(previous_version + 1, int(time.time() * 1000))
+    receipt.base_version = receipt.version
+    receipt.changes = {}
+
+def next_change(receipt: ReceiptRecord, field_name: str, user_id: int) -> Tuple[int, Dict[str, Dict[str, int]]]:
+    """Версия и журнал изменений чека после изменения поля участника (сам чек не меняется)."""
+    version = receipt.version + 1
+    changes = dict(receipt.changes)
+    changes[field_name] = {**changes.get(field_name, {}), str(user_id): version}
+    return version, changes
+
+class StateStore(ABC):
+    """
+    Хранилище состояний чеков по message_id сообщения с клавиатурой.
+
+    Все обработчики бота и API веб-приложения работают с чеками только через этот
+    интерфейс. Записи, полученные через get, изменять нельзя: выбор, итоги и оплаты
+    участников сохраняются методами update_selection, set_result и set_payment.
+
+    Каждое изменение увеличивает ReceiptRecord.version, а в changes отмечается, в какой
+    версии участник последний раз менял свое поле (для ETag и ?since= в API).
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sweeper: Optional[asyncio.Task] = None
+        self._sync_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sync_loop_lock = threading.Lock()
+
+    @abstractmethod
+    async def get(self, message_id: int) -> Optional[ReceiptRecord]:
+        """Возвращает чек или None, если его нет или срок жизни истек."""
+
+    @abstractmethod
+    async def put(self, message_id: int, receipt: ReceiptRecord) -> None:
+        """Сохраняет чек (заменяя прежний) и продлевает срок его жизни."""
+
+    @abstractmethod
+    async def delete(self, message_id: int) -> None:
+        """Удаляет чек."""
+
+    @abstractmethod
+    async def update_selection(self, message_id: int, user_id: int, selection: Dict[str, SelectionValue]) -> bool:
+        """Сохраняет выбор участника (индекс позиции → количество или доля). False, если чека нет."""
+
+    @abstractmethod
+    async def set_result(self, message_id: int, user_id: int, result: Dict[str, Any]) -> bool:
+        """Сохраняет подтвержденный итог участника. False, если чека нет."""
+
+    @abstractmethod
+    async def set_payment(self, message_id: int, user_id: int, amount: int) -> bool:
+        """Сохраняет, сколько участник заплатил по чеку (0 — не платил). False, если чека нет."""
+
+    @abstractmethod
+    async def purge_expired(self) -> int:
+        """Удаляет чеки с истекшим сроком жизни и возвращает их количество."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики хранилища для /api/stats."""
+
+    async def start(self) -> None:
+        """Подготавливает хранилище к работе и запускает фоновую очистку (вызывается в create_app)."""
+        self.start_sweeper()
+
+    async def close(self) -> None:
+        """Останавливает фоновую очистку и освобождает ресурсы хранилища."""
+        await self.stop_sweeper()
+
+    def start_sweeper(self, interval: float = STATE_SWEEP_INTERVAL) -> None:
+        """Запускает фоновую задачу, которая раз в interval секунд удаляет устаревшие чеки."""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep(interval))
+
+    async def stop_sweeper(self) -> None:
+        """Останавливает фоновую очистку."""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _sweep(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await self.purge_expired()
+                if removed:
+                    logger.info(f"Хранилище состояний: удалено {removed} устаревших чеков")
+            except Exception as e:
+                logger.error(f"Ошибка очистки хранилища состояний: {e}")
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Запоминает event loop бота, чтобы синхронный код (Flask) мог обращаться к хранилищу."""
+        self._loop = loop
+
+    def run_sync(self, coro: Awaitable[T], timeout: float = 10.0) -> T:
+        """
+        Выполняет операцию хранилища из синхронного кода.
+
+        Flask работает в потоках aiohttp_wsgi, поэтому операция отправляется в event loop
+        бота; без запущенного loop (отдельный запуск Flask) — в собственный фоновый loop
+        хранилища. Он живет до конца процесса, поэтому привязанные к loop ресурсы
+        (пул services.http_client, соединения Redis) переиспользуются между запросами.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed() or not loop.is_running():
+            loop = self._background_loop()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        with self._sync_loop_lock:
+            if self._sync_loop is None:
+                self._sync_loop = asyncio.new_event_loop()
+                threading.Thread(target=self._sync_loop.run_forever, name="state-store-sync", daemon=True).start()
+            return self._sync_loop
+
+class MemoryStateStore(StateStore):
+    """
+    Хранилище в памяти процесса: LRU с временем жизни и ограничением по объему.
+
+    Объем записи оценивается по длине ее JSON: при сохранении целиком чек сериализуется,
+    а при изменении поля участника к оценке добавляется разница длин JSON старого
+    и нового значения, поэтому изменение не зависит от размера чека. При превышении
+    max_bytes или max_entries вытесняются давно не использовавшиеся чеки, поэтому
+    потребление памяти не растет с числом созданных чеков.
+
+    Сроки жизни лежат в куче (expires_at, message_id): очистка снимает с вершины только
+    истекшие записи, O(log n) на чек. Элементы кучи не удаляются при изменении или
+    вытеснении чека — устаревшие пропускаются, а куча пересобирается, когда их
+    становится больше, чем живых записей.
+
+    С журналом (StateJournal) каждое изменение записывается на диск, и чеки переживают
+    перезапуск процесса. Записи не изменяются на месте: выбор и итог участника создают
+    новый ReceiptRecord, поэтому снимок можно сериализовать в потоке журнала.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_entries: int = 20000, ttl_hours: float = 48,
+                 journal: Optional[StateJournal] = None):
+        """
+        Args:
+            max_bytes: Бюджет на все чеки в байтах
+            max_entries: Максимальное количество чеков
+            ttl_hours: Время жизни чека в часах с последнего изменения
+            journal: Журнал для восстановления чеков после перезапуска
+        """
+        super().__init__()
+        self._data: "OrderedDict[int, Tuple[float, int, ReceiptRecord]]" = OrderedDict()
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._ttl = ttl_hours * 3600
+        self._expiry_heap: List[Tuple[float, int]] = []
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._journal = journal
+        self.evictions = 0
+        self.expirations = 0
+
+    def _store(self, message_id: int, receipt: ReceiptRecord, size: int, expires_at: Optional[float] = None) -> None:
+        """
+        Сохраняет запись размером size байт (оценка) и вытесняет старые записи сверх бюджета.
+        Вызывается под блокировкой.
+        """
+        previous = self._data.pop(message_id, None)
+        if previous is not None:
+            self._bytes -= previous[1]
+        if expires_at is None:
+            expires_at = time.time() + self._ttl
+        self._data[message_id] = (expires_at, size, receipt)
+        self._bytes += size
+        heapq.heappush(self._expiry_heap, (expires_at, message_id))
+        while len(self._data) > 1 and (self._bytes > self._max_bytes or len(self._data) > self._max_entries):
+            evicted_id, (_, evicted_size, _) = self._data.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+            logger.debug(f"Чек message_id={evicted_id} вытеснен из хранилища состояний")
+        if len(self._expiry_heap) > 2 * len(self._data) + 64:
+            self._expiry_heap = [(entry[0], key) for key, entry in self._data.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def _update(self, message_id: int, field_name: str, user_id: int, value: Any,
+                expires_at: Optional[float] = None) -> Optional[float]:
+        """
+        Записывает значение участника в user_selections, user_results или payments новой копии чека.
+        Вызывается под блокировкой.
+
+        Returns:
+            Новый срок жизни чека или None, если чека нет
+        """
+        receipt = self._load(message_id)
+        if receipt is None:
+            return None
+        values = dict(getattr(receipt, field_name))
+        user_key = str(user_id)
+        # Размер меняется на разницу JSON значений; новый участник добавляет еще ключ и версию в changes
+        size = self._data[message_id][1] + _json_size(value)
+        if user_key in values:
+            size -= _json_size(values[user_key])
+        else:
+            size += 2 * len(user_key) + 24
+        values[user_key] = value
+        version, changes = next_change(receipt, field_name, user_id)
+        updated = replace(receipt, version=version, changes=changes, **{field_name: values})
+        if field_name == "user_selections" and receipt.totals is not None:
+            # Доли пересчитываются только по изменившимся позициям и переходят к новой копии;
+            # у прежней копии они сбрасываются и при обращении строятся заново по ее выбору
+            receipt.totals = None
+            updated.totals.set_selection(str(user_id), value)
+        self._store(message_id, updated, size, expires_at)
+        return self._data[message_id][0] if message_id in self._data else None
+
+    def _entries(self) -> List[SnapshotEntry]:
+        """Живые чеки для снимка журнала. Вызывается под блокировкой."""
+        return [(message_id, entry[0], entry[2]) for message_id, entry in self._data.items()]
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        """Применяет запись журнала при восстановлении. Вызывается под блокировкой."""
+        op = record.get("op")
+        message_id = record.get("id")
+        expires_at = record.get("expires_at")
+        if op == "delete":
+            entry = self._data.pop(message_id, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+        elif expires_at is None or expires_at <= time.time():
+            return
+        elif op == "put":
+            receipt = receipt_record_adapter().validate_python(record["receipt"])
+            self._store(message_id, receipt, len(receipt_record_adapter().dump_json(receipt)), expires_at)
+        elif op == "selection":
+            self._update(message_id, "user_selections", record["user"], record["value"], expires_at)
+        elif op == "result":
+            self._update(message_id, "user_results", record["user"], record["value"], expires_at)
+        elif op == "payment":
+            self._update(message_id, "payments", record["user"], record["value"], expires_at)
+
+    def _recover(self) -> Dict[str, Any]:
+        with self._lock:
+            def apply(record: Dict[str, Any]) -> None:
+                try:
+                    self._apply(record)
+                except (ValidationError, KeyError, TypeError) as e:
+                    logger.warning(f"Журнал состояний: запись {record.get('op')} для {record.get('id')} не применена: {e}")
+            return self._journal.replay(apply)
+
+    async def start(self) -> None:
+        if self._journal is not None and self._sweeper is None:
+            recovery = await asyncio.to_thread(self._recover)
+            logger.info(
+                f"Хранилище состояний восстановлено за {recovery['duration_ms']} мс: "
+                f"{len(self._data)} чеков, записей в снимке {recovery['snapshot_records']}, "
+                f"в журнале {recovery['journal_records']}, поврежденных строк {recovery['skipped']}"
+            )
+            self._journal.start(self._lock, self._entries)
+        await super().start()
+
+    async def close(self) -> None:
+        await super().close()
+        if self._journal is not None:
+            await asyncio.to_thread(self._journal.stop)
+
+    def _load(self, message_id: int) -> Optional[ReceiptRecord]:
+        """Возвращает живую запись и помечает ее как недавно использованную. Вызывается под блокировкой."""
+        entry = self._data.get(message_id)
+        if entry is None:
+            return None
+        expires_at, size, receipt = entry
+        if expires_at <= time.time():
+            del self._data[message_id]
+            self._bytes -= size
+            self.expirations += 1
+            return None
+        self._data.move_to_end(message_id)
+        return receipt
+
+    async def get(self, message_id: int) -> Optional[ReceiptRecord]:
+        with self._lock:
+            return self._load(message_id)
+
+    async def put(self, message_id: int, receipt: ReceiptRecord) -> None:
+        with self._lock:
+            previous = self._data.get(message_id)
+            stamp_put(receipt, previous[2].version if previous is not None else 0)
+            payload = receipt_record_adapter().dump_json(receipt)
+            self._store(message_id, receipt, len(payload))
+            if self._journal is not None:
+                self._journal.append(encode_put(message_id, self._data[message_id][0], payload))
+
+    async def delete(self, message_id: int) -> None:
+        with self._lock:
+            entry = self._data.pop(message_id, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+                if self._journal is not None:
+                    self._journal.append(encode_delete(message_id))
+
+    async def update_selection(self, message_id: int, user_id: int, selection: Dict[str, SelectionValue]) -> bool:
+        selection = dict(selection)
+        with self._lock:
+            expires_at = self._update(message_id, "user_selections", user_id, selection)
+            if expires_at is not None and self._journal is not None:
+                self._journal.append(encode_update("selection", message_id, user_id, selection, expires_at))
+            return expires_at is not None
+
+    async def set_result(self, message_id: int, user_id: int, result: Dict[str, Any]) -> bool:
+        with self._lock:
+            expires_at = self._update(message_id, "user_results", user_id, result)
+            if expires_at is not None and self._journal is not None:
+                self._journal.append(encode_update("result", message_id, user_id, result, expires_at))
+            return expires_at is not None
+
+    async def set_payment(self, message_id: int, user_id: int, amount: int) -> bool:
+        with self._lock:
+            expires_at = self._update(message_id, "payments", user_id, amount)
+            if expires_at is not None and self._journal is not None:
+                self._journal.append(encode_update("payment", message_id, user_id, amount, expires_at))
+            return expires_at is not None
+
+    async def purge_expired(self) -> int:
+        now = time.time()
+        removed = 0
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires_at, message_id = heapq.heappop(self._expiry_heap)
+                entry = self._data.get(message_id)
+                # Чек мог быть продлен или вытеснен после того, как попал в кучу
+                if entry is None or entry[0] != expires_at:
+                    continue
+                del self._data[message_id]
+                self._bytes -= entry[1]
+                removed += 1
+            self.expirations += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_bytes": self._max_bytes,
+            "max_entries": self._max_entries,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "journal": self._journal.stats() if self._journal is not None else None,
+        }
+
+class SQLiteStateStore(StateStore):
+    """
+    Хранилище в SQLite: чеки переживают перезапуск процесса и не занимают память.
+
+    Запросы выполняются в отдельном потоке (asyncio.to_thread) и не блокируют event loop.
+    """
+
+    def __init__(self, path: str, ttl_hours: float = 48):
+        """
+        Args:
+            path: Путь к файлу SQLite
+            ttl_hours: Время жизни чека в часах с последнего изменения
+        """
+        super().__init__()
+        self._path = path
+        self._ttl = ttl_hours * 3600
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """Открывает соединение с SQLite и создает таблицу при первом обращении."""
+        if self._conn is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS receipt_state ("
+                "message_id INTEGER PRIMARY KEY, payload TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_receipt_state_expires ON receipt_state(expires_at)")
+            removed = conn.execute("DELETE FROM receipt_state WHERE expires_at <= ?", (time.time(),)).rowcount
+            conn.commit()
+            if removed:
+                logger.info(f"Хранилище состояний: удалено {removed} устаревших чеков")
+            self._conn = conn
+        return self._conn
+
+    def _read(self, conn: sqlite3.Connection, message_id: int) -> Optional[ReceiptRecord]:
+        row = conn.execute(
+            "SELECT payload FROM receipt_state WHERE message_id = ? AND expires_at > ?", (message_id, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return receipt_record_adapter().validate_json(row[0])
+        except ValidationError as e:
+            logger.error(f"Чек message_id={message_id} в хранилище не читается: {e.error_count()} ошибок")
+            return None
+
+    def _write(self, conn: sqlite3.Connection, message_id: int, receipt: ReceiptRecord) -> None:
+        payload = receipt_record_adapter().dump_json(receipt).decode("utf-8")
+        conn.execute(
+            "INSERT OR REPLACE INTO receipt_state (message_id, payload, expires_at) VALUES (?, ?, ?)",
+            (message_id, payload, time.time() + self._ttl)
+        )
+        conn.commit()
+
+    def _purge(self) -> int:
+        with self._lock:
+            conn = self._connection()
+            removed = conn.execute("DELETE FROM receipt_state WHERE expires_at <= ?", (time.time(),)).rowcount
+            conn.commit()
+            return removed
+
+    def _get(self, message_id: int) -> Optional[ReceiptRecord]:
+        with self._lock:
+            return self._read(self._connection(), message_id)
+
+    def _put(self, message_id: int, receipt: ReceiptRecord) -> None:
+        with self._lock:
+            conn = self._connection()
+            # Версия берется и у истекшего чека: она должна только расти
+            row = conn.execute(
+                "SELECT json_extract(payload, '$.version') FROM receipt_state WHERE message_id = ?", (message_id,)
+            ).fetchone()
+            stamp_put(receipt, row[0] or 0 if row is not None else 0)
+            self._write(conn, message_id, receipt)
+
+    def _delete(self, message_id: int) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM receipt_state WHERE message_id = ?", (message_id,))
+            conn.commit()
+
+    def _update(self, message_id: int, field_name: str, user_id: int, value: Any) -> bool:
+        with self._lock:
+            conn = self._connection()
+            receipt = self._read(conn, message_id)
+            if receipt is None:
+                return False
+            getattr(receipt, field_name)[str(user_id)] = value
+            receipt.version, receipt.changes = next_change(receipt, field_name, user_id)
+            self._write(conn, message_id, receipt)
+            return True
+
+    async def get(self, message_id: int) -> Optional[ReceiptRecord]:
+        try:
+            return await asyncio.to_thread(self._get, message_id)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения чека message_id={message_id}: {e}")
+            return None
+
+    async def put(self, message_id: int, receipt: ReceiptRecord) -> None:
+        try:
+            await asyncio.to_thread(self._put, message_id, receipt)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка сохранения чека message_id={message_id}: {e}")
+
+    async def delete(self, message_id: int) -> None:
+        try:
+            await asyncio.to_thread(self._delete, message_id)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка удаления чека message_id={message_id}: {e}")
+
+    async def update_selection(self, message_id: int, user_id: int, selection: Dict[str, SelectionValue]) -> bool:
+        try:
+            return await asyncio.to_thread(self._update, message_id, "user_selections", user_id, dict(selection))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка сохранения выбора для message_id={message_id}: {e}")
+            return False
+
+    async def set_result(self, message_id: int, user_id: int, result: Dict[str, Any]) -> bool:
+        try:
+            return await asyncio.to_thread(self._update, message_id, "user_results", user_id, result)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка сохранения итога для message_id={message_id}: {e}")
+            return False
+
+    async def set_payment(self, message_id: int, user_id: int, amount: int) -> bool:
+        try:
+            return await asyncio.to_thread(self._update, message_id, "payments", user_id, amount)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка сохранения оплаты для message_id={message_id}: {e}")
+            return False
+
+    async def purge_expired(self) -> int:
+        # Удаление идет по индексу expires_at и не просматривает живые чеки
+        try:
+            return await asyncio.to_thread(self._purge)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка очистки хранилища состояний: {e}")
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            with self._lock:
+                entries = self._connection().execute(
+                    "SELECT COUNT(*) FROM receipt_state WHERE expires_at > ?", (time.time(),)
+                ).fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        return {"backend": "sqlite", "path": self._path, "entries": entries}
+
+    async def close(self) -> None:
+        await super().close()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# Сохранение чека целиком: версия больше прежней и не меньше текущего времени в мс (см. stamp_put)
+_PUT_SCRIPT = """
+local version = math.max(tonumber(redis.call('HGET', KEYS[1], 'version') or '0') + 1, tonumber(ARGV[2]))
+version = string.format('%d', version)
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'receipt', ARGV[1], 'version', version, 'base', version)
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return version
+"""
+
+# Атомарная запись поля участника: только для существующего чека, с новой версией и продлением срока жизни
+_UPDATE_FIELD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local version = string.format('%d', redis.call('HINCRBY', KEYS[1], 'version', 1))
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2], 'v:' .. ARGV[1], version)
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# Префиксы полей участников в хэше чека
+_REDIS_FIELDS = {"sel": "user_selections", "res": "user_results", "pay": "payments"}
+
+class RedisStateStore(StateStore):
+    """
+    Хранилище в Redis (или совместимом сервере), общее для нескольких процессов бота.
+
+    Чек лежит в хэше <prefix>:receipt:<message_id>: поле receipt — JSON записи,
+    поля sel:<user_id>, res:<user_id> и pay:<user_id> — выбор, итог и оплата участника,
+    version и base — текущая версия и версия сохранения целиком, v:<поле> — версия
+    последнего изменения поля участника.
+    Участники пишут каждый в свое поле одной командой, поэтому одновременные
+    подтверждения из разных процессов не перезаписывают друг друга. Сроки жизни отслеживает сам Redis.
+    """
+
+    def __init__(self, redis: Any, prefix: str = "splitix", ttl_hours: float = 48):
+        """
+        Args:
+            redis: Клиент redis.asyncio
+            prefix: Префикс ключей
+            ttl_hours: Время жизни чека в часах с последнего изменения
+        """
+        super().__init__()
+        self._redis = redis
+        self._prefix = prefix
+        self._ttl_ms = int(ttl_hours * 3600 * 1000)
+        self._put_receipt = redis.register_script(_PUT_SCRIPT)
+        self._update_field = redis.register_script(_UPDATE_FIELD_SCRIPT)
+
+    def _key(self, message_id: int) -> str:
+        return f"{self._prefix}:receipt:{message_id}"
+
+    async def get(self, message_id: int) -> Optional[ReceiptRecord]:
+        try:
+            fields = await self._redis.hgetall(self._key(message_id))
+        except Exception as e:
+            logger.error(f"Ошибка чтения чека message_id={message_id} из Redis: {e}")
+            return None
+        payload = fields.pop(b"receipt", None)
+        if payload is None:
+            return None
+        try:
+            receipt = receipt_record_adapter().validate_json(payload)
+        except ValidationError as e:
+            logger.error(f"Чек message_id={message_id} в Redis не читается: {e.error_count()} ошибок")
+            return None
+        for name, value in fields.items():
+            kind, _, user_id = name.decode("utf-8").partition(":")
+            if kind in _REDIS_FIELDS:
+                getattr(receipt, _REDIS_FIELDS[kind])[user_id] = json.loads(value)
+            elif kind == "v":
+                kind, _, user_id = user_id.partition(":")
+                if kind in _REDIS_FIELDS:
+                    receipt.changes.setdefault(_REDIS_FIELDS[kind], {})[user_id] = int(value)
+            elif kind == "version":
+                receipt.version = int(value)
+            elif kind == "base":
+                receipt.base_version = int(value)
+        return receipt
+
+    async def put(self, message_id: int, receipt: ReceiptRecord) -> None:
+        receipt.changes = {}
+        try:
+            version = await self._put_receipt(
+                keys=[self._key(message_id)],
+                args=[receipt_record_adapter().dump_json(receipt), int(time.time() * 1000), self._ttl_ms],
+            )
+            receipt.version = receipt.base_version = int(version)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения чека message_id={message_id} в Redis: {e}")
+
+    async def delete(self, message_id: int) -> None:
+        try:
+            await self._redis.delete(self._key(message_id))
+        except Exception as e:
+            logger.error(f"Ошибка удаления чека message_id={message_id} из Redis: {e}")
+
+    async def _set_field(self, message_id: int, field_name: str, value: Any) -> bool:
+        try:
+            updated = await self._update_field(
+                keys=[self._key(message_id)],
+                args=[field_name, json.dumps(value, ensure_ascii=False), self._ttl_ms],
+            )
+        except Exception as e:
+            logger.error(f"Ошибка записи {field_name} для message_id={message_id} в Redis: {e}")
+            return False
+        return bool(updated)
+
+    async def update_selection(self, message_id: int, user_id: int, selection: Dict[str, SelectionValue]) -> bool:
+        return await self._set_field(message_id, f"sel:{user_id}", dict(selection))
+
+    async def set_result(self, message_id: int, user_id: int, result: Dict[str, Any]) -> bool:
+        return await self._set_field(message_id, f"res:{user_id}", result)
+
+    async def set_payment(self, message_id: int, user_id: int, amount: int) -> bool:
+        return await self._set_field(message_id, f"pay:{user_id}", amount)
+
+    async def start(self) -> None:
+        # Фоновая очистка не нужна: ключи с истекшим сроком удаляет сам Redis
+        pass
+
+    async def purge_expired(self) -> int:
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis", "prefix": self._prefix}
+
+def create_state_store(backend: str = STATE_STORE_BACKEND) -> StateStore:
+    """Создает хранилище по настройке STATE_STORE_BACKEND."""
+    if backend == "redis":
+        from services.redis_client import get_redis
+        logger.info(f"Хранилище состояний: Redis (префикс {REDIS_PREFIX})")
+        return RedisStateStore(get_redis(), prefix=REDIS_PREFIX, ttl_hours=STATE_TTL_HOURS)
+    if backend == "sqlite":
+        logger.info(f"Хранилище состояний: SQLite ({STATE_STORE_PATH})")
+        return SQLiteStateStore(STATE_STORE_PATH, ttl_hours=STATE_TTL_HOURS)
+    if backend != "memory":
+        logger.warning(f"Неизвестный STATE_STORE_BACKEND '{backend}', используется memory")
+    journal = None
+    if STATE_JOURNAL_ENABLED:
+        journal = StateJournal(
+            STATE_JOURNAL_DIR,
+            snapshot_interval=STATE_SNAPSHOT_INTERVAL,
+            max_records=STATE_JOURNAL_MAX_RECORDS,
+        )
+    return MemoryStateStore(
+        max_bytes=STATE_STORE_MAX_BYTES,
+        max_entries=STATE_STORE_MAX_ENTRIES,
+        ttl_hours=STATE_TTL_HOURS,
+        journal=journal,
+    )
+
+# Глобальное хранилище состояний чеков
+state_store = create_state_store()
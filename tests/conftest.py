@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# config.settings читает окружение при импорте: задаем обязательные значения до импорта модулей бота
+_data_dir = tempfile.mkdtemp(prefix="splitix-tests-")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:test-token")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("STATE_STORE_BACKEND", "memory")
+os.environ.setdefault("STATE_JOURNAL_ENABLED", "false")
+os.environ.setdefault("LEDGER_BACKEND", "sqlite")
+os.environ.setdefault("LEDGER_PATH", os.path.join(_data_dir, "ledger.sqlite3"))
+os.environ.setdefault("RECOGNITION_CACHE_PATH", os.path.join(_data_dir, "recognition_cache.sqlite3"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,86 @@
+"""Разбор ответа модели: repair_json для неидеального и обрезанного JSON, IncrementalItemsParser для потока."""
+import json
+from utils.json_repair import repair_json
+from utils.json_stream import IncrementalItemsParser
+
+RESPONSE = {
+    "items": [
+        {"description": "Пицца \"Маргарита\" {большая}", "quantity": 1, "total_amount": 500},
+        {"description": "Чай [черный], с лимоном", "quantity": 2, "total_amount": 200},
+    ],
+    "service_charge_percent": 10,
+}
+
+# ---------------------------------------------------------------------------
+# repair_json
+# ---------------------------------------------------------------------------
+
+def test_repair_valid_and_wrapped_json():
+    text = json.dumps(RESPONSE, ensure_ascii=False)
+    assert repair_json(text) == RESPONSE
+    assert repair_json(f"Вот результат:\n```json\n{text}\n```\nГотово.") == RESPONSE
+
+def test_repair_trailing_commas():
+    assert repair_json('{"items": [{"a": 1,}, {"a": 2},], "b": "x,]",}') == {"items": [{"a": 1}, {"a": 2}], "b": "x,]"}
+
+def test_repair_not_json():
+    assert repair_json("") is None
+    assert repair_json("нет данных") is None
+    assert repair_json("{\"a\": }") is None
+
+def test_repair_truncated_inside_item_drops_it():
+    text = '{"items": [{"description": "A", "total_amount": 1}, {"description": "B", "total'
+    assert repair_json(text) == {"items": [{"description": "A", "total_amount": 1}]}
+
+def test_repair_truncated_inside_string():
+    text = '{"items": [{"description": "A", "total_amount": 1}, {"description": "Пиц'
+    assert repair_json(text) == {"items": [{"description": "A", "total_amount": 1}]}
+    # Обрезка до первой безопасной точки: остается пустой объект
+    assert repair_json('{"items": [{"description": "A {[,') == {}
+
+def test_repair_truncated_after_array():
+    text = '{"items": [{"description": "A"}], "service_charge_percent": 1'
+    assert repair_json(text) == {"items": [{"description": "A"}]}
+    assert repair_json('{"items": [{"description": "A"}],') == {"items": [{"description": "A"}]}
+
+def test_repair_every_prefix_keeps_complete_items():
+    text = json.dumps(RESPONSE, ensure_ascii=False)
+    for cut in range(1, len(text)):
+        repaired = repair_json(text[:cut])
+        assert repaired is not None, text[:cut]
+        items = repaired.get("items", [])
+        assert items == RESPONSE["items"][:len(items)]
+
+# ---------------------------------------------------------------------------
+# IncrementalItemsParser
+# ---------------------------------------------------------------------------
+
+def test_parser_emits_items_as_they_close():
+    text = "```json\n" + json.dumps(RESPONSE, ensure_ascii=False) + "\n```"
+    parser = IncrementalItemsParser()
+    emitted = []
+    for char in text:
+        emitted.extend(parser.feed(char))
+    assert emitted == RESPONSE["items"]
+    assert parser.items_emitted == 2
+    assert parser.text == text
+
+def test_parser_emits_first_item_before_the_rest_arrives():
+    text = json.dumps(RESPONSE, ensure_ascii=False)
+    first_end = text.index("500}") + len("500}")
+    parser = IncrementalItemsParser()
+    assert parser.feed(text[:first_end]) == RESPONSE["items"][:1]
+    assert parser.feed(text[first_end:]) == RESPONSE["items"][1:]
+
+def test_parser_ignores_other_arrays_and_nested_objects():
+    data = {
+        "notes": [{"description": "не позиция"}],
+        "items": [{"description": "A", "meta": {"x": [1, {"y": 2}]}}, 5, {"description": "B"}],
+        "extra": {"items": [{"description": "вложенный"}]},
+    }
+    parser = IncrementalItemsParser()
+    assert parser.feed(json.dumps(data)) == [data["items"][0], data["items"][2]]
+
+def test_parser_custom_array_key():
+    parser = IncrementalItemsParser(array_key="lines")
+    assert parser.feed('{"items": [{"a": 1}], "lines": [{"b": 2}]}') == [{"b": 2}]
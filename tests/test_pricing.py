@@ -0,0 +1,166 @@
+"""Деление сумм: allocate, расчет чека PricingPlan и инкрементальные доли SplitTotals."""
+import random
+import pytest
+from models.receipt import receipt_from_api
+from utils.money import allocate
+from utils.pricing import UNCLAIMED, PricingPlan, SplitTotals
+
+RECEIPT = {
+    "items": [
+        {"description": "Пицца", "quantity": 1, "total_amount": 777.77},
+        {"description": "Чай", "quantity": 3, "total_amount": 100},
+        {"description": "Вино", "quantity": 1, "total_amount": 1000.01},
+        {"description": "Хлеб", "quantity": 2, "unit_price_from_openai": 33.33, "discount_percent": 15},
+    ],
+    "total_discount_percent": 7.5,
+    "service_charge_percent": 12.5,
+}
+
+def make_plan(payload=RECEIPT):
+    return PricingPlan.from_receipt(receipt_from_api(payload))
+
+def assert_closes(totals):
+    """Доли участников вместе с невыбранной частью в точности дают итог чека."""
+    shares = totals.shares()
+    plan = totals.plan
+    assert sum(share.total for share in shares.values()) == plan.total
+    assert sum(share.items_total for share in shares.values()) == plan.items_total
+    assert sum(share.discount for share in shares.values()) == plan.discount
+    assert sum(share.service_charge for share in shares.values()) == plan.service_charge
+
+# ---------------------------------------------------------------------------
+# allocate
+# ---------------------------------------------------------------------------
+
+def test_allocate_gives_leftover_to_largest_remainders():
+    assert allocate(100, [1, 1, 1]) == [34, 33, 33]
+    assert allocate(10, [1, 2, 3]) == [2, 3, 5]
+    assert allocate(-100, [1, 1, 1]) == [-34, -33, -33]
+
+def test_allocate_zero_weights():
+    assert allocate(100, [0, 0]) == [0, 0]
+    assert allocate(100, []) == []
+    assert allocate(100, [0, 5]) == [0, 100]
+
+def test_allocate_preserves_total():
+    rng = random.Random(1)
+    for _ in range(500):
+        weights = [rng.randint(0, 50) for _ in range(rng.randint(1, 8))]
+        total = rng.randint(-100000, 100000)
+        shares = allocate(total, weights)
+        if sum(weights):
+            assert sum(shares) == total
+        for share, weight in zip(shares, weights):
+            if weight == 0:
+                assert share == 0
+
+# ---------------------------------------------------------------------------
+# PricingPlan
+# ---------------------------------------------------------------------------
+
+def test_plan_totals():
+    plan = make_plan()
+    # Хлеб: 2 × 33.33 = 66.66, скидка 15% → 66.66 - 10.00 = 56.66
+    assert plan.line_totals == (77777, 10000, 100001, 5666)
+    assert plan.items_total == 193444
+    assert plan.discount == 14508
+    assert plan.service_charge == 22367
+    assert plan.total == plan.items_total - plan.discount + plan.service_charge
+    assert sum(plan.line_discounts) == plan.discount
+    assert sum(plan.line_service_charges) == plan.service_charge
+    assert plan.quantities == (1, 3, 1, 2)
+
+def test_plan_with_fixed_discount_amount():
+    plan = make_plan({"items": [{"description": "A", "total_amount": 10}, {"description": "B", "total_amount": 20}],
+                      "total_discount_amount": 1})
+    assert plan.discount == 100
+    assert plan.line_discounts == (33, 67)
+    assert plan.discount_percent == 333
+
+def test_split_of_whole_receipt_has_nothing_unclaimed():
+    plan = make_plan()
+    shares = plan.split({"1": {"0": 1, "1": 3, "2": 1, "3": 2}})
+    assert shares["1"].total == plan.total
+    assert shares[UNCLAIMED].total == 0
+
+def test_split_by_quantity():
+    plan = make_plan()
+    shares = plan.split({"1": {"1": 1}, "2": {"1": 1}})
+    line = plan.line_totals[1]
+    assert shares["1"].items == {1: (1, 3334)}
+    assert shares["2"].items == {1: (1, 3333)}
+    assert shares[UNCLAIMED].items_total == plan.items_total - line + 3333
+
+def test_parse_selection_drops_bad_keys():
+    plan = make_plan()
+    counts, weights = plan.parse_selection({"0": 1, "9": 1, "x": 1, "1": 0, "2": {"share": 2}, "3": "bad"})
+    assert counts == {0: 1}
+    assert weights == {2: 2}
+
+# ---------------------------------------------------------------------------
+# SplitTotals
+# ---------------------------------------------------------------------------
+
+def test_shared_item_split_by_weights():
+    plan = make_plan()
+    totals = SplitTotals(plan, {"1": {"2": {"share": 1}}, "2": {"2": {"share": 2}}})
+    first, second = totals.share("1"), totals.share("2")
+    assert first.shared == {2: (1, 3, 33334)}
+    assert second.shared == {2: (2, 3, 66667)}
+    assert totals.unclaimed().items_total == plan.items_total - plan.line_totals[2]
+    assert_closes(totals)
+
+def test_shared_weights_take_units_nobody_claimed():
+    plan = make_plan()
+    # Одну чашку чая взял участник 1, две оставшиеся делят 2 и 3
+    totals = SplitTotals(plan, {"1": {"1": 1}, "2": {"1": {"share": 1}}, "3": {"1": {"share": 1}}})
+    assert totals.share("1").items == {1: (1, 3333)}
+    assert totals.share("2").shared[1] == (1, 2, 3334)
+    assert totals.share("3").shared[1] == (1, 2, 3333)
+    assert totals.unclaimed().items_total == plan.items_total - plan.line_totals[1]
+    assert_closes(totals)
+
+def random_selection(rng, lines):
+    selection = {}
+    for index in rng.sample(range(lines), rng.randint(0, lines)):
+        if rng.random() < 0.3:
+            selection[str(index)] = {"share": rng.randint(1, 3)}
+        else:
+            selection[str(index)] = rng.randint(0, 3)
+    return selection
+
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_updates_match_full_split(seed):
+    rng = random.Random(seed)
+    plan = make_plan()
+    totals = SplitTotals(plan)
+    selections = {}
+    for _ in range(60):
+        user = str(rng.randint(1, 5))
+        selection = random_selection(rng, len(plan.line_totals))
+        selections[user] = selection
+        totals.set_selection(user, selection)
+        assert_closes(totals)
+    # Инкрементальный результат совпадает с расчетом с нуля (и не зависит от порядка выбора)
+    assert totals.shares() == plan.split(selections)
+
+def test_preview_does_not_change_state():
+    plan = make_plan()
+    totals = SplitTotals(plan, {"1": {"0": 1}})
+    before = totals.shares()
+    preview = totals.preview("2", {"1": 2, "2": {"share": 1}})
+    assert totals.shares() == before
+    totals.set_selection("2", {"1": 2, "2": {"share": 1}})
+    assert totals.share("2") == preview
+
+def test_rendered_is_cached_until_share_changes():
+    plan = make_plan()
+    totals = SplitTotals(plan, {"1": {"0": 1}, "2": {"1": 1}})
+    calls = []
+    render = lambda share: calls.append(share.total) or share.total
+    totals.rendered("1", render)
+    totals.rendered("2", render)
+    totals.set_selection("2", {"1": 2})
+    totals.rendered("1", render)
+    totals.rendered("2", render)
+    assert len(calls) == 3
@@ -0,0 +1,100 @@
+"""Взаиморасчет: переводы settle (точный минимум и жадный зачет) и settle_receipt по чеку."""
+import random
+import pytest
+from models.receipt import receipt_from_api
+from utils.settlement import EXACT_SETTLEMENT_LIMIT, _zero_sum_groups, confirmed_receipt, settle, settle_receipt
+
+def apply_transfers(balances, transfers):
+    """Балансы после переводов: должник отдает, кредитор получает."""
+    result = dict(balances)
+    for transfer in transfers:
+        assert transfer.amount > 0
+        result[transfer.debtor] += transfer.amount
+        result[transfer.creditor] -= transfer.amount
+    return result
+
+def random_balances(rng, count):
+    amounts = [rng.randint(-50000, 50000) for _ in range(count - 1)]
+    amounts.append(-sum(amounts))
+    return {f"u{i}": amount for i, amount in enumerate(amounts)}
+
+# ---------------------------------------------------------------------------
+# settle / _zero_sum_groups
+# ---------------------------------------------------------------------------
+
+def test_settle_simple():
+    transfers = settle({"a": 300, "b": -100, "c": -200})
+    assert sorted((t.debtor, t.creditor, t.amount) for t in transfers) == [("b", "a", 100), ("c", "a", 200)]
+
+def test_settle_empty_and_zero_balances():
+    assert settle({}) == []
+    assert settle({"a": 0, "b": 0}) == []
+
+def test_settle_uses_zero_sum_groups():
+    # Две независимые пары: хватает двух переводов (жадный зачет дал бы три)
+    balances = {"a": 500, "b": -500, "c": 301, "d": -301, "e": 0}
+    transfers = settle(balances)
+    assert len(transfers) == 2
+    assert all(amount == 0 for amount in apply_transfers(balances, transfers).values())
+
+def test_zero_sum_groups_finds_most_groups():
+    balances = [("a", 5), ("b", -3), ("c", -2), ("d", 7), ("e", -7), ("f", 1), ("g", -1)]
+    groups = _zero_sum_groups(balances)
+    assert len(groups) == 3
+    assert sorted(sorted(user for user, _ in group) for group in groups) == [["a", "b", "c"], ["d", "e"], ["f", "g"]]
+    for group in groups:
+        assert sum(amount for _, amount in group) == 0
+
+@pytest.mark.parametrize("count", [2, 3, 5, EXACT_SETTLEMENT_LIMIT, EXACT_SETTLEMENT_LIMIT + 5, 60])
+def test_transfers_close_balances(count):
+    rng = random.Random(count)
+    for _ in range(20):
+        balances = random_balances(rng, count)
+        transfers = settle(balances)
+        assert all(amount == 0 for amount in apply_transfers(balances, transfers).values())
+        nonzero = sum(1 for amount in balances.values() if amount)
+        assert len(transfers) <= max(nonzero - 1, 0)
+
+# ---------------------------------------------------------------------------
+# settle_receipt
+# ---------------------------------------------------------------------------
+
+RECEIPT = {
+    "items": [
+        {"description": "Пицца", "quantity": 1, "total_amount": 900},
+        {"description": "Чай", "quantity": 3, "total_amount": 100},
+    ],
+    "service_charge_percent": 10,
+}
+
+def test_settle_receipt_without_payments_has_no_transfers():
+    receipt = receipt_from_api({**RECEIPT, "user_selections": {"1": {"0": 1}}})
+    settlement = settle_receipt(receipt)
+    assert settlement.shares == {"1": 99000}
+    assert settlement.balances == {}
+    assert settlement.transfers == []
+
+def test_settle_receipt_spreads_unclaimed_over_payers():
+    receipt = receipt_from_api({
+        **RECEIPT,
+        "user_selections": {"1": {"0": 1}, "2": {"1": 1}},
+        "payments": {"1": 700, "3": 400},
+    })
+    settlement = settle_receipt(receipt)
+    assert settlement.shares == {"1": 99000, "2": 3666}
+    assert settlement.unclaimed == 7334
+    assert sum(settlement.payments.values()) == 110000
+    assert sum(settlement.balances.values()) == 0
+    assert all(amount == 0 for amount in apply_transfers(settlement.balances, settlement.transfers).values())
+
+def test_confirmed_receipt_uses_confirmed_selection():
+    receipt = receipt_from_api({
+        **RECEIPT,
+        "user_selections": {"1": {"0": 1, "1": 3}, "2": {"1": 1}},
+        "user_results": {"1": {"selected_items": {"0": 1}}},
+        "payments": {"1": 1100},
+    })
+    settlement = settle_receipt(confirmed_receipt(receipt))
+    assert settlement.shares == {"1": 99000}
+    assert settlement.balances == {"1": 0}
+    assert settlement.transfers == []
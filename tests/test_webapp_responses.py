@@ -0,0 +1,126 @@
+"""Что получает клиент веб-приложения: ETag и 304, кодировки, данные чека в странице, ?since=."""
+import json
+import asyncio
+from aiohttp.test_utils import make_mocked_request
+from models.receipt import receipt_from_api
+from services.state_store import state_store
+from webapp.backend import assets
+from webapp.backend.assets import accepted_encodings, embed_json, not_modified
+from webapp.backend.routes import get_receipt
+
+RECEIPT = {
+    "items": [
+        {"description": "Пицца", "quantity": 1, "total_amount": 500},
+        {"description": "Чай", "quantity": 2, "total_amount": 200},
+    ],
+    "service_charge_percent": 10,
+}
+
+def request_with(headers=None, path="/"):
+    return make_mocked_request("GET", path, headers=headers or {})
+
+# ---------------------------------------------------------------------------
+# not_modified / accepted_encodings
+# ---------------------------------------------------------------------------
+
+def test_not_modified_matches_exact_and_listed_etags():
+    assert not_modified(request_with({"If-None-Match": '"abc"'}), '"abc"')
+    assert not_modified(request_with({"If-None-Match": '"x", "abc" ,"y"'}), '"abc"')
+    assert not_modified(request_with({"If-None-Match": "*"}), '"abc"')
+
+def test_not_modified_rejects_other_or_missing_etags():
+    assert not not_modified(request_with(), '"abc"')
+    assert not not_modified(request_with({"If-None-Match": '"abcd"'}), '"abc"')
+    # Без кавычек это другой тег
+    assert not not_modified(request_with({"If-None-Match": "abc"}), '"abc"')
+
+def test_accepted_encodings_skips_q_zero():
+    assert accepted_encodings(request_with({"Accept-Encoding": "gzip;q=0, deflate"})) == ()
+    assert accepted_encodings(request_with({"Accept-Encoding": "gzip; q=0.000"})) == ()
+    assert accepted_encodings(request_with({"Accept-Encoding": "GZIP;q=0.5"})) == ("gzip",)
+    assert accepted_encodings(request_with()) == ()
+
+def test_accepted_encodings_prefers_brotli_when_available():
+    encodings = accepted_encodings(request_with({"Accept-Encoding": "gzip, br"}))
+    assert encodings == (("br", "gzip") if assets.brotli else ("gzip",))
+
+# ---------------------------------------------------------------------------
+# embed_json
+# ---------------------------------------------------------------------------
+
+def test_embed_json_cannot_close_script_tag():
+    data = {"description": "</script><script>alert(1)</script>", "note": "<!-- & -->"}
+    embedded = embed_json(data)
+    assert b"</script" not in embedded.lower()
+    assert b"<" not in embedded and b">" not in embedded and b"&" not in embedded
+    assert json.loads(embedded) == data
+
+def test_embed_json_escapes_line_separators():
+    data = {"description": "a\u2028b\u2029c"}
+    embedded = embed_json(data)
+    assert "\u2028".encode("utf-8") not in embedded and "\u2029".encode("utf-8") not in embedded
+    assert json.loads(embedded) == data
+
+# ---------------------------------------------------------------------------
+# GET /api/receipt/<id>
+# ---------------------------------------------------------------------------
+
+async def fetch(message_id, query="", headers=None):
+    request = make_mocked_request(
+        "GET", f"/api/receipt/{message_id}{query}", headers=headers or {},
+        match_info={"message_id": str(message_id)},
+    )
+    response = await get_receipt(request)
+    body = json.loads(response.body) if response.body else None
+    return response, body
+
+def test_get_receipt_etag_and_304():
+    async def scenario():
+        await state_store.put(9001, receipt_from_api(RECEIPT))
+        response, body = await fetch(9001)
+        assert response.status == 200
+        assert response.headers["ETag"] == f'"{body["version"]}"'
+        assert response.headers["Cache-Control"] == "no-cache"
+        etag = response.headers["ETag"]
+
+        response, body = await fetch(9001, headers={"If-None-Match": etag})
+        assert response.status == 304
+        assert body is None
+
+        # Изменение выбора меняет версию: старый ETag больше не совпадает
+        assert await state_store.update_selection(9001, 42, {"0": 1})
+        response, body = await fetch(9001, headers={"If-None-Match": etag})
+        assert response.status == 200
+        assert body["user_selections"] == {"42": {"0": 1}}
+        assert response.headers["ETag"] != etag
+    asyncio.run(scenario())
+
+def test_get_receipt_since_returns_only_changes():
+    async def scenario():
+        await state_store.put(9002, receipt_from_api(RECEIPT))
+        _, full = await fetch(9002)
+        version = full["version"]
+        assert await state_store.update_selection(9002, 1, {"0": 1})
+        assert await state_store.update_selection(9002, 2, {"1": 2})
+
+        response, body = await fetch(9002, f"?since={version + 1}")
+        assert response.status == 200
+        assert body == {
+            "version": version + 2,
+            "since": version + 1,
+            "changes": {"user_selections": {"2": {"1": 2}}, "user_results": {}, "payments": {}},
+        }
+
+        # Версия до сохранения чека целиком: изменений не восстановить, отдается весь чек
+        _, body = await fetch(9002, f"?since={version - 1}")
+        assert "items" in body and body["version"] == version + 2
+    asyncio.run(scenario())
+
+def test_get_receipt_rejects_bad_since_and_missing_receipt():
+    async def scenario():
+        await state_store.put(9003, receipt_from_api(RECEIPT))
+        response, _ = await fetch(9003, "?since=abc")
+        assert response.status == 400
+        response, _ = await fetch(9999999)
+        assert response.status == 404
+    asyncio.run(scenario())
@@ -104,8 +104,8 @@ def parse_quantity(raw_quantity):
     """
     Преобразует количество из строки/числа в int (или 1 для весовых товаров).
     """
-    if isinstance(raw_quantity, (int, float)):
-        if float(raw_quantity) != int(raw_quantity):
+    if isinstance(raw_quantity, (int, float, Decimal)):
+        if raw_quantity != int(raw_quantity):
             return 1
         return int(raw_quantity)
     elif isinstance(raw_quantity, str):
@@ -1,74 +1,105 @@
+import html
 from decimal import Decimal
 from typing import Dict, Any, Optional, List, Tuple
+from models.receipt import ReceiptLine, ReceiptRecord
+from utils.money import format_minor
+from utils.pricing import pricing_plan
+from utils.settlement import Settlement, Transfer
 
-def format_item_line(item: Dict[str, Any]) -> str:
+def format_item_line(item: ReceiptLine) -> str:
     """Форматирует строку товара для сообщения"""
-    description = item.get("description", "N/A")
-    quantity = item.get("quantity_from_openai", 1)
-    unit_price = item.get("unit_price_from_openai")
-    total_amount = item.get("total_amount_from_openai")
+    if item.unit_price is not None:
+        return f"• {item.description}: {format_minor(item.unit_price)} × {item.quantity} = {format_minor(item.unit_price * item.quantity)}\n"
+    elif item.total_amount is not None:
+        return f"• {item.description}: {format_minor(item.total_amount)}\n"
     
-    if unit_price is not None:
-        return f"• {description}: {unit_price:.2f} × {quantity} = {unit_price * quantity:.2f}\n"
-    elif total_amount is not None:
-        return f"• {description}: {total_amount:.2f}\n"
-    
-    return f"• {description}\n"
+    return f"• {item.description}\n"
 
-def calculate_totals(items: List[Dict[str, Any]], 
-                    service_charge: Optional[Decimal], 
-                    total_discount_amount: Optional[Decimal]) -> Tuple[Decimal, Decimal, Decimal]:
-    """Рассчитывает итоговые суммы"""
-    total_items_cost = sum(
-        item["total_amount_from_openai"] 
-        for item in items 
-        if item.get("total_amount_from_openai") is not None
-    )
-    
-    total_discounts = total_discount_amount or Decimal("0.00")
-    calculated_total = total_items_cost - total_discounts
-    
-    service_charge_amount = Decimal("0.00")
-    if service_charge is not None:
-        service_charge_amount = (calculated_total * service_charge / Decimal("100")).quantize(Decimal("0.01"))
-        calculated_total += service_charge_amount
-    
-    actual_discount_percent = Decimal("0.00")
-    if total_items_cost > 0:
-        actual_discount_percent = (total_discounts * Decimal("100") / total_items_cost).quantize(Decimal("0.01"))
-    
-    return calculated_total, service_charge_amount, actual_discount_percent 
+def format_progress_message(items: List[Dict[str, Any]]) -> str:
+    """Форматирует промежуточное сообщение со списком позиций, распознанных на данный момент."""
+    lines = ["⏳ <b>Распознаю чек...</b>\n"]
+    for item in items:
+        description = html.escape(str(item.get("description") or "N/A"))
+        total_amount = item.get("total_amount")
+        if isinstance(total_amount, (int, float)):
+            lines.append(f"• {description}: {total_amount:.2f}")
+        else:
+            lines.append(f"• {description}")
+    lines.append(f"\n<i>Найдено позиций: {len(items)}</i>")
+    return "\n".join(lines)
+
+def calculate_totals(receipt: ReceiptRecord) -> Tuple[int, int, int]:
+    """
+    Рассчитывает итоговые суммы по расчету чека (utils.pricing).
+
+    Returns:
+        (расчетный итог и сервисный сбор в минимальных единицах,
+         фактический процент общей скидки в сотых долях процента)
+    """
+    plan = pricing_plan(receipt)
+    return plan.total, plan.service_charge, plan.discount_percent
 
 def format_user_summary(
     username: str,
-    items: List[Dict[str, Any]],
+    items: List[ReceiptLine],
     user_counts: Dict[str, int],
     total_sum: Decimal,
     summary: str
 ) -> str:
     """Форматирует итоговое сообщение для пользователя."""
-    user_mention = f"@{username}" if username else "Пользователь"
+    user_mention = f"@{html.escape(username)}" if username else "Пользователь"
     return f"<b>{user_mention}, ваш выбор:</b>\n\n{summary}"
 
-def format_final_summary(
-    user_results: Dict[int, Dict[str, Any]],
-    usernames: Dict[int, str]
-) -> str:
-    """Форматирует финальный итог с результатами всех участников."""
-    summary = "<b>💸 Итог взаиморасчетов</b>\n\n"
-    
-    # Собираем данные о платежах
-    payments = []
-    for user_id, result in user_results.items():
-        username = usernames.get(user_id, f"Пользователь {user_id}")
-        total_sum = Decimal(str(result["total_sum"]))
-        payments.append((username, total_sum))
+def format_final_summary(settlement: Settlement, usernames: Dict[str, str]) -> str:
+    """Форматирует финальный итог: доли участников и переводы, закрывающие взаиморасчет."""
+    def name(user_id: str) -> str:
+        return html.escape(usernames.get(user_id, f"Пользователь {user_id}"))
+
+    lines = ["<b>💸 Итог взаиморасчетов</b>", ""]
     
-    # Сортируем по сумме (от большей к меньшей)
-    payments.sort(key=lambda x: x[1], reverse=True)
+    # Доли участников (от большей к меньшей)
+    for user_id, amount in sorted(settlement.shares.items(), key=lambda x: x[1], reverse=True):
+        lines.append(f"{name(user_id)}: {format_minor(amount)}")
+    if settlement.unclaimed:
+        lines.append(f"<i>Не выбрано: {format_minor(settlement.unclaimed)}</i>")
     
-    # Формируем итог
-    for username, amount in payments:
-        summary += f"{username}: {amount:.2f}\n"
+    # Кто кому переводит
+    if not settlement.payments:
+        lines.extend(["", "<i>Неизвестно, кто оплатил чек, поэтому переводы не рассчитаны.</i>"])
+    elif settlement.transfers:
+        lines.extend(["", "<b>🔁 Переводы:</b>"])
+        lines.extend(
+            f"{name(transfer.debtor)} → {name(transfer.creditor)}: {format_minor(transfer.amount)}"
+            for transfer in settlement.transfers
+        )
+    else:
+        lines.extend(["", "✅ Все в расчете, переводы не нужны."])
     
-    return summary 
\ No newline at end of file
+    return "\n".join(lines) + "\n"
+
+def format_ledger_summary(
+    title: str,
+    balances: Dict[str, int],
+    transfers: List[Transfer],
+    usernames: Dict[str, str]
+) -> str:
+    """Форматирует балансы журнала взаиморасчетов (поездки) и переводы между участниками."""
+    def name(user_id: str) -> str:
+        return html.escape(usernames.get(user_id, f"Пользователь {user_id}"))
+
+    lines = [f"<b>🧾 {html.escape(title)}</b>", ""]
+    if not balances:
+        lines.append("✅ Все в расчете, переводы не нужны.")
+        return "\n".join(lines) + "\n"
+
+    # Балансы: сначала те, кому должны больше всего
+    for user_id, amount in sorted(balances.items(), key=lambda x: x[1], reverse=True):
+        sign = "+" if amount > 0 else "-"
+        lines.append(f"{name(user_id)}: {sign}{format_minor(abs(amount))}")
+
+    lines.extend(["", "<b>🔁 Переводы:</b>"])
+    lines.extend(
+        f"{name(transfer.debtor)} → {name(transfer.creditor)}: {format_minor(transfer.amount)}"
+        for transfer in transfers
+    )
+    return "\n".join(lines) + "\n"
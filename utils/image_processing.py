@@ -0,0 +1,113 @@
+import logging
+from io import BytesIO
+from typing import Optional, Tuple
+from PIL import Image, ImageFilter, ImageOps, UnidentifiedImageError
+from config.settings import (
+    IMAGE_PREPROCESSING_ENABLED,
+    IMAGE_GRAYSCALE,
+    IMAGE_AUTOCROP,
+    IMAGE_TARGET_LONG_EDGE,
+    IMAGE_JPEG_QUALITY,
+)
+
+logger = logging.getLogger(__name__)
+
+#: Размер уменьшенной копии, по которой ищутся границы чека
+AUTOCROP_PREVIEW_SIZE = 256
+#: Отступ вокруг найденных границ (доля от размера изображения)
+AUTOCROP_MARGIN = 0.02
+#: Если найденная область меньше этой доли кадра, считаем, что граница не найдена
+AUTOCROP_MIN_AREA = 0.15
+
+def detect_mime_type(image_data: bytes) -> str:
+    """Определяет MIME-тип изображения по сигнатуре файла."""
+    if image_data.startswith(b"\x89PNG"):
+        return "image/png"
+    if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+        return "image/webp"
+    if image_data[:3] == b"GIF":
+        return "image/gif"
+    return "image/jpeg"
+
+def find_receipt_bounds(image: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Ищет границы чека на изображении.
+
+    Чек обычно светлее фона (стол, скатерть), поэтому на уменьшенной копии
+    берутся пиксели ярче среднего, и по ним строится ограничивающий прямоугольник.
+    Возвращает координаты в масштабе исходного изображения или None.
+    """
+    preview = image.convert("L")
+    preview.thumbnail((AUTOCROP_PREVIEW_SIZE, AUTOCROP_PREVIEW_SIZE))
+    preview = preview.filter(ImageFilter.MedianFilter(5))
+
+    histogram = preview.histogram()
+    pixels = sum(histogram)
+    mean = sum(value * count for value, count in enumerate(histogram)) / pixels
+    threshold = min(250, int(mean + (255 - mean) * 0.25))
+
+    bbox = preview.point(lambda value: 255 if value >= threshold else 0).getbbox()
+    if bbox is None:
+        return None
+
+    left, top, right, bottom = bbox
+    if (right - left) * (bottom - top) < AUTOCROP_MIN_AREA * preview.width * preview.height:
+        return None
+
+    scale_x = image.width / preview.width
+    scale_y = image.height / preview.height
+    margin_x = int(image.width * AUTOCROP_MARGIN)
+    margin_y = int(image.height * AUTOCROP_MARGIN)
+    return (
+        max(0, int(left * scale_x) - margin_x),
+        max(0, int(top * scale_y) - margin_y),
+        min(image.width, int(right * scale_x) + margin_x),
+        min(image.height, int(bottom * scale_y) + margin_y),
+    )
+
+def preprocess_receipt_image(image_data: bytes) -> Tuple[bytes, str]:
+    """
+    Готовит фото чека к отправке в OpenAI Vision.
+
+    Поворачивает изображение по EXIF, переводит в оттенки серого, обрезает по границам чека,
+    уменьшает до IMAGE_TARGET_LONG_EDGE по длинной стороне и пережимает в JPEG.
+    Функция выполняет работу на CPU, поэтому из асинхронного кода ее нужно вызывать
+    через asyncio.to_thread.
+
+    Returns:
+        Кортеж (байты изображения, MIME-тип)
+    """
+    if not IMAGE_PREPROCESSING_ENABLED:
+        return image_data, detect_mime_type(image_data)
+
+    try:
+        with Image.open(BytesIO(image_data)) as original:
+            original_size = original.size
+            image = ImageOps.exif_transpose(original)
+            image = image.convert("L" if IMAGE_GRAYSCALE else "RGB")
+
+            if IMAGE_AUTOCROP:
+                bounds = find_receipt_bounds(image)
+                if bounds is not None:
+                    image = image.crop(bounds)
+
+            if max(image.size) > IMAGE_TARGET_LONG_EDGE:
+                image.thumbnail((IMAGE_TARGET_LONG_EDGE, IMAGE_TARGET_LONG_EDGE), Image.Resampling.LANCZOS)
+
+            output = BytesIO()
+            image.save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+            processed = output.getvalue()
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        logger.warning(f"Не удалось обработать изображение, отправляем оригинал: {e}")
+        return image_data, detect_mime_type(image_data)
+
+    if len(processed) >= len(image_data) and image.size == original_size:
+        # Исходное изображение уже компактнее, а размеры не изменились — нет смысла его заменять
+        logger.info(f"Предобработка изображения: {len(image_data)} байт, оставляем оригинал")
+        return image_data, detect_mime_type(image_data)
+
+    logger.info(
+        f"Предобработка изображения: {len(image_data)} → {len(processed)} байт "
+        f"({len(processed) / len(image_data):.0%}), размер {image.width}x{image.height}"
+    )
+    return processed, "image/jpeg"
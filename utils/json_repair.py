@@ -0,0 +1,114 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+def _strip_trailing_commas(text: str) -> str:
+    """Удаляет запятые перед закрывающими скобками (вне строк)."""
+    result: List[str] = []
+    in_string = False
+    escape = False
+    length = len(text)
+    for pos, char in enumerate(text):
+        if in_string:
+            result.append(char)
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char == ",":
+            lookahead = pos + 1
+            while lookahead < length and text[lookahead] in " \t\r\n":
+                lookahead += 1
+            if lookahead < length and text[lookahead] in "}]":
+                continue
+        result.append(char)
+    return "".join(result)
+
+def _scan(text: str) -> Tuple[Optional[int], int, Tuple[str, ...]]:
+    """
+    Проходит по тексту, начинающемуся с '{'.
+
+    Returns:
+        (позиция закрытия объекта верхнего уровня или None,
+         последняя безопасная точка обрезки, стек открытых скобок в этой точке)
+
+    Безопасная точка — граница между элементами массива или ключами объекта верхнего уровня:
+    все, что до нее, является законченными значениями. Незаконченный объект внутри массива
+    при обрезке отбрасывается целиком.
+    """
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    safe_pos = 1
+    safe_stack: Tuple[str, ...] = ("{",)
+
+    for pos, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append(char)
+        elif char in "}]":
+            if not stack:
+                continue
+            stack.pop()
+            if not stack:
+                return pos, safe_pos, safe_stack
+            if stack[-1] == "[" or len(stack) == 1:
+                safe_pos, safe_stack = pos + 1, tuple(stack)
+        elif char == ",":
+            if stack and (stack[-1] == "[" or len(stack) == 1):
+                safe_pos, safe_stack = pos, tuple(stack)
+
+    return None, safe_pos, safe_stack
+
+def repair_json(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Восстанавливает JSON-объект из неидеального ответа модели.
+
+    Обрабатывает:
+    - пояснения и markdown-ограждения вокруг JSON;
+    - запятые перед закрывающими скобками;
+    - обрезанный ответ (незакрытые массивы и объекты): незаконченный элемент отбрасывается,
+      скобки закрываются, уже распознанные позиции сохраняются.
+
+    Returns:
+        Восстановленный словарь или None, если восстановить не удалось
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+
+    candidate = _strip_trailing_commas(text[start:])
+    end, safe_pos, safe_stack = _scan(candidate)
+
+    if end is not None:
+        repaired = candidate[:end + 1]
+    else:
+        closers = "".join(_CLOSERS[opener] for opener in reversed(safe_stack))
+        repaired = _strip_trailing_commas(candidate[:safe_pos] + closers)
+        logger.warning(f"JSON обрезан, восстановлено {safe_pos} из {len(candidate)} символов")
+
+    try:
+        data = json.loads(repaired)
+    except json.JSONDecodeError as e:
+        logger.error(f"Не удалось восстановить JSON: {e}")
+        return None
+    return data if isinstance(data, dict) else None
@@ -0,0 +1,101 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class IncrementalItemsParser:
+    """
+    Инкрементальный парсер ответа OpenAI.
+
+    Принимает текст ответа по частям (как он приходит в streaming-режиме) и возвращает
+    элементы массива "items" сразу, как только закрывается соответствующий JSON-объект.
+    Текст до первой '{' (markdown-ограждения, пояснения) пропускается.
+    """
+
+    def __init__(self, array_key: str = "items"):
+        """
+        Args:
+            array_key: Ключ массива верхнего уровня, элементы которого нужно выдавать
+        """
+        self._array_key = array_key
+        self._text = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        self._item_start = -1
+        self.items_emitted = 0
+
+    @property
+    def text(self) -> str:
+        """Весь полученный на данный момент текст."""
+        return self._text
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Добавляет очередной фрагмент текста и возвращает новые завершенные элементы."""
+        self._text += chunk
+        text = self._text
+        completed: List[Dict[str, Any]] = []
+
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        self._last_string = text[self._string_start + 1:pos]
+                continue
+
+            if not self._stack and char != "{":
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif char == ":":
+                if len(self._stack) == 1:
+                    self._pending_key = self._last_string
+            elif char == ",":
+                if len(self._stack) == 1:
+                    self._pending_key = None
+            elif char in "{[":
+                if char == "[" and len(self._stack) == 1 and self._pending_key == self._array_key:
+                    self._array_depth = 2
+                elif char == "{" and self._array_depth is not None and len(self._stack) == self._array_depth:
+                    self._item_start = pos
+                self._stack.append(char)
+            elif char in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if char == "}" and self._item_start != -1 and len(self._stack) == self._array_depth:
+                    item = self._decode_item(text[self._item_start:pos + 1])
+                    self._item_start = -1
+                    if item is not None:
+                        completed.append(item)
+                elif char == "]" and self._array_depth is not None and len(self._stack) == self._array_depth - 1:
+                    self._array_depth = None
+
+        self._pos = len(text)
+        self.items_emitted += len(completed)
+        return completed
+
+    @staticmethod
+    def _decode_item(raw_item: str) -> Optional[Dict[str, Any]]:
+        """Декодирует один элемент массива; некорректные элементы пропускаются."""
+        try:
+            item = json.loads(raw_item)
+        except json.JSONDecodeError as e:
+            logger.debug(f"Не удалось разобрать элемент из потока: {e}")
+            return None
+        return item if isinstance(item, dict) else None
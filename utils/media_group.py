@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from aiogram.types import Message
+from config.settings import MEDIA_GROUP_WINDOW, MEDIA_GROUP_MAX_PHOTOS
+
+logger = logging.getLogger(__name__)
+
+class MediaGroupCollector:
+    """
+    Собирает сообщения одного альбома (media_group_id).
+
+    Telegram присылает фото альбома отдельными обновлениями с небольшим интервалом.
+    Первый вызов collect() для альбома ждет, пока новые фото перестанут приходить
+    в течение window секунд, и возвращает все сообщения альбома по порядку.
+    Остальные вызовы для того же альбома сразу возвращают None.
+    """
+
+    def __init__(self, window: float = 1.0, max_messages: int = 10):
+        """
+        Args:
+            window: Время тишины в секундах, после которого альбом считается полным
+            max_messages: Максимальное количество сообщений в альбоме
+        """
+        self._window = window
+        self._max_messages = max_messages
+        self._groups: Dict[str, List[Message]] = {}
+        self._events: Dict[str, asyncio.Event] = {}
+
+    async def collect(self, message: Message) -> Optional[List[Message]]:
+        """Добавляет сообщение в альбом; возвращает весь альбом только первому вызову."""
+        group_id = message.media_group_id
+        group = self._groups.get(group_id)
+        if group is not None:
+            if len(group) < self._max_messages:
+                group.append(message)
+                self._events[group_id].set()
+            return None
+
+        group = self._groups[group_id] = [message]
+        event = self._events[group_id] = asyncio.Event()
+        try:
+            while len(group) < self._max_messages:
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=self._window)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            del self._groups[group_id]
+            del self._events[group_id]
+
+        group.sort(key=lambda item: item.message_id)
+        logger.info(f"Альбом {group_id} собран: {len(group)} фото")
+        return group
+
+# Глобальный сборщик альбомов
+media_group_collector = MediaGroupCollector(window=MEDIA_GROUP_WINDOW, max_messages=MEDIA_GROUP_MAX_PHOTOS)
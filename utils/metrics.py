@@ -0,0 +1,64 @@
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator
+
+logger = logging.getLogger(__name__)
+
+class StageMetrics:
+    """
+    Длительности этапов обработки чека (скачивание, кодирование, распознавание и т.д.).
+
+    Для каждого этапа хранится скользящее окно последних замеров, по которому
+    считаются среднее и перцентили. Используется в /api/stats и в бенчмарках.
+    """
+
+    def __init__(self, window: int = 1000):
+        """
+        Args:
+            window: Количество последних замеров, хранимых для каждого этапа
+        """
+        self._window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Замеряет длительность блока как этапа name (в том числе при исключении)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, duration: float) -> None:
+        """Добавляет замер длительности этапа в секундах."""
+        samples = self._samples.get(name)
+        if samples is None:
+            samples = self._samples[name] = deque(maxlen=self._window)
+        samples.append(duration)
+        self._counts[name] = self._counts.get(name, 0) + 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Сводка по этапам в миллисекундах: count, avg_ms, p50_ms, p95_ms, max_ms."""
+        result: Dict[str, Dict[str, float]] = {}
+        for name, samples in self._samples.items():
+            ordered = sorted(samples)
+            last = len(ordered) - 1
+            result[name] = {
+                "count": self._counts[name],
+                "avg_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+                "p50_ms": round(ordered[int(0.5 * last)] * 1000, 2),
+                "p95_ms": round(ordered[int(0.95 * last)] * 1000, 2),
+                "max_ms": round(ordered[last] * 1000, 2),
+            }
+        return result
+
+    def reset(self) -> None:
+        """Сбрасывает все замеры."""
+        self._samples.clear()
+        self._counts.clear()
+
+# Глобальные метрики этапов обработки фото чека
+pipeline_metrics = StageMetrics()
@@ -0,0 +1,92 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Any, List, Optional, Sequence
+
+#: Минимальных единиц (копеек, центов) в одной единице валюты
+MINOR_UNITS = 100
+#: Сотых долей процента в 100%
+BASIS_POINTS = 10000
+
+def _to_decimal(value: Any) -> Optional[Decimal]:
+    """Приводит число или строку ("12,50") к Decimal; нечисловые значения — None."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, Decimal):
+        return value if value.is_finite() else None
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, float):
+        return Decimal(repr(value)) if value == value and value not in (float("inf"), float("-inf")) else None
+    if isinstance(value, str):
+        try:
+            parsed = Decimal(value.strip().replace(",", ".").replace(" ", ""))
+        except InvalidOperation:
+            return None
+        return parsed if parsed.is_finite() else None
+    return None
+
+def to_minor(value: Any) -> Optional[int]:
+    """Сумма (число, Decimal или строка) → целое число минимальных единиц, с округлением до копейки."""
+    amount = _to_decimal(value)
+    if amount is None:
+        return None
+    return int((amount * MINOR_UNITS).to_integral_value(rounding=ROUND_HALF_UP))
+
+def from_minor(value: Optional[int]) -> Optional[Decimal]:
+    """Минимальные единицы → Decimal с двумя знаками после точки."""
+    if value is None:
+        return None
+    return Decimal(value).scaleb(-2)
+
+def to_basis_points(value: Any) -> Optional[int]:
+    """Процент (12.5) → сотые доли процента (1250)."""
+    return to_minor(value)
+
+def from_basis_points(value: Optional[int]) -> Optional[Decimal]:
+    """Сотые доли процента → процент в Decimal."""
+    return from_minor(value)
+
+def apply_basis_points(amount: int, basis_points: int) -> int:
+    """Доля amount в basis_points сотых долях процента, округленная до минимальной единицы (half up)."""
+    numerator = amount * basis_points
+    sign = -1 if numerator < 0 else 1
+    return sign * ((abs(numerator) + BASIS_POINTS // 2) // BASIS_POINTS)
+
+def ratio_basis_points(part: int, whole: int) -> int:
+    """Доля part от whole в сотых долях процента (half up)."""
+    if not whole:
+        return 0
+    numerator = part * BASIS_POINTS
+    sign = -1 if (numerator < 0) != (whole < 0) else 1
+    return sign * ((abs(numerator) + abs(whole) // 2) // abs(whole))
+
+def format_minor(value: int) -> str:
+    """Форматирует сумму в минимальных единицах: 123456 → "1234.56"."""
+    sign = "-" if value < 0 else ""
+    units, cents = divmod(abs(value), MINOR_UNITS)
+    return f"{sign}{units}.{cents:02d}"
+
+def format_percent(basis_points: int) -> str:
+    """Форматирует процент без лишних нулей: 1000 → "10", 1250 → "12.5"."""
+    text = format_minor(basis_points)
+    return text.rstrip("0").rstrip(".")
+
+def allocate(total: int, weights: Sequence[int]) -> List[int]:
+    """
+    Делит total пропорционально неотрицательным весам методом наибольших остатков.
+
+    Каждая доля округляется вниз, оставшиеся минимальные единицы получают доли с
+    наибольшими дробными остатками (при равенстве — первая по порядку), поэтому сумма
+    долей всегда равна total. При нулевой сумме весов все доли нулевые.
+    """
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        return [0] * len(weights)
+    sign = -1 if total < 0 else 1
+    amount = abs(total)
+    shares = [amount * weight // weight_sum for weight in weights]
+    leftover = amount - sum(shares)
+    if leftover:
+        by_remainder = sorted(range(len(weights)), key=lambda i: (-(amount * weights[i] % weight_sum), i))
+        for index in by_remainder[:leftover]:
+            shares[index] += 1
+    return [sign * share for share in shares]
@@ -0,0 +1,339 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, TypeVar
+from models.receipt import ReceiptLine, ReceiptRecord, SelectionValue
+from utils.money import MINOR_UNITS, allocate, apply_basis_points, ratio_basis_points
+
+#: Ключ нераспределенной части чека (позиции, которые никто не выбрал)
+UNCLAIMED = ""
+
+#: Доля позиции: (сумма, скидка, сервисный сбор) в минимальных единицах
+Parts = Tuple[int, int, int]
+_NO_PARTS: Parts = (0, 0, 0)
+
+T = TypeVar("T")
+
+@dataclass(slots=True, frozen=True)
+class Share:
+    """Доля участника в минимальных единицах."""
+    #: индекс позиции → (количество, сумма)
+    items: Dict[int, Tuple[int, int]]
+    items_total: int
+    discount: int
+    service_charge: int
+    total: int
+    #: индекс общей позиции → (вес участника, сумма весов всех делящих, сумма)
+    shared: Dict[int, Tuple[int, int, int]] = field(default_factory=dict)
+
+    def to_api(self) -> Dict[str, Any]:
+        """Доля в формате API; ключи совпадают с summary веб-приложения."""
+        return {
+            "items": {
+                str(index): {"quantity": count, "amount": amount / MINOR_UNITS}
+                for index, (count, amount) in self.items.items()
+            },
+            "shared": {
+                str(index): {"weight": weight, "total_weight": total_weight, "amount": amount / MINOR_UNITS}
+                for index, (weight, total_weight, amount) in self.shared.items()
+            },
+            "items_total": self.items_total / MINOR_UNITS,
+            "discount_amount": self.discount / MINOR_UNITS,
+            "service_amount": self.service_charge / MINOR_UNITS,
+            "final_total": self.total / MINOR_UNITS,
+        }
+
+@dataclass(slots=True, frozen=True)
+class PricingPlan:
+    """
+    Расчет чека, выполняемый один раз после распознавания.
+
+    Хранит стоимость каждой позиции и итоги чека в минимальных единицах. Общая скидка
+    и сервисный сбор сразу распределяются по позициям, поэтому каждая позиция делится
+    между участниками независимо от остальных. Все распределения идут методом
+    наибольших остатков, и доли участников вместе с нераспределенной частью
+    в точности дают итог чека.
+    """
+    line_totals: Tuple[int, ...]
+    #: доля общей скидки и сервисного сбора, приходящаяся на каждую позицию
+    line_discounts: Tuple[int, ...]
+    line_service_charges: Tuple[int, ...]
+    quantities: Tuple[int, ...]
+    items_total: int
+    discount: int
+    service_charge: int
+    total: int
+    #: фактический процент общей скидки в сотых долях процента
+    discount_percent: int
+    service_charge_percent: Optional[int] = None
+
+    @classmethod
+    def from_receipt(cls, receipt: ReceiptRecord) -> "PricingPlan":
+        line_totals = tuple(line_total(item) for item in receipt.items)
+        items_total = sum(line_totals)
+        if receipt.total_discount_amount is not None:
+            discount = receipt.total_discount_amount
+        elif receipt.total_discount_percent is not None:
+            discount = apply_basis_points(items_total, receipt.total_discount_percent)
+        else:
+            discount = 0
+        service_charge = 0
+        if receipt.service_charge_percent is not None:
+            service_charge = apply_basis_points(items_total - discount, receipt.service_charge_percent)
+        # Скидка — пропорционально стоимости позиций, сервисный сбор — от суммы после скидки
+        line_discounts = allocate(discount, [max(amount, 0) for amount in line_totals])
+        line_service_charges = allocate(
+            service_charge,
+            [max(amount - line_discount, 0) for amount, line_discount in zip(line_totals, line_discounts)],
+        )
+        return cls(
+            line_totals=line_totals,
+            line_discounts=tuple(line_discounts),
+            line_service_charges=tuple(line_service_charges),
+            quantities=tuple(max(item.quantity, 1) for item in receipt.items),
+            items_total=items_total,
+            discount=discount,
+            service_charge=service_charge,
+            total=items_total - discount + service_charge,
+            discount_percent=ratio_basis_points(discount, items_total) if items_total > 0 else 0,
+            service_charge_percent=receipt.service_charge_percent,
+        )
+
+    def split(self, selections: Mapping[str, Mapping[str, SelectionValue]]) -> Dict[str, Share]:
+        """
+        Рассчитывает доли всех участников.
+
+        Args:
+            selections: user_id → (индекс позиции → количество), как в user_selections
+
+        Returns:
+            user_id → Share; под ключом UNCLAIMED — часть чека, которую никто не выбрал
+        """
+        return SplitTotals(self, selections).shares()
+
+    def parse_selection(self, selection: Mapping[str, SelectionValue]) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """
+        Разбирает выбор участника; несуществующие позиции и нулевые значения отбрасываются.
+
+        Returns:
+            (индекс → количество штук, индекс → вес в общей позиции)
+        """
+        counts: Dict[int, int] = {}
+        weights: Dict[int, int] = {}
+        for key, value in selection.items():
+            try:
+                index = int(key)
+                if isinstance(value, dict):
+                    target, value = weights, int(value.get("share", 1))
+                else:
+                    target, value = counts, int(value)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= index < len(self.line_totals) and value > 0:
+                target[index] = value
+        return counts, weights
+
+    def allocate_line(self, index: int, counts: Mapping[str, int],
+                      weights: Mapping[str, int]) -> Tuple[Dict[str, Parts], Parts]:
+        """
+        Делит позицию между участниками.
+
+        Сначала участники со штуками получают доли пропорционально количеству; остаток
+        позиции (штуки, которые никто не взял целиком) делится между участниками общей
+        позиции пропорционально весам, а если таких нет — остается невыбранным.
+
+        Returns:
+            (user_id → (сумма, скидка, сервисный сбор), невыбранный остаток позиции)
+        """
+        # Порядок участников фиксирован, чтобы остатки распределялись одинаково при любом порядке выбора
+        users = sorted(counts)
+        unit_weights = [counts[user] for user in users]
+        unit_weights.append(max(self.quantities[index] - sum(unit_weights), 0))
+        components = [
+            allocate(amount, unit_weights)
+            for amount in (self.line_totals[index], self.line_discounts[index], self.line_service_charges[index])
+        ]
+        parts = {user: (components[0][i], components[1][i], components[2][i]) for i, user in enumerate(users)}
+        rest = (components[0][-1], components[1][-1], components[2][-1])
+        if weights:
+            sharers = sorted(weights)
+            shared = [allocate(amount, [weights[user] for user in sharers]) for amount in rest]
+            parts.update({user: (shared[0][i], shared[1][i], shared[2][i]) for i, user in enumerate(sharers)})
+            rest = _NO_PARTS
+        return parts, rest
+
+class SplitTotals:
+    """
+    Доли участников чека, которые поддерживаются при изменении выбора.
+
+    Для каждой позиции хранится, кто и сколько ее выбрал (штуками или долей общей
+    позиции) и как она поделена, а для каждого участника — текущие суммы (позиции,
+    скидка, сервисный сбор). Изменение выбора одной позиции пересчитывает только эту
+    позицию и добавляет разницу к суммам ее участников, поэтому стоимость растет лишь
+    с числом участников этой позиции. Отрисованные итоги участников кэшируются и
+    сбрасываются только у тех, чья доля изменилась.
+    """
+    __slots__ = ("plan", "_counts", "_weights", "_parts", "_unclaimed_parts", "_selected", "_shared",
+                 "_totals", "_unclaimed", "_rendered")
+
+    def __init__(self, plan: PricingPlan, selections: Optional[Mapping[str, Mapping[str, SelectionValue]]] = None):
+        self.plan = plan
+        lines = len(plan.line_totals)
+        #: по позициям: user_id → количество штук, user_id → вес в общей позиции, user_id → доля
+        self._counts: List[Dict[str, int]] = [{} for _ in range(lines)]
+        self._weights: List[Dict[str, int]] = [{} for _ in range(lines)]
+        self._parts: List[Dict[str, Parts]] = [{} for _ in range(lines)]
+        self._unclaimed_parts: List[Parts] = [
+            (plan.line_totals[i], plan.line_discounts[i], plan.line_service_charges[i]) for i in range(lines)
+        ]
+        #: по участникам: выбранные позиции (штуки и веса) и суммы [позиции, скидка, сервисный сбор]
+        self._selected: Dict[str, Dict[int, int]] = {}
+        self._shared: Dict[str, Dict[int, int]] = {}
+        self._totals: Dict[str, List[int]] = {}
+        self._unclaimed = [plan.items_total, plan.discount, plan.service_charge]
+        self._rendered: Dict[str, Any] = {}
+
+        # Начальное заполнение: каждая позиция делится один раз по всем участникам
+        for user, selection in (selections or {}).items():
+            self._selected[user], self._shared[user] = self.plan.parse_selection(selection)
+            self._totals[user] = [0, 0, 0]
+            for index, count in self._selected[user].items():
+                self._counts[index][user] = count
+            for index, weight in self._shared[user].items():
+                self._weights[index][user] = weight
+        for index in range(lines):
+            if self._counts[index] or self._weights[index]:
+                self._reallocate(index)
+
+    def _reallocate(self, index: int) -> None:
+        """Заново делит позицию и переносит разницу в суммы участников."""
+        old_parts = self._parts[index]
+        new_parts, unclaimed = self.plan.allocate_line(index, self._counts[index], self._weights[index])
+        for user in old_parts.keys() | new_parts.keys():
+            old = old_parts.get(user, _NO_PARTS)
+            new = new_parts.get(user, _NO_PARTS)
+            if old != new:
+                totals = self._totals[user]
+                for component in range(3):
+                    totals[component] += new[component] - old[component]
+                self._rendered.pop(user, None)
+        old_unclaimed = self._unclaimed_parts[index]
+        for component in range(3):
+            self._unclaimed[component] += unclaimed[component] - old_unclaimed[component]
+        self._parts[index] = new_parts
+        self._unclaimed_parts[index] = unclaimed
+
+    def _claim(self, user: str, index: int, count: int, weight: int) -> None:
+        """Записывает выбор участника по позиции: штуки или вес в общей позиции (не то и другое)."""
+        selected = self._selected.setdefault(user, {})
+        shared = self._shared.setdefault(user, {})
+        self._totals.setdefault(user, [0, 0, 0])
+        if selected.get(index, 0) == count and shared.get(index, 0) == weight:
+            return
+        for own, line, value in ((selected, self._counts[index], count), (shared, self._weights[index], weight)):
+            if value > 0:
+                own[index] = value
+                line[user] = value
+            else:
+                own.pop(index, None)
+                line.pop(user, None)
+        self._rendered.pop(user, None)
+        self._reallocate(index)
+
+    def set_count(self, user: str, index: int, count: int) -> None:
+        """Меняет количество штук позиции у участника."""
+        self._claim(user, index, max(count, 0), 0)
+
+    def set_weight(self, user: str, index: int, weight: int) -> None:
+        """Меняет вес участника в общей позиции (0 — отказаться от доли)."""
+        self._claim(user, index, 0, max(weight, 0))
+
+    def set_selection(self, user: str, selection: Mapping[str, SelectionValue]) -> None:
+        """Заменяет выбор участника; пересчитываются только изменившиеся позиции."""
+        counts, weights = self.plan.parse_selection(selection)
+        old = self._selected.get(user, {}).keys() | self._shared.get(user, {}).keys()
+        for index in old - counts.keys() - weights.keys():
+            self._claim(user, index, 0, 0)
+        for index in counts.keys() | weights.keys():
+            self._claim(user, index, counts.get(index, 0), weights.get(index, 0))
+
+    def share(self, user: str) -> Share:
+        """Текущая доля участника (нулевая, если он ничего не выбирал)."""
+        if user not in self._totals:
+            return Share(items={}, items_total=0, discount=0, service_charge=0, total=0)
+        items_total, discount, service_charge = self._totals[user]
+        return Share(
+            items={index: (count, self._parts[index][user][0]) for index, count in sorted(self._selected[user].items())},
+            items_total=items_total,
+            discount=discount,
+            service_charge=service_charge,
+            total=items_total - discount + service_charge,
+            shared={
+                index: (weight, sum(self._weights[index].values()), self._parts[index][user][0])
+                for index, weight in sorted(self._shared[user].items())
+            },
+        )
+
+    def unclaimed(self) -> Share:
+        """Часть чека, которую никто не выбрал."""
+        items_total, discount, service_charge = self._unclaimed
+        return Share(items={}, items_total=items_total, discount=discount, service_charge=service_charge,
+                     total=items_total - discount + service_charge)
+
+    def shares(self) -> Dict[str, Share]:
+        """Доли всех участников; под ключом UNCLAIMED — невыбранная часть чека."""
+        shares = {user: self.share(user) for user in self._totals}
+        shares[UNCLAIMED] = self.unclaimed()
+        return shares
+
+    def preview(self, user: str, selection: Mapping[str, SelectionValue]) -> Share:
+        """Доля участника, если бы он выбрал selection; состояние не меняется."""
+        counts, weights = self.plan.parse_selection(selection)
+        items: Dict[int, Tuple[int, int]] = {}
+        shared: Dict[int, Tuple[int, int, int]] = {}
+        totals = [0, 0, 0]
+        for index in sorted(counts.keys() | weights.keys()):
+            line_counts = {other: value for other, value in self._counts[index].items() if other != user}
+            line_weights = {other: value for other, value in self._weights[index].items() if other != user}
+            if index in counts:
+                line_counts[user] = counts[index]
+            else:
+                line_weights[user] = weights[index]
+            parts = self.plan.allocate_line(index, line_counts, line_weights)[0][user]
+            if index in counts:
+                items[index] = (counts[index], parts[0])
+            else:
+                shared[index] = (weights[index], sum(line_weights.values()), parts[0])
+            for component in range(3):
+                totals[component] += parts[component]
+        return Share(items=items, items_total=totals[0], discount=totals[1], service_charge=totals[2],
+                     total=totals[0] - totals[1] + totals[2], shared=shared)
+
+    def rendered(self, user: str, render: Callable[[Share], T]) -> T:
+        """Отрисованный итог участника; render вызывается, только если доля изменилась."""
+        if user not in self._rendered:
+            self._rendered[user] = render(self.share(user))
+        return self._rendered[user]
+
+def line_total(item: ReceiptLine) -> int:
+    """Стоимость позиции с учетом скидки на позицию (total_amount из чека уже ее включает)."""
+    if item.total_amount is not None:
+        return item.total_amount
+    if item.unit_price is None:
+        return 0
+    amount = item.unit_price * item.quantity
+    if item.discount_percent is not None:
+        amount -= apply_basis_points(amount, item.discount_percent)
+    elif item.discount_amount is not None:
+        amount -= item.discount_amount
+    return amount
+
+def pricing_plan(receipt: ReceiptRecord) -> PricingPlan:
+    """Возвращает расчет чека, при первом обращении строит его и сохраняет в записи."""
+    if receipt.pricing is None:
+        receipt.pricing = PricingPlan.from_receipt(receipt)
+    return receipt.pricing
+
+def split_totals(receipt: ReceiptRecord) -> SplitTotals:
+    """Возвращает текущие доли участников чека, при первом обращении строит их по user_selections."""
+    if receipt.totals is None:
+        receipt.totals = SplitTotals(pricing_plan(receipt), receipt.user_selections)
+    return receipt.totals
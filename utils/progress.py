@@ -0,0 +1,80 @@
+import time
+import asyncio
+import logging
+from typing import Optional
+from aiogram.types import Message
+from aiogram.exceptions import TelegramBadRequest
+from config.settings import PROGRESS_EDIT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class ProgressMessage:
+    """
+    Сообщение о ходе обработки с ограничением частоты правок.
+
+    update() можно вызывать сколько угодно часто: правки выполняются в фоне
+    не чаще одного раза в min_interval секунд, промежуточные тексты схлопываются
+    до последнего. close() гарантирует, что после него не придет ни одной
+    промежуточной правки и итоговое сообщение не будет перезаписано.
+    """
+
+    def __init__(self, message: Message, min_interval: float = PROGRESS_EDIT_INTERVAL):
+        """
+        Args:
+            message: Сообщение, которое нужно редактировать
+            min_interval: Минимальный интервал между правками в секундах
+        """
+        self.message = message
+        self._min_interval = min_interval
+        self._pending_text: Optional[str] = None
+        self._last_text: Optional[str] = message.text
+        self._last_edit = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._editing = False
+        self._closed = False
+
+    def update(self, text: str) -> None:
+        """Планирует обновление текста сообщения."""
+        if self._closed:
+            return
+        self._pending_text = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        """Фоновая отправка накопленных правок с учетом интервала."""
+        while self._pending_text is not None and not self._closed:
+            delay = self._last_edit + self._min_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                if self._closed:
+                    return
+
+            text, self._pending_text = self._pending_text, None
+            if text == self._last_text:
+                continue
+
+            self._editing = True
+            try:
+                await self.message.edit_text(text, parse_mode="HTML")
+                self._last_text = text
+            except TelegramBadRequest as e:
+                logger.debug(f"Промежуточная правка сообщения пропущена: {e}")
+            except Exception as e:
+                logger.warning(f"Ошибка при обновлении сообщения о ходе обработки: {e}")
+            finally:
+                self._editing = False
+                self._last_edit = time.monotonic()
+
+    async def close(self) -> None:
+        """Останавливает промежуточные правки, дожидаясь уже отправленной."""
+        self._closed = True
+        task, self._task = self._task, None
+        if task is None or task.done():
+            return
+        if not self._editing:
+            task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
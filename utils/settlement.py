@@ -0,0 +1,157 @@
+import heapq
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Mapping, Tuple
+from models.receipt import ReceiptRecord
+from utils.money import MINOR_UNITS, allocate
+from utils.pricing import UNCLAIMED, split_totals
+
+#: До скольких участников с ненулевым балансом ищется точный минимум переводов (2^n масок)
+EXACT_SETTLEMENT_LIMIT = 12
+
+@dataclass(slots=True, frozen=True)
+class Transfer:
+    """Перевод от должника тому, кто заплатил больше своей доли (в минимальных единицах)."""
+    debtor: str
+    creditor: str
+    amount: int
+
+@dataclass(slots=True, frozen=True)
+class Settlement:
+    """Взаиморасчет по чеку: доли, оплаты, балансы и переводы в минимальных единицах."""
+    shares: Dict[str, int]
+    payments: Dict[str, int]
+    #: оплачено минус доля: > 0 — участнику должны, < 0 — должен он
+    balances: Dict[str, int]
+    transfers: List[Transfer]
+    unclaimed: int
+
+    def to_api(self) -> Dict[str, Any]:
+        """Взаиморасчет в формате API (суммы — обычные числа)."""
+        return {
+            "shares": {user: amount / MINOR_UNITS for user, amount in self.shares.items()},
+            "payments": {user: amount / MINOR_UNITS for user, amount in self.payments.items()},
+            "balances": {user: amount / MINOR_UNITS for user, amount in self.balances.items()},
+            "transfers": [
+                {"from": transfer.debtor, "to": transfer.creditor, "amount": transfer.amount / MINOR_UNITS}
+                for transfer in self.transfers
+            ],
+            "unclaimed": self.unclaimed / MINOR_UNITS,
+        }
+
+def settle(balances: Mapping[str, int]) -> List[Transfer]:
+    """
+    Строит переводы, закрывающие балансы (их сумма должна быть нулевой).
+
+    Для небольших групп ищется точный минимум: участники разбиваются на наибольшее
+    число групп с нулевой суммой, внутри группы из k участников хватает k-1 переводов.
+    Для больших групп — жадный взаимозачет: самый крупный должник платит самому
+    крупному кредитору, остаток возвращается в кучу; не больше n-1 переводов за O(n log n).
+    """
+    nonzero = [(user, amount) for user, amount in sorted(balances.items()) if amount]
+    if len(nonzero) <= EXACT_SETTLEMENT_LIMIT:
+        transfers: List[Transfer] = []
+        for group in _zero_sum_groups(nonzero):
+            transfers.extend(_greedy(group))
+        return transfers
+    return _greedy(nonzero)
+
+def _greedy(balances: List[Tuple[str, int]]) -> List[Transfer]:
+    """Жадный взаимозачет на двух кучах (максимальный кредитор и максимальный должник)."""
+    creditors = [(-amount, user) for user, amount in balances if amount > 0]
+    debtors = [(amount, user) for user, amount in balances if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append(Transfer(debtor=debtor, creditor=creditor, amount=amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return transfers
+
+def _zero_sum_groups(balances: List[Tuple[str, int]]) -> List[List[Tuple[str, int]]]:
+    """
+    Разбивает участников на наибольшее число групп с нулевой суммой (динамика по подмножествам).
+
+    best[mask] — сколько групп с нулевой суммой можно закрыть, добавляя участников mask
+    по одному; группа закрывается, когда сумма добавленных становится нулевой.
+    """
+    count = len(balances)
+    full = (1 << count) - 1
+    sums = [0] * (full + 1)
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        lowest = (mask & -mask).bit_length() - 1
+        sums[mask] = sums[mask & (mask - 1)] + balances[lowest][1]
+        closed = 1 if sums[mask] == 0 else 0
+        best[mask] = max(best[mask ^ (1 << i)] for i in range(count) if mask >> i & 1) + closed
+
+    # Восстанавливаем порядок добавления участников и режем его по нулевым суммам
+    order = []
+    mask = full
+    while mask:
+        closed = 1 if sums[mask] == 0 else 0
+        for i in range(count):
+            if mask >> i & 1 and best[mask ^ (1 << i)] + closed == best[mask]:
+                order.append(i)
+                mask ^= 1 << i
+                break
+    order.reverse()
+
+    groups: List[List[Tuple[str, int]]] = []
+    current: List[Tuple[str, int]] = []
+    running = 0
+    for i in order:
+        current.append(balances[i])
+        running += balances[i][1]
+        if running == 0:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+def confirmed_receipt(receipt: ReceiptRecord) -> ReceiptRecord:
+    """
+    Копия чека, в которой выбраны только подтвержденные позиции участников.
+
+    Выбор берется из user_results (selected_items на момент подтверждения), поэтому
+    неподтвержденный и измененный после подтверждения выбор в расчет не попадает.
+    """
+    selections = {user: dict(result.get("selected_items") or {}) for user, result in receipt.user_results.items()}
+    return replace(receipt, user_selections=selections, totals=None)
+
+def settle_receipt(receipt: ReceiptRecord) -> Settlement:
+    """
+    Взаиморасчет по чеку: доли участников из текущего выбора и оплаты из receipt.payments.
+
+    Оплаты приводятся к итогу чека (распределением пропорционально внесенным суммам),
+    а невыбранная часть чека ложится на плативших в той же пропорции, поэтому сумма
+    балансов всегда нулевая. Без оплат переводы не строятся.
+    """
+    totals = split_totals(receipt)
+    shares = {user: share.total for user, share in totals.shares().items() if user != UNCLAIMED and share.total}
+    unclaimed = totals.unclaimed().total
+
+    payers = sorted(user for user, amount in receipt.payments.items() if amount > 0)
+    payments: Dict[str, int] = {}
+    balances: Dict[str, int] = {}
+    if payers:
+        weights = [receipt.payments[user] for user in payers]
+        payments = dict(zip(payers, allocate(totals.plan.total, weights)))
+        unclaimed_parts = dict(zip(payers, allocate(unclaimed, weights)))
+        for user in shares.keys() | payments.keys():
+            owed = shares.get(user, 0) + unclaimed_parts.get(user, 0)
+            balances[user] = payments.get(user, 0) - owed
+
+    return Settlement(
+        shares=shares,
+        payments=payments,
+        balances=balances,
+        transfers=settle(balances),
+        unclaimed=unclaimed,
+    )
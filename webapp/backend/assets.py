@@ -0,0 +1,216 @@
+"""
+Страницы и статика веб-приложения из памяти процесса.
+
+Файлы читаются один раз (изменения подхватываются после перезапуска). Статические
+ответы сжимаются заранее (gzip и, если установлен пакет brotli, br) и отдаются со
+строгим ETag и Cache-Control; страница чека собирается из шаблона index.html с
+данными чека внутри, поэтому для первой отрисовки хватает одного запроса.
+"""
+import os
+import gzip
+import json
+import hashlib
+import logging
+import mimetypes
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него ответы сжимаются только gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+#: Место в index.html, куда подставляются данные чека
+RECEIPT_MARKER = b"<!--RECEIPT_DATA-->"
+
+#: Кэширование страниц: браузер хранит копию, но перед показом сверяет ETag
+NO_CACHE = "no-cache"
+#: Страница с данными чека: только в браузере пользователя, с проверкой ETag
+PRIVATE_NO_CACHE = "private, no-cache"
+#: Файлы из static/: сутки без запросов, затем проверка ETag
+STATIC_CACHE = "public, max-age=86400"
+
+# Уровни сжатия для ответов, которые собираются на каждый запрос (заранее сжатые — максимальные)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+#: Сколько сжатых страниц чеков держать в памяти (чек открывают несколько участников подряд)
+COMPRESSED_PAGES_CACHE = 256
+
+def accepted_encodings(request: web.Request) -> Tuple[str, ...]:
+    """Кодировки из Accept-Encoding в порядке нашего предпочтения (br, gzip)."""
+    accepted = set()
+    for token in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = token.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return tuple(encoding for encoding in ("br", "gzip") if encoding in accepted and (encoding != "br" or brotli))
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    """Сжимает тело ответа в gzip или br (best — максимальное сжатие для заранее сжатых файлов)."""
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+def etag_for(body: bytes) -> str:
+    """Строгий ETag по содержимому (без кавычек и суффикса кодировки)."""
+    return hashlib.sha256(body).hexdigest()[:32]
+
+def not_modified(request: web.Request, etag: str) -> bool:
+    """Совпадает ли ETag (в кавычках) с If-None-Match запроса."""
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+
+def _respond(request: web.Request, etag: str, content_type: str, cache_control: str,
+             body: bytes, encoding: Optional[str]) -> web.Response:
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if not_modified(request, etag):
+        return web.Response(status=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return web.Response(body=body, content_type=content_type, charset="utf-8" if content_type.startswith("text/") else None,
+                        headers=headers)
+
+@dataclass(slots=True, frozen=True)
+class StaticAsset:
+    """Неизменяемый ответ, заранее сжатый во все поддерживаемые кодировки."""
+    body: bytes
+    content_type: str
+    cache_control: str
+    etag: str
+    encoded: Dict[str, bytes]
+
+    @classmethod
+    def from_bytes(cls, body: bytes, content_type: str, cache_control: str = NO_CACHE) -> "StaticAsset":
+        encodings = ("br", "gzip") if brotli else ("gzip",)
+        return cls(
+            body=body,
+            content_type=content_type,
+            cache_control=cache_control,
+            etag=etag_for(body),
+            encoded={encoding: compress(body, encoding, best=True) for encoding in encodings},
+        )
+
+    def respond(self, request: web.Request) -> web.Response:
+        for encoding in accepted_encodings(request):
+            body = self.encoded.get(encoding)
+            # Сжатие не всегда выгодно (маленькие или уже сжатые файлы)
+            if body is not None and len(body) < len(self.body):
+                return _respond(request, f'"{self.etag}-{encoding}"', self.content_type, self.cache_control, body, encoding)
+        return _respond(request, f'"{self.etag}"', self.content_type, self.cache_control, self.body, None)
+
+def dynamic_response(request: web.Request, body: bytes, content_type: str, cache_control: str = NO_CACHE,
+                     compressed: Optional["OrderedDict[str, bytes]"] = None) -> web.Response:
+    """
+    Ответ, собранный на этот запрос: ETag по содержимому, сжатие после проверки If-None-Match.
+
+    compressed — LRU сжатых тел по ETag, чтобы одинаковые ответы не сжимались повторно.
+    """
+    etag = etag_for(body)
+    encodings = accepted_encodings(request)
+    encoding = encodings[0] if encodings else None
+    if encoding is None:
+        return _respond(request, f'"{etag}"', content_type, cache_control, body, None)
+    tagged = f'"{etag}-{encoding}"'
+    if not_modified(request, tagged):
+        return _respond(request, tagged, content_type, cache_control, b"", encoding)
+    encoded = compressed.get(tagged) if compressed is not None else None
+    if encoded is None:
+        encoded = compress(body, encoding)
+        if compressed is not None:
+            compressed[tagged] = encoded
+            if len(compressed) > COMPRESSED_PAGES_CACHE:
+                compressed.popitem(last=False)
+    else:
+        compressed.move_to_end(tagged)
+    return _respond(request, tagged, content_type, cache_control, encoded, encoding)
+
+def embed_json(data: Any) -> bytes:
+    """JSON для вставки в <script type="application/json"> (без закрывающих тегов и HTML-сущностей)."""
+    text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    text = text.replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026")
+    return text.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029").encode("utf-8")
+
+class PageTemplate:
+    """
+    Страница чека: index.html, разрезанный по RECEIPT_MARKER.
+
+    Без данных чека отдается как статика (страница сама запросит /api/receipt/<id>).
+    """
+
+    def __init__(self, html: bytes):
+        self.page = StaticAsset.from_bytes(html, "text/html")
+        head, marker, tail = html.partition(RECEIPT_MARKER)
+        if not marker:
+            logger.warning("В index.html нет метки данных чека, страница будет загружать чек отдельным запросом")
+            head, tail = html, b""
+        self._head = head
+        self._tail = tail
+        self.embeds = bool(marker)
+        self._compressed: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def render(self, request: web.Request, receipt_data: Dict[str, Any]) -> web.Response:
+        """Страница с данными чека внутри (ответ не кэшируется без проверки ETag)."""
+        if not self.embeds:
+            return self.page.respond(request)
+        body = b"".join((
+            self._head,
+            b'<script id="receiptData" type="application/json">',
+            embed_json(receipt_data),
+            b"</script>",
+            self._tail,
+        ))
+        return dynamic_response(request, body, "text/html", PRIVATE_NO_CACHE, self._compressed)
+
+class FrontendAssets:
+    """Файлы фронтенда в памяти: шаблон страницы чека, тестовая страница и static/."""
+
+    def __init__(self, frontend_dir: str):
+        """
+        Args:
+            frontend_dir: Каталог webapp/frontend
+        """
+        self._frontend_dir = frontend_dir
+        self.receipt_page: Optional[PageTemplate] = None
+        self.test_page: Optional[StaticAsset] = None
+        self.static: Dict[str, StaticAsset] = {}
+
+    def _read(self, *parts: str) -> Optional[bytes]:
+        path = os.path.join(self._frontend_dir, *parts)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def load(self) -> None:
+        """Читает и сжимает файлы (вызывается один раз при регистрации маршрутов)."""
+        test_html = self._read("debug", "test_webapp.html")
+        self.test_page = StaticAsset.from_bytes(test_html, "text/html") if test_html is not None else None
+
+        index_html = self._read("index.html")
+        if index_html is not None:
+            self.receipt_page = PageTemplate(index_html)
+        elif test_html is not None:
+            # Fallback на тестовое приложение
+            self.receipt_page = PageTemplate(test_html)
+        else:
+            logger.error(f"Не найдены ни index.html, ни debug/test_webapp.html в {self._frontend_dir}")
+
+        static_dir = os.path.join(self._frontend_dir, "static")
+        self.static = {}
+        for root, _, files in os.walk(static_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, static_dir).replace(os.sep, "/")
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                with open(path, "rb") as f:
+                    self.static[relative] = StaticAsset.from_bytes(f.read(), content_type, STATIC_CACHE)
+        logger.info(f"Фронтенд загружен в память: страница чека, {len(self.static)} статических файлов")
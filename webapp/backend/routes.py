@@ -0,0 +1,401 @@
+"""
+Нативные aiohttp-обработчики веб-приложения.
+
+Работают в event loop бота и обращаются к хранилищу состояний и журналу
+взаиморасчетов напрямую, без WSGI-моста и пула потоков Flask. Flask-приложение
+(webapp/backend/server.py) остается как запасной вариант (WEBAPP_BACKEND=flask)
+и использует те же операции через state_store.run_sync.
+"""
+import os
+import time
+import logging
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiohttp import web
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
+from aiogram.utils.web_app import safe_parse_webapp_init_data
+from pydantic import ValidationError
+from config.settings import ENVIRONMENT, ENABLE_TEST_COMMANDS, TELEGRAM_BOT_TOKEN, WEBAPP_INIT_DATA_MAX_AGE
+from main import BOT_KEY
+from models.receipt import receipt_changes_to_api, receipt_from_api, receipt_to_api
+from services.state_store import state_store
+from services.ledger import ledger, ledger_name, record_receipt
+from utils.money import MINOR_UNITS, to_minor
+from utils.pricing import Share, split_totals
+from utils.settlement import Settlement, settle, settle_receipt
+from webapp.backend.assets import NO_CACHE, FrontendAssets, not_modified
+
+logger = logging.getLogger(__name__)
+
+webapp_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+frontend_dir = os.path.join(webapp_dir, 'frontend')
+
+# Файлы фронтенда в памяти процесса (загружаются в setup_routes)
+frontend_assets = FrontendAssets(frontend_dir)
+
+#: Префиксы путей, ответы на которые разрешены с любых источников (как CORS(app) во Flask)
+CORS_PREFIXES = ("/api/", "/health")
+
+#: Заголовок с initData веб-приложения Telegram (Telegram.WebApp.initData) для запросов от имени участника
+INIT_DATA_HEADER = "X-Telegram-Init-Data"
+
+# ---------------------------------------------------------------------------
+# Операции над чеками (общие для aiohttp и Flask)
+# ---------------------------------------------------------------------------
+
+async def quote_selection(message_id: int, user_key: str, selection: Dict[str, Any]) -> Optional[Share]:
+    """Доля участника для выбора из веб-приложения без сохранения выбора; None — чека нет."""
+    receipt = await state_store.get(message_id)
+    if receipt is None:
+        return None
+    return split_totals(receipt).preview(user_key, selection)
+
+async def receipt_settlement(message_id: int) -> Optional[Settlement]:
+    """Взаиморасчет по чеку; None — чека нет."""
+    receipt = await state_store.get(message_id)
+    return settle_receipt(receipt) if receipt is not None else None
+
+def authenticated_user_id(init_data: Optional[str]) -> Optional[int]:
+    """
+    Telegram user_id из initData веб-приложения (заголовок X-Telegram-Init-Data).
+
+    Returns:
+        user_id или None, если initData нет, подпись не сходится с токеном бота
+        или данные старше WEBAPP_INIT_DATA_MAX_AGE
+    """
+    if not init_data:
+        return None
+    try:
+        data = safe_parse_webapp_init_data(TELEGRAM_BOT_TOKEN, init_data)
+    except ValueError:
+        return None
+    if data.user is None or time.time() - data.auth_date.timestamp() > WEBAPP_INIT_DATA_MAX_AGE:
+        return None
+    return data.user.id
+
+async def save_payment(message_id: int, user_id: int, amount: int) -> bool:
+    """Сохраняет оплату участника и обновляет вклад чека в журнал; False — чека нет."""
+    if not await state_store.set_payment(message_id, user_id, amount):
+        return False
+    # Оплата меняет балансы чека, поэтому обновляем и его вклад в журнал взаиморасчетов
+    receipt = await state_store.get(message_id)
+    if receipt is not None:
+        await record_receipt(message_id, receipt)
+    return True
+
+async def ledger_summary(chat_id: int, event: Optional[str], user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Балансы и переводы по всем чекам чата или события в формате API.
+
+    Returns:
+        None, если пользователь user_id не участвовал ни в одном чеке журнала
+    """
+    name = ledger_name(chat_id, event)
+    if not await ledger.is_participant(name, str(user_id)):
+        return None
+    balances = await ledger.balances(name)
+    return {
+        "ledger": name,
+        "balances": {user: amount / MINOR_UNITS for user, amount in balances.items()},
+        "transfers": [
+            {"from": transfer.debtor, "to": transfer.creditor, "amount": transfer.amount / MINOR_UNITS}
+            for transfer in settle(balances)
+        ],
+    }
+
+def collect_stats() -> Dict[str, Any]:
+    """Статистика распознавания: кэш, очередь, OpenAI, хранилище, журнал и длительности этапов."""
+    from services.recognition_cache import recognition_cache
+    from services.ocr_scheduler import ocr_scheduler
+    from services.resilience import openai_caller
+    from services.model_router import model_router
+    from services.chat_ownership import chat_ownership
+    from services.http_client import http_client
+    from services.receipt_publisher import receipt_publisher
+    from utils.metrics import pipeline_metrics
+    return {
+        "recognition_cache": recognition_cache.stats(),
+        "ocr_scheduler": ocr_scheduler.stats(),
+        "openai": openai_caller.stats(),
+        "model_router": model_router.stats(),
+        "state_store": state_store.stats(),
+        "chat_ownership": chat_ownership.stats() if chat_ownership is not None else None,
+        "ledger": ledger.stats(),
+        "receipt_publisher": receipt_publisher.stats(),
+        "http_client": http_client.stats(),
+        "pipeline": pipeline_metrics.summary(),
+    }
+
+# ---------------------------------------------------------------------------
+# Страницы
+# ---------------------------------------------------------------------------
+
+async def receipt_app(request: web.Request) -> web.StreamResponse:
+    """Основное приложение для конкретного чека (/app/<message_id>) с данными чека внутри страницы."""
+    page = frontend_assets.receipt_page
+    if page is None:
+        return web.Response(text="Приложение не найдено", status=404)
+    try:
+        receipt = await state_store.get(int(request.match_info["message_id"]))
+    except Exception as e:
+        logger.error(f"Ошибка чтения чека для страницы {request.path}: {e}")
+        receipt = None
+    if receipt is None:
+        # Страница сама запросит /api/receipt/<id> и покажет ошибку
+        return page.page.respond(request)
+    return page.render(request, receipt_to_api(receipt))
+
+async def test_webapp_page(request: web.Request) -> web.StreamResponse:
+    """Тестовый WebApp (только в dev/staging окружениях)."""
+    if not ENABLE_TEST_COMMANDS:
+        logger.warning(f"Попытка доступа к тестовой странице в {ENVIRONMENT} окружении")
+        raise web.HTTPNotFound()
+    if frontend_assets.test_page is None:
+        logger.error("Тестовый файл test_webapp.html не найден")
+        return web.Response(text="Тестовый файл не найден", status=404)
+    return frontend_assets.test_page.respond(request)
+
+async def static_file(request: web.Request) -> web.StreamResponse:
+    """Файлы из frontend/static, заранее сжатые."""
+    asset = frontend_assets.static.get(request.match_info["path"])
+    if asset is None:
+        raise web.HTTPNotFound()
+    return asset.respond(request)
+
+async def health_check(request: web.Request) -> web.Response:
+    """Проверка работоспособности API."""
+    return web.json_response({"status": "ok", "message": "API is running"})
+
+# ---------------------------------------------------------------------------
+# API
+# ---------------------------------------------------------------------------
+
+async def read_json(request: web.Request) -> Optional[Any]:
+    """Тело запроса в JSON или None, если это не JSON."""
+    if request.content_type != 'application/json':
+        return None
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+def api_handler(description: str) -> Callable[[Callable[..., Awaitable[web.StreamResponse]]], Callable[..., Awaitable[web.StreamResponse]]]:
+    """Оборачивает обработчик API: непредвиденная ошибка → 500 с записью в лог."""
+    def decorator(handler: Callable[..., Awaitable[web.StreamResponse]]) -> Callable[..., Awaitable[web.StreamResponse]]:
+        @wraps(handler)
+        async def wrapper(request: web.Request) -> web.StreamResponse:
+            try:
+                return await handler(request)
+            except web.HTTPException:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка {description} ({request.path}): {e}")
+                return web.json_response({"error": "Internal server error"}, status=500)
+        return wrapper
+    return decorator
+
+@api_handler("при получении данных чека")
+async def get_receipt(request: web.Request) -> web.Response:
+    """
+    Данные чека по message_id.
+
+    ETag — версия чека: при совпадении с If-None-Match отвечает 304 без тела.
+    С ?since=<версия> отдает только выборы, итоги и оплаты, измененные после нее
+    (или весь чек, если изменения с этой версии не восстановить).
+    """
+    message_id = int(request.match_info["message_id"])
+    since = request.query.get("since")
+    if since is not None and not since.isdigit():
+        return web.json_response({"error": "Invalid since version"}, status=400)
+    receipt = await state_store.get(message_id)
+    if receipt is None:
+        logger.warning(f"Данные чека не найдены для message_id: {message_id}")
+        return web.json_response({"error": "Receipt data not found"}, status=404)
+    headers = {"ETag": f'"{receipt.version}"', "Cache-Control": NO_CACHE}
+    if not_modified(request, headers["ETag"]):
+        return web.Response(status=304, headers=headers)
+    data = receipt_changes_to_api(receipt, int(since)) if since is not None else None
+    return web.json_response(data if data is not None else receipt_to_api(receipt), headers=headers)
+
+@api_handler("при сохранении данных чека")
+async def put_receipt(request: web.Request) -> web.Response:
+    """Сохранение данных чека по message_id."""
+    message_id = int(request.match_info["message_id"])
+    data = await read_json(request)
+    if data is None:
+        return web.json_response({"error": "Expected JSON data"}, status=400)
+    try:
+        receipt = receipt_from_api(data)
+    except ValidationError as e:
+        logger.warning(f"Некорректные данные чека для message_id {message_id}: {e.error_count()} ошибок")
+        return web.json_response(
+            {"error": "Invalid receipt data", "details": e.errors(include_url=False, include_context=False)},
+            status=400
+        )
+    await state_store.put(message_id, receipt)
+    logger.info(f"Сохранены данные чека для message_id: {message_id}")
+    return web.json_response({"success": True, "message": "Receipt data saved successfully"})
+
+@api_handler("при расчете доли")
+async def quote_receipt_selection(request: web.Request) -> web.Response:
+    """Расчет доли участника для выбора из веб-приложения (без сохранения выбора)."""
+    message_id = int(request.match_info["message_id"])
+    data = await read_json(request)
+    if not isinstance(data, dict):
+        return web.json_response({"error": "Expected JSON data"}, status=400)
+    selection = data.get("selection")
+    if not isinstance(selection, dict):
+        return web.json_response({"error": "Expected selection object"}, status=400)
+
+    share = await quote_selection(message_id, str(data.get("user_id") or "webapp"), selection)
+    if share is None:
+        return web.json_response({"error": "Receipt data not found"}, status=404)
+    return web.json_response(share.to_api())
+
+@api_handler("при расчете взаиморасчета")
+async def get_receipt_settlement(request: web.Request) -> web.Response:
+    """Взаиморасчет по чеку: доли, оплаты, балансы и минимальный набор переводов."""
+    result = await receipt_settlement(int(request.match_info["message_id"]))
+    if result is None:
+        return web.json_response({"error": "Receipt data not found"}, status=404)
+    return web.json_response(result.to_api())
+
+@api_handler("при сохранении оплаты")
+async def post_receipt_payment(request: web.Request) -> web.Response:
+    """
+    Сохранение оплаты участника: {"user_id": ..., "amount": ...} (amount 0 — не платил).
+
+    Оплату может записать только сам участник: нужен initData веб-приложения
+    в заголовке X-Telegram-Init-Data с тем же user_id.
+    """
+    message_id = int(request.match_info["message_id"])
+    auth_user_id = authenticated_user_id(request.headers.get(INIT_DATA_HEADER))
+    if auth_user_id is None:
+        return web.json_response({"error": "Invalid or missing Telegram init data"}, status=401)
+    data = await read_json(request)
+    if not isinstance(data, dict):
+        return web.json_response({"error": "Expected JSON data"}, status=400)
+    try:
+        user_id = int(data.get("user_id"))
+        amount = to_minor(data.get("amount"))
+    except (TypeError, ValueError):
+        return web.json_response({"error": "Expected user_id and amount"}, status=400)
+    if amount is None or amount < 0:
+        return web.json_response({"error": "Expected non-negative amount"}, status=400)
+    if user_id != auth_user_id:
+        return web.json_response({"error": "user_id does not match Telegram init data"}, status=403)
+
+    if not await save_payment(message_id, user_id, amount):
+        return web.json_response({"error": "Receipt data not found"}, status=404)
+    logger.info(f"Сохранена оплата участника {user_id} для message_id: {message_id}")
+    return web.json_response({"success": True})
+
+@api_handler("при расчете журнала")
+async def get_ledger(request: web.Request) -> web.Response:
+    """
+    Балансы и переводы по всем чекам чата или события (?event=<название>).
+
+    Доступны только участникам журнала: нужен initData в заголовке X-Telegram-Init-Data.
+    """
+    chat_id = int(request.match_info["chat_id"])
+    user_id = authenticated_user_id(request.headers.get(INIT_DATA_HEADER))
+    if user_id is None:
+        return web.json_response({"error": "Invalid or missing Telegram init data"}, status=401)
+    summary = await ledger_summary(chat_id, request.query.get("event") or None, user_id)
+    if summary is None:
+        return web.json_response({"error": "Not a participant of this ledger"}, status=403)
+    return web.json_response(summary)
+
+@api_handler("при сборе статистики")
+async def get_stats(request: web.Request) -> web.Response:
+    """Статистика распознавания, хранилища и журнала."""
+    return web.json_response(collect_stats())
+
+async def answer_webapp_query(request: web.Request) -> web.Response:
+    """Ответ на answerWebAppQuery для Inline-кнопок через сессию бота."""
+    data = await read_json(request)
+    if not isinstance(data, dict):
+        return web.json_response({"error": "Expected JSON data"}, status=400)
+    query_id = data.get('query_id')
+    result_data = data.get('data') or {}
+    logger.info(f"Получен answerWebAppQuery: query_id={query_id}")
+    if not query_id:
+        return web.json_response({"error": "query_id is required"}, status=400)
+
+    payload = result_data.get('payload', 'Нет данных') if isinstance(result_data, dict) else result_data
+
+    # Сообщение БЕЗ разметки для Inline-кнопок (избегаем проблем с парсингом)
+    if isinstance(payload, str) and payload.strip() == "Привет":
+        message_text = f"🎉 УСПЕХ! Бот получил сообщение от WebApp!\n\n💬 Сообщение: {payload}\n🔵 Тип кнопки: Inline\n⏰ Время: {time.strftime('%H:%M:%S')}"
+    else:
+        lines = ["✅ Данные от WebApp получены!", "", "🔵 Тип кнопки: Inline"]
+        if isinstance(payload, str):
+            lines.append(f"💬 Сообщение: {payload}")
+        elif isinstance(payload, dict):
+            if 'message' in payload:
+                lines.append(f"💬 Сообщение: {payload['message']}")
+            if 'items' in payload:
+                lines.append(f"📦 Элементы: {payload['items']}")
+            if 'count' in payload:
+                lines.append(f"🔢 Количество: {payload['count']}")
+        lines.append(f"⏰ Время: {time.strftime('%H:%M:%S')}")
+        lines.append("🔧 Источник: test_webapp")
+        message_text = "\n".join(lines)
+
+    result = InlineQueryResultArticle(
+        id=str(int(time.time())),
+        title="✅ Данные получены",
+        description=f"WebApp: {payload if isinstance(payload, str) else 'JSON данные'}",
+        input_message_content=InputTextMessageContent(message_text=message_text, parse_mode=None),
+    )
+    try:
+        await request.app[BOT_KEY].answer_web_app_query(web_app_query_id=query_id, result=result)
+    except TelegramAPIError as e:
+        logger.error(f"Telegram API error: {e}")
+        return web.json_response({"error": f"Telegram API error: {e}"}, status=500)
+    except Exception as e:
+        logger.error(f"Ошибка в answer_webapp_query: {e}")
+        return web.json_response({"error": str(e)}, status=500)
+
+    logger.info("Успешно отправлен answerWebAppQuery")
+    return web.json_response({"success": True, "message": "WebApp query answered successfully"})
+
+# ---------------------------------------------------------------------------
+# Регистрация
+# ---------------------------------------------------------------------------
+
+@web.middleware
+async def cors_middleware(request: web.Request, handler: Callable[[web.Request], Awaitable[web.StreamResponse]]) -> web.StreamResponse:
+    """Разрешает запросы к API с любых источников (preflight OPTIONS отвечается здесь же)."""
+    if not request.path.startswith(CORS_PREFIXES):
+        return await handler(request)
+    if request.method == "OPTIONS":
+        response: web.StreamResponse = web.Response()
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = request.headers.get("Access-Control-Request-Headers", "Content-Type")
+    else:
+        response = await handler(request)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Access-Control-Expose-Headers"] = "ETag"
+    return response
+
+def setup_routes(app: web.Application) -> None:
+    """Регистрирует страницы и API веб-приложения в приложении aiohttp бота."""
+    frontend_assets.load()
+    app.middlewares.append(cors_middleware)
+    router = app.router
+    router.add_get(r"/app/{message_id:\d+}", receipt_app)
+    router.add_get("/test_webapp", test_webapp_page)
+    router.add_get("/test_webapp/", test_webapp_page)
+    router.add_get("/health", health_check)
+    router.add_get("/health/", health_check)
+    router.add_get("/api/stats", get_stats)
+    router.add_get(r"/api/receipt/{message_id:\d+}", get_receipt)
+    router.add_post(r"/api/receipt/{message_id:\d+}", put_receipt)
+    router.add_post(r"/api/receipt/{message_id:\d+}/quote", quote_receipt_selection)
+    router.add_get(r"/api/receipt/{message_id:\d+}/settlement", get_receipt_settlement)
+    router.add_post(r"/api/receipt/{message_id:\d+}/payments", post_receipt_payment)
+    router.add_get(r"/api/ledger/{chat_id:-?\d+}", get_ledger)
+    router.add_post("/api/answer_webapp_query", answer_webapp_query)
+    router.add_get("/static/{path:.+}", static_file)
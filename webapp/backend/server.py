@@ -5,6 +5,8 @@ import time
 from datetime import datetime
 from flask import Flask, request, jsonify, send_file, abort
 from flask_cors import CORS
+from pydantic import ValidationError
+from models.receipt import receipt_from_api, receipt_to_api
 
 # Получаем абсолютный путь к директории webapp
 webapp_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -20,10 +22,10 @@ logger = logging.getLogger(__name__)
 # Middleware для логирования всех запросов
 @app.before_request
 def log_request_info():
-    logger.info(f"Flask: {request.method} {request.path} - URL: {request.url}")
-    logger.info(f"Flask: Headers: {dict(request.headers)}")
+    logger.debug(f"Flask: {request.method} {request.path} - URL: {request.url}")
+    logger.debug(f"Flask: Headers: {dict(request.headers)}")
     if request.is_json:
-        logger.info(f"Flask: JSON data: {request.json}")
+        logger.debug(f"Flask: JSON data: {request.json}")
 
 # Добавляем отладочную информацию о всех зарегистрированных маршрутах
 def log_routes():
@@ -121,20 +123,26 @@ def health_check():
     """Проверка работоспособности API"""
     return jsonify({"status": "ok", "message": "API is running"})
 
+@app.route('/api/stats')
+def service_stats():
+    """Статистика распознавания: кэш (сколько запросов к OpenAI сэкономлено), очередь и длительности этапов"""
+    from webapp.backend.routes import collect_stats
+    return jsonify(collect_stats())
+
 @app.route('/api/receipt/<int:message_id>', methods=['GET', 'POST'])
 def handle_receipt_data(message_id):
     """Получение и сохранение данных чека по message_id"""
     try:
-        # Импортируем message_states из handlers.photo
-        from handlers.photo import message_states
+        from services.state_store import state_store
         
         if request.method == 'GET':
             # Получение данных чека
-            if message_id not in message_states:
+            receipt = state_store.run_sync(state_store.get(message_id))
+            if receipt is None:
                 logger.warning(f"Данные чека не найдены для message_id: {message_id}")
                 return jsonify({"error": "Receipt data not found"}), 404
             
-            receipt_data = message_states[message_id]
+            receipt_data = receipt_to_api(receipt)
             logger.info(f"Отдаю данные чека для message_id: {message_id}")
             
             return jsonify(receipt_data)
@@ -144,8 +152,12 @@ def handle_receipt_data(message_id):
             if not request.is_json:
                 return jsonify({"error": "Expected JSON data"}), 400
             
-            receipt_data = request.json
-            message_states[message_id] = receipt_data
+            try:
+                receipt = receipt_from_api(request.json)
+            except ValidationError as e:
+                logger.warning(f"Некорректные данные чека для message_id {message_id}: {e.error_count()} ошибок")
+                return jsonify({"error": "Invalid receipt data", "details": e.errors(include_url=False, include_context=False)}), 400
+            state_store.run_sync(state_store.put(message_id, receipt))
             logger.info(f"Сохранены данные чека для message_id: {message_id}")
             
             return jsonify({"success": True, "message": "Receipt data saved successfully"})
@@ -154,6 +166,101 @@ def handle_receipt_data(message_id):
         logger.error(f"Ошибка при обработке данных чека: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route('/api/receipt/<int:message_id>/quote', methods=['POST'])
+def quote_receipt_selection(message_id):
+    """Расчет доли участника для выбора из веб-приложения (без сохранения выбора)"""
+    try:
+        from services.state_store import state_store
+        from webapp.backend.routes import quote_selection
+
+        if not request.is_json:
+            return jsonify({"error": "Expected JSON data"}), 400
+        selection = request.json.get("selection")
+        if not isinstance(selection, dict):
+            return jsonify({"error": "Expected selection object"}), 400
+
+        user_key = str(request.json.get("user_id") or "webapp")
+
+        # Доли участников меняются в event loop, поэтому и читаются там же
+        share = state_store.run_sync(quote_selection(message_id, user_key, selection))
+        if share is None:
+            return jsonify({"error": "Receipt data not found"}), 404
+
+        return jsonify(share.to_api())
+
+    except Exception as e:
+        logger.error(f"Ошибка при расчете доли для message_id {message_id}: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/api/receipt/<int:message_id>/settlement')
+def receipt_settlement(message_id):
+    """Взаиморасчет по чеку: доли, оплаты, балансы и минимальный набор переводов"""
+    try:
+        from services.state_store import state_store
+        from webapp.backend.routes import receipt_settlement
+
+        result = state_store.run_sync(receipt_settlement(message_id))
+        if result is None:
+            return jsonify({"error": "Receipt data not found"}), 404
+
+        return jsonify(result.to_api())
+
+    except Exception as e:
+        logger.error(f"Ошибка при расчете взаиморасчета для message_id {message_id}: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/api/receipt/<int:message_id>/payments', methods=['POST'])
+def receipt_payment(message_id):
+    """Сохранение оплаты участника: {"user_id": ..., "amount": ...} (amount 0 — не платил), только с initData участника"""
+    try:
+        from services.state_store import state_store
+        from utils.money import to_minor
+        from webapp.backend.routes import INIT_DATA_HEADER, authenticated_user_id, save_payment
+
+        auth_user_id = authenticated_user_id(request.headers.get(INIT_DATA_HEADER))
+        if auth_user_id is None:
+            return jsonify({"error": "Invalid or missing Telegram init data"}), 401
+        if not request.is_json:
+            return jsonify({"error": "Expected JSON data"}), 400
+        try:
+            user_id = int(request.json.get("user_id"))
+            amount = to_minor(request.json.get("amount"))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Expected user_id and amount"}), 400
+        if amount is None or amount < 0:
+            return jsonify({"error": "Expected non-negative amount"}), 400
+        if user_id != auth_user_id:
+            return jsonify({"error": "user_id does not match Telegram init data"}), 403
+
+        if not state_store.run_sync(save_payment(message_id, user_id, amount)):
+            return jsonify({"error": "Receipt data not found"}), 404
+        logger.info(f"Сохранена оплата участника {user_id} для message_id: {message_id}")
+
+        return jsonify({"success": True})
+
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении оплаты для message_id {message_id}: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/api/ledger/<int(signed=True):chat_id>')
+def ledger_settlement(chat_id):
+    """Балансы и переводы по всем чекам чата или события (?event=<название>), только для участников журнала"""
+    try:
+        from services.state_store import state_store
+        from webapp.backend.routes import INIT_DATA_HEADER, authenticated_user_id, ledger_summary
+
+        user_id = authenticated_user_id(request.headers.get(INIT_DATA_HEADER))
+        if user_id is None:
+            return jsonify({"error": "Invalid or missing Telegram init data"}), 401
+        summary = state_store.run_sync(ledger_summary(chat_id, request.args.get("event") or None, user_id))
+        if summary is None:
+            return jsonify({"error": "Not a participant of this ledger"}), 403
+        return jsonify(summary)
+
+    except Exception as e:
+        logger.error(f"Ошибка при расчете журнала для чата {chat_id}: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
 @app.route('/api/answer_webapp_query', methods=['POST'])
 def answer_webapp_query():
     """API endpoint для answerWebAppQuery (для Inline-кнопок)"""
@@ -177,10 +284,13 @@ def answer_webapp_query():
         try:
             # Здесь нужно вызвать Telegram Bot API answerWebAppQuery
             # Но у нас нет прямого доступа к bot объекту из Flask
-            # Поэтому мы делаем HTTP запрос к Telegram API
+            # Поэтому запрос к Telegram API идет через общий пул соединений: в event loop бота,
+            # а при отдельном запуске Flask — в фоновом loop хранилища (см. StateStore.run_sync)
             
-            import requests
-            import os
+            import aiohttp
+            from config.settings import TELEGRAM_API_URL
+            from services.http_client import http_client
+            from services.state_store import state_store
             
             bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
             if not bot_token:
@@ -202,11 +312,11 @@ def answer_webapp_query():
             }
             
             # Отправляем запрос к Telegram Bot API
-            telegram_url = f"https://api.telegram.org/bot{bot_token}/answerWebAppQuery"
-            response = requests.post(telegram_url, json=telegram_data, timeout=10)
+            telegram_url = f"{(TELEGRAM_API_URL or 'https://api.telegram.org').rstrip('/')}/bot{bot_token}/answerWebAppQuery"
+            status, response_text = state_store.run_sync(http_client.post_json(telegram_url, telegram_data, timeout=10), timeout=15)
             
-            if response.status_code == 200:
-                telegram_result = response.json()
+            if status == 200:
+                telegram_result = json.loads(response_text)
                 if telegram_result.get('ok'):
                     logger.info(f"answerWebAppQuery выполнен успешно для query_id: {query_id}")
                     return jsonify({"success": True, "message": "WebApp query answered successfully"})
@@ -215,10 +325,10 @@ def answer_webapp_query():
                     logger.error(f"Telegram API error: {error_desc}")
                     return jsonify({"error": f"Telegram API error: {error_desc}"}), 500
             else:
-                logger.error(f"HTTP error from Telegram API: {response.status_code}")
-                return jsonify({"error": f"HTTP error: {response.status_code}"}), 500
+                logger.error(f"HTTP error from Telegram API: {status}")
+                return jsonify({"error": f"HTTP error: {status}"}), 500
                 
-        except requests.RequestException as e:
+        except (aiohttp.ClientError, TimeoutError) as e:
             logger.error(f"Ошибка при запросе к Telegram API: {e}")
             return jsonify({"error": f"Request error: {str(e)}"}), 500
         except Exception as e:
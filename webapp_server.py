@@ -7,11 +7,12 @@ import asyncio
 import logging
 import os
 import json
-import aiohttp
 import time
 from aiohttp import web
 from aiohttp_wsgi import WSGIHandler
+from config.settings import TELEGRAM_API_URL, WEBAPP_BACKEND
 from main import create_app
+from services.http_client import http_client
 
 # Настройка логирования
 logging.basicConfig(
@@ -98,26 +99,24 @@ async def test_answer_webapp_query(request):
         logger.debug(f"Отправляю в Telegram API: {json.dumps(telegram_data, ensure_ascii=False, indent=2)}")
         
         # Отправляем answerWebAppQuery
-        telegram_url = f"https://api.telegram.org/bot{bot_token}/answerWebAppQuery"
+        telegram_url = f"{(TELEGRAM_API_URL or 'https://api.telegram.org').rstrip('/')}/bot{bot_token}/answerWebAppQuery"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(telegram_url, json=telegram_data, timeout=10) as response:
-                response_text = await response.text()
-                logger.debug(f"Telegram API response: status={response.status}, body={response_text}")
-                
-                if response.status == 200:
-                    telegram_result = await response.json()
-                    if telegram_result.get('ok'):
-                        logger.info("Успешно отправлен answerWebAppQuery")
-                        return web.json_response({"success": True, "message": "WebApp query answered successfully"})
-                    else:
-                        error_desc = telegram_result.get('description', 'Unknown error')
-                        logger.error(f"Telegram API error: {error_desc}")
-                        return web.json_response({"error": f"Telegram API error: {error_desc}"}, status=500)
-                else:
-                    logger.error(f"HTTP error from Telegram API: {response.status}")
-                    logger.error(f"Response body: {response_text}")
-                    return web.json_response({"error": f"HTTP error: {response.status}"}, status=500)
+        status, response_text = await http_client.post_json(telegram_url, telegram_data, timeout=10)
+        logger.debug(f"Telegram API response: status={status}, body={response_text}")
+        
+        if status == 200:
+            telegram_result = json.loads(response_text)
+            if telegram_result.get('ok'):
+                logger.info("Успешно отправлен answerWebAppQuery")
+                return web.json_response({"success": True, "message": "WebApp query answered successfully"})
+            else:
+                error_desc = telegram_result.get('description', 'Unknown error')
+                logger.error(f"Telegram API error: {error_desc}")
+                return web.json_response({"error": f"Telegram API error: {error_desc}"}, status=500)
+        else:
+            logger.error(f"HTTP error from Telegram API: {status}")
+            logger.error(f"Response body: {response_text}")
+            return web.json_response({"error": f"HTTP error: {status}"}, status=500)
                     
     except Exception as e:
         logger.error(f"Ошибка в test_answer_webapp_query: {e}")
@@ -161,7 +160,15 @@ class PrefixedWSGIHandler(WSGIHandler):
 async def init_app() -> web.Application:
     app = await create_app()  # aiogram routes inside
 
-    # ---- direct JSON endpoint ------------------------------------------------
+    if WEBAPP_BACKEND != "flask":
+        # Страницы и API обрабатываются прямо в event loop бота
+        if WEBAPP_BACKEND != "aiohttp":
+            logger.warning(f"Неизвестный WEBAPP_BACKEND '{WEBAPP_BACKEND}', используется aiohttp")
+        from webapp.backend.routes import setup_routes
+        setup_routes(app)
+        return app
+
+    # ---- legacy: Flask через WSGI ---------------------------------------------
     app.router.add_post("/api/answer_webapp_query", test_answer_webapp_query)
 
     # ---- import Flask --------------------------------------------------------